@@ -0,0 +1,76 @@
+"""added full text search index for image texts
+
+Revision ID: d7526a63b3f3
+Revises: eb14dd47366a
+Create Date: 2026-10-17 10:12:41.228416
+
+"""
+import logging
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd7526a63b3f3'
+down_revision = 'eb14dd47366a'
+branch_labels = None
+depends_on = None
+
+LOGGER = logging.getLogger(__name__)
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE images_fts USING fts5(text, content='images', content_rowid='id')",
+    """CREATE TRIGGER images_fts_insert AFTER INSERT ON images BEGIN
+        INSERT INTO images_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER images_fts_delete AFTER DELETE ON images BEGIN
+        INSERT INTO images_fts(images_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER images_fts_update AFTER UPDATE OF text ON images BEGIN
+        INSERT INTO images_fts(images_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO images_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    "INSERT INTO images_fts(images_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS images_fts_update",
+    "DROP TRIGGER IF EXISTS images_fts_delete",
+    "DROP TRIGGER IF EXISTS images_fts_insert",
+    "DROP TABLE IF EXISTS images_fts",
+]
+
+POSTGRESQL_UPGRADE = [
+    "CREATE INDEX ix_images_text_fts ON images USING gin (to_tsvector('simple', coalesce(text, '')))",
+]
+
+POSTGRESQL_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_images_text_fts",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        try:
+            for statement in SQLITE_UPGRADE:
+                op.execute(statement)
+        except Exception as ex:
+            # FTS5 is an optional sqlite extension, text search falls back to ILIKE without it
+            LOGGER.warning("Unable to create FTS5 index, full text search will not be available: {}".format(ex))
+            for statement in SQLITE_DOWNGRADE:
+                op.execute(statement)
+    elif dialect == "postgresql":
+        for statement in POSTGRESQL_UPGRADE:
+            op.execute(statement)
+    else:
+        LOGGER.warning("No full text search index available for dialect: {}".format(dialect))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == "postgresql":
+        for statement in POSTGRESQL_DOWNGRADE:
+            op.execute(statement)
@@ -0,0 +1,64 @@
+"""
+Simple benchmark measuring image data read throughput of the image data stores
+with an increasing number of concurrent reader threads.
+"Global lock" wraps the file store in a single lock like it was used before.
+
+Usage: python benchmark_image_data_store.py [image_count] [reads_per_thread]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from infinitewisdom.persistence.image_persistence import FileImageDataStore
+from infinitewisdom.persistence.packed_image_persistence import PackedImageDataStore
+from infinitewisdom.util import create_hash
+
+image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+reads_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+thread_counts = [1, 2, 4, 8, 16]
+
+base_path = tempfile.mkdtemp()
+file_store = FileImageDataStore(os.path.join(base_path, "files"))
+packed_store = PackedImageDataStore(os.path.join(base_path, "packed"))
+
+print("Creating {} images in {}...".format(image_count, base_path))
+hashes = []
+for _ in range(image_count):
+    image_data = os.urandom(random.randint(50, 150) * 1024)
+    image_hash = create_hash(image_data)
+    file_store.put(image_hash, image_data)
+    packed_store.put(image_hash, image_data)
+    hashes.append(image_hash)
+
+global_lock = Lock()
+
+
+def get_with_global_lock(image_hash):
+    with global_lock:
+        return file_store.get(image_hash)
+
+
+def read(get):
+    for image_hash in random.choices(hashes, k=reads_per_thread):
+        get(image_hash)
+
+
+def benchmark(name, get):
+    for thread_count in thread_counts:
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            start = time.perf_counter()
+            futures = [executor.submit(read, get) for _ in range(thread_count)]
+            for future in futures:
+                future.result()
+            duration = time.perf_counter() - start
+        print("{} ({} threads): {:.0f} reads/s".format(name, thread_count, thread_count * reads_per_thread / duration))
+
+
+benchmark("Global lock", get_with_global_lock)
+benchmark("FileImageDataStore", file_store.get)
+benchmark("PackedImageDataStore", packed_store.get)
@@ -0,0 +1,54 @@
+"""
+Simple benchmark comparing random image selection using "ORDER BY random()"
+with the in-memory RandomIdIndex used by ImageDataPersistence.
+
+Usage: python benchmark_random_selection.py [entity_count] [iterations]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from infinitewisdom.persistence.random_index import RandomIdIndex
+from infinitewisdom.persistence.sqlalchemy import Base, Image, SQLAlchemyPersistence, _sessionmaker, _session_scope
+
+entity_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+page_size = 16
+
+db_file = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+engine = create_engine("sqlite:///{}".format(db_file))
+Base.metadata.create_all(engine)
+_sessionmaker.configure(bind=engine)
+
+print("Creating {} entities in {}...".format(entity_count, db_file))
+now = time.time()
+with engine.begin() as connection:
+    connection.execute(Image.__table__.insert(), [
+        {"url": "https://generated.inspirobot.me/a/{}.jpg".format(i), "created": now, "image_hash": str(i)}
+        for i in range(entity_count)
+    ])
+
+
+def benchmark(name, func):
+    with _session_scope(False) as session:
+        func(session)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func(session)
+        duration = time.perf_counter() - start
+    print("{}: {:.3f} ms per call".format(name, duration / iterations * 1000))
+
+
+with _session_scope(False) as session:
+    start = time.perf_counter()
+    index = RandomIdIndex(SQLAlchemyPersistence.get_all_ids(session))
+    print("Building index: {:.3f} s".format(time.perf_counter() - start))
+
+benchmark("ORDER BY random() (single)", lambda s: SQLAlchemyPersistence.get_random(s))
+benchmark("RandomIdIndex (single)", lambda s: SQLAlchemyPersistence.get_by_ids(s, index.sample(1)))
+benchmark("ORDER BY random() (page)", lambda s: SQLAlchemyPersistence.get_random(s, page_size))
+benchmark("RandomIdIndex (page)", lambda s: SQLAlchemyPersistence.get_by_ids(s, index.sample(page_size)))
@@ -0,0 +1,58 @@
+"""
+Simple benchmark comparing the text recognition throughput of the pytesseract based analyser
+(one tesseract process per image) with the tesserocr based analyser (long-lived API handle).
+
+Usage: python benchmark_tesseract.py [image_folder] [image_count]
+"""
+
+import glob
+import os
+import sys
+import time
+
+from infinitewisdom.analysis.tesseract import Tesseract
+from infinitewisdom.analysis.tesseract_api import TesseractApi
+from infinitewisdom.config.config import AppConfig
+
+if len(sys.argv) > 1:
+    image_folder = sys.argv[1]
+else:
+    image_folder = AppConfig(validate=False).FILE_PERSISTENCE_BASE_PATH.value
+image_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+image_files = sorted(glob.glob(os.path.join(image_folder, "**", "*.jp*g"), recursive=True))[:image_count]
+if len(image_files) <= 0:
+    print("No images found in {}".format(image_folder))
+    sys.exit(1)
+
+images = []
+for image_file in image_files:
+    with open(image_file, 'rb') as f:
+        images.append(f.read())
+print("Loaded {} images from {}".format(len(images), image_folder))
+
+
+def benchmark(name, create_analyser):
+    try:
+        analyser = create_analyser()
+        # warm up
+        analyser.find_text(images[0])
+    except ImportError as e:
+        print("{}: not available ({})".format(name, e))
+        return None
+
+    start = time.perf_counter()
+    texts = list(map(analyser.find_text, images))
+    duration = time.perf_counter() - start
+    print("{}: {:.2f} images/s ({:.1f} ms per image)".format(name, len(images) / duration,
+                                                             duration / len(images) * 1000))
+    return texts
+
+
+pytesseract_texts = benchmark("pytesseract", Tesseract)
+tesserocr_texts = benchmark("tesserocr", TesseractApi)
+
+if pytesseract_texts is not None and tesserocr_texts is not None:
+    equal = len(list(filter(lambda x: (x[0] or "").strip() == (x[1] or "").strip(),
+                            zip(pytesseract_texts, tesserocr_texts))))
+    print("Identical results: {}/{}".format(equal, len(images)))
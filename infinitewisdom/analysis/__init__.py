@@ -15,6 +15,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+class AnalysisError(Exception):
+    """
+    Error analysing a single image, returned by find_text_batch in place of the text of that image
+    """
+    pass
+
+
 class ImageAnalyser:
     """
     Base class for image analysis
@@ -26,6 +33,13 @@ class ImageAnalyser:
         """
         raise NotImplementedError()
 
+    def get_version(self) -> str:
+        """
+        :return: the version of this analyser, which has to be changed whenever its results change
+        (f.ex. because of different preprocessing) to invalidate cached results
+        """
+        return "1"
+
     def get_quality(self) -> float:
         """
         :return: the quality of this analyser compared to other implementations
@@ -38,10 +52,53 @@ class ImageAnalyser:
         """
         raise NotImplementedError()
 
+    def is_cpu_bound(self) -> bool:
+        """
+        :return: True if this analyser does the analysis on its own (instead of calling a remote service),
+        in which case it is run in a separate process
+        """
+        return False
+
+    def get_max_concurrency(self) -> int:
+        """
+        :return: the maximum number of concurrent requests to this analyser, 0 to run analyses
+        in the analysis thread (or the process pool if the analyser is CPU bound)
+        """
+        return 0
+
+    def get_input_format(self) -> str:
+        """
+        :return: the image representation passed to find_text, see infinitewisdom.analysis.preprocessing
+        """
+        from infinitewisdom.analysis.preprocessing import INPUT_FORMAT_JPEG
+        return INPUT_FORMAT_JPEG
+
     def find_text(self, image: bytes) -> str or None:
         """
         Analyses the given image
-        :param image: the image to analyse
-        :return: recognized text
+        :param image: the image to analyse in the format returned by get_input_format()
+        :return: recognized text, None if the image doesn't contain any text
+        :raises Exception: if the image could not be analysed
         """
         raise NotImplementedError()
+
+    def get_batch_size(self) -> int:
+        """
+        :return: the maximum number of images that can be analysed using a single call to find_text_batch
+        """
+        return 1
+
+    def find_text_batch(self, images: [bytes]) -> [str or None or AnalysisError]:
+        """
+        Analyses multiple images at once
+        :param images: the images to analyse, at most get_batch_size() images
+        :return: recognized text for each image, in the same order as the given images,
+        or an AnalysisError for images that could not be analysed
+        """
+        texts = []
+        for image in images:
+            try:
+                texts.append(self.find_text(image))
+            except Exception as ex:
+                texts.append(AnalysisError(str(ex)))
+        return texts
@@ -0,0 +1,122 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import heapq
+import itertools
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+
+# first element of the sort key of images added using push(), so they are analysed before any other image
+PRIORITY_HIGH = 0
+
+
+class AnalysisQueue:
+    """
+    Thread safe priority queue of image ids waiting for analysis.
+
+    Images with suboptimal analysis are loaded from the persistence page by page (in the order
+    provided by the persistence) whenever all previously loaded ones have been taken. Images pushed
+    explicitly (f.ex. newly crawled ones) are taken before any of them.
+    """
+
+    def __init__(self, persistence, target_quality: float, page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        :param persistence: persistence to load images with suboptimal analysis from
+        :param target_quality: the target quality to reach
+        :param page_size: number of images to load at once
+        """
+        self._persistence = persistence
+        self._target_quality = target_quality
+        self._page_size = page_size
+
+        self._lock = threading.Lock()
+        # (sort key, image id)
+        self._heap = []
+        # ids of all images in the heap
+        self._queued = set()
+        # ids of pushed images that have already been taken during the current pass through the persistence
+        self._taken = set()
+        # number of images in the heap that have been loaded from the persistence
+        self._loaded = 0
+        # sort key of the last image loaded from the persistence
+        self._cursor = None
+        self._exhausted = False
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def push(self, image_id: int):
+        """
+        Adds an image with high priority
+        :param image_id: entity id
+        """
+        with self._lock:
+            self._queued.add(image_id)
+            heapq.heappush(self._heap, ((PRIORITY_HIGH, next(self._counter)), image_id))
+
+    def pop(self, session) -> int or None:
+        """
+        Takes the image id with the highest priority, loading the next page from the persistence if necessary
+        :return: entity id or None if there are no more images to analyse
+        """
+        with self._lock:
+            while True:
+                if self._loaded <= 0 and not self._exhausted:
+                    self._load_next_page(session)
+                if len(self._heap) <= 0:
+                    return None
+
+                key, image_id = heapq.heappop(self._heap)
+                if key[0] != PRIORITY_HIGH:
+                    self._loaded -= 1
+                elif image_id in self._queued:
+                    self._taken.add(image_id)
+                if image_id in self._queued:
+                    self._queued.remove(image_id)
+                    return image_id
+                # the image has been queued multiple times and was already taken
+
+    def restart(self):
+        """
+        Starts loading images from the persistence from the beginning again
+        """
+        with self._lock:
+            self._cursor = None
+            self._exhausted = False
+            self._taken.clear()
+
+    def _load_next_page(self, session):
+        """
+        Loads the next page of images with suboptimal analysis from the persistence
+        """
+        page = self._persistence.find_non_optimal(session, self._target_quality, self._cursor, self._page_size)
+        if len(page) < self._page_size:
+            self._exhausted = True
+        if len(page) <= 0:
+            return
+
+        self._cursor = page[-1][0]
+        for key, image_id in page:
+            if image_id in self._taken:
+                continue
+            self._queued.add(image_id)
+            heapq.heappush(self._heap, (key, image_id))
+            self._loaded += 1
+        LOGGER.debug("Loaded {} images with suboptimal analysis".format(len(page)))
@@ -0,0 +1,100 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from infinitewisdom.analysis import ImageAnalyser
+
+LOGGER = logging.getLogger(__name__)
+
+# time period in seconds the monthly capacity of an analyser applies to
+CAPACITY_PERIOD = 60 * 60 * 24 * 31
+
+
+class AnalyserCapacityLedger:
+    """
+    Keeps track of the usage of image analysers within the last CAPACITY_PERIOD in memory.
+
+    The usage is loaded from the persistence once and then updated for every analysis,
+    so checking the remaining capacity of an analyser doesn't need any database query.
+    """
+
+    def __init__(self, session, persistence, analysers: [ImageAnalyser]):
+        """
+        :param persistence: persistence to load the past usage from
+        :param analysers: the analysers to keep track of
+        """
+        self._lock = threading.Lock()
+        # analyser identifier -> ascending timestamps of analyses
+        self._usage = {}
+
+        since = time.time() - CAPACITY_PERIOD
+        for analyser in analysers:
+            if math.isinf(analyser.get_monthly_capacity()):
+                # no need to keep track
+                timestamps = []
+            else:
+                timestamps = sorted(persistence.get_analysis_timestamps(session, analyser.get_identifier(), since))
+            self._usage[analyser.get_identifier()] = deque(timestamps)
+            LOGGER.debug("Analyser '{}' has been used {} times in the current period".format(
+                analyser.get_identifier(), len(timestamps)))
+
+    def record(self, analyser: ImageAnalyser, count: int = 1):
+        """
+        Records the usage of an analyser
+        :param analyser: the analyser used
+        :param count: number of analysed images
+        """
+        if math.isinf(analyser.get_monthly_capacity()):
+            return
+
+        now = time.time()
+        with self._lock:
+            usage = self._usage.setdefault(analyser.get_identifier(), deque())
+            usage.extend([now] * count)
+
+    def release(self, analyser: ImageAnalyser, count: int = 1):
+        """
+        Takes back recorded usage of an analyser that has not been used after all
+        :param analyser: the analyser
+        :param count: number of images that have not been analysed
+        """
+        if math.isinf(analyser.get_monthly_capacity()):
+            return
+
+        with self._lock:
+            usage = self._usage.setdefault(analyser.get_identifier(), deque())
+            for _ in range(min(count, len(usage))):
+                usage.pop()
+
+    def get_remaining(self, analyser: ImageAnalyser) -> float:
+        """
+        :param analyser: the analyser to check
+        :return: the remaining capacity of the analyser
+        """
+        capacity = analyser.get_monthly_capacity()
+        if math.isinf(capacity):
+            return capacity
+
+        since = time.time() - CAPACITY_PERIOD
+        with self._lock:
+            usage = self._usage.setdefault(analyser.get_identifier(), deque())
+            while len(usage) > 0 and usage[0] <= since:
+                usage.popleft()
+            return capacity - len(usage)
@@ -0,0 +1,158 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+
+import numpy as np
+
+from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.preprocessing import PreprocessedImage
+from infinitewisdom.stats import IMAGE_ANALYSIS_IN_FLIGHT, ANALYSER_FIND_TEXT_TIME
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _find_text(analyser: ImageAnalyser, image: bytes or np.ndarray) -> str or None:
+    """
+    Runs an analysis inside of a worker process
+    :param analyser: the analyser to use
+    :param image: the image to analyse in the format required by the analyser
+    :return: recognized text
+    """
+    return analyser.find_text(image)
+
+
+def _find_text_batch(analyser: ImageAnalyser, images: [PreprocessedImage]) -> [str or None]:
+    """
+    Runs a (batch) analysis inside of a worker thread
+    :param analyser: the analyser to use
+    :param images: the images to analyse, at most get_batch_size() images
+    :return: recognized text for each image
+    """
+    return analyser.find_text_batch(list(map(lambda x: x.get(analyser.get_input_format()), images)))
+
+
+class AnalysisProcessPool:
+    """
+    Runs CPU bound image analysers in separate processes.
+    Only the image (in the format required by the analyser) is passed to a worker process
+    and only the recognized text is passed back.
+    """
+
+    def __init__(self, processes: int):
+        """
+        :param processes: number of worker processes
+        """
+        self._processes = processes
+        # worker processes are spawned instead of forked since the parent process is running lots of threads
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        LOGGER.debug("Started analysis process pool with {} processes".format(processes))
+
+    def get_process_count(self) -> int:
+        """
+        :return: the number of worker processes
+        """
+        return self._processes
+
+    def submit(self, analyser: ImageAnalyser, image: bytes or np.ndarray) -> Future:
+        """
+        Schedules the analysis of an image
+        :param analyser: the analyser to use, it has to be picklable
+        :param image: the image to analyse in the format required by the analyser
+        :return: future resolving to the recognized text
+        """
+        future = self._executor.submit(_find_text, analyser, image)
+
+        # metrics observed by the analyser itself are only visible in the worker process,
+        # so the time until the result arrives is observed here instead
+        find_text_time = ANALYSER_FIND_TEXT_TIME.labels(name=analyser.get_identifier())
+        submitted = time.monotonic()
+
+        def observe(done: Future):
+            if not done.cancelled():
+                find_text_time.observe(time.monotonic() - submitted)
+
+        future.add_done_callback(observe)
+        return future
+
+    def shutdown(self):
+        """
+        Stops all worker processes, pending analyses are cancelled
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AnalysisThreadPool:
+    """
+    Runs analysers calling remote services concurrently, so a single slow request doesn't block
+    other analyses. Every analyser gets its own threads, limited to get_max_concurrency() requests.
+    """
+
+    def __init__(self, analysers: [ImageAnalyser]):
+        """
+        :param analysers: the analysers to run, analysers with a max concurrency of 0 are ignored
+        """
+        self._lock = threading.Lock()
+        # analyser identifier -> executor
+        self._executors = {}
+        # analyser identifier -> number of requests submitted but not yet finished
+        self._in_flight = {}
+        for analyser in filter(lambda x: x.get_max_concurrency() > 0, analysers):
+            identifier = analyser.get_identifier()
+            self._executors[identifier] = ThreadPoolExecutor(max_workers=analyser.get_max_concurrency(),
+                                                             thread_name_prefix="analysis-{}".format(identifier))
+            self._in_flight[identifier] = 0
+            LOGGER.debug("Running up to {} concurrent requests of '{}'".format(
+                analyser.get_max_concurrency(), identifier))
+
+    def supports(self, analyser: ImageAnalyser) -> bool:
+        """
+        :param analyser: the analyser
+        :return: True if this pool runs the given analyser
+        """
+        return analyser.get_identifier() in self._executors
+
+    def submit(self, analyser: ImageAnalyser, images: [PreprocessedImage]) -> Future:
+        """
+        Schedules the analysis of a batch of images, the representation required by the analyser
+        is created in the worker thread
+        :param analyser: the analyser to use
+        :param images: the images to analyse, at most get_batch_size() images
+        :return: future resolving to the recognized text of each image
+        """
+        identifier = analyser.get_identifier()
+        with self._lock:
+            self._in_flight[identifier] += 1
+            IMAGE_ANALYSIS_IN_FLIGHT.labels(name=identifier).set(self._in_flight[identifier])
+
+        future = self._executors[identifier].submit(_find_text_batch, analyser, images)
+        future.add_done_callback(lambda x: self._on_done(identifier))
+        return future
+
+    def _on_done(self, identifier: str):
+        with self._lock:
+            self._in_flight[identifier] -= 1
+            IMAGE_ANALYSIS_IN_FLIGHT.labels(name=identifier).set(self._in_flight[identifier])
+
+    def shutdown(self):
+        """
+        Stops all threads, requests that haven't been started yet are cancelled
+        """
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
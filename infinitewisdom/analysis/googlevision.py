@@ -14,8 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from infinitewisdom.analysis import ImageAnalyser
-from infinitewisdom.stats import GOOGLE_VISION_FIND_TEXT_TIME
+from infinitewisdom.analysis import ImageAnalyser, AnalysisError
+from infinitewisdom.stats import GOOGLE_VISION_FIND_TEXT_TIME, GOOGLE_VISION_FIND_TEXT_BATCH_TIME
+
+# maximum number of images per batch_annotate_images request
+MAX_BATCH_SIZE = 16
+# vision.Feature.Type.TEXT_DETECTION
+FEATURE_TYPE_TEXT_DETECTION = 5
 
 
 class GoogleVision(ImageAnalyser):
@@ -23,14 +28,15 @@ class GoogleVision(ImageAnalyser):
     Google Vision API implementation
     """
 
-    def __init__(self, auth_file_path: str, monthly_capacity: float = None):
+    def __init__(self, auth_file_path: str, monthly_capacity: float = None, batch_size: int = MAX_BATCH_SIZE,
+                 concurrency: int = 0, client=None):
         """
         :param auth_file_path: authentication file for the google vision api
         :param monthly_capacity: custom monthly capacity (optional)
+        :param batch_size: maximum number of images analysed in a single request
+        :param concurrency: maximum number of concurrent requests, 0 to run requests in the analysis thread
+        :param client: the client to use (optional), by default a client is created using the auth file
         """
-        # Imports the Google Cloud client library
-        from google.cloud import vision
-
         self._auth_file_path = auth_file_path
 
         if monthly_capacity is None:
@@ -38,8 +44,16 @@ class GoogleVision(ImageAnalyser):
         else:
             self._monthly_capacity = float(monthly_capacity)
 
-        # Instantiates a client
-        self._client = vision.ImageAnnotatorClient.from_service_account_file(auth_file_path)
+        self._batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self._concurrency = concurrency
+
+        if client is None:
+            # Imports the Google Cloud client library
+            from google.cloud import vision
+
+            # Instantiates a client
+            client = vision.ImageAnnotatorClient.from_service_account_file(auth_file_path)
+        self._client = client
 
     def get_identifier(self) -> str:
         from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_GOOGLE_VISION
@@ -51,6 +65,9 @@ class GoogleVision(ImageAnalyser):
     def get_monthly_capacity(self) -> float:
         return self._monthly_capacity
 
+    def get_max_concurrency(self) -> int:
+        return self._concurrency
+
     @GOOGLE_VISION_FIND_TEXT_TIME.time()
     def find_text(self, image: bytes):
         from google.cloud import vision
@@ -59,9 +76,41 @@ class GoogleVision(ImageAnalyser):
 
         # Performs label detection on the image file
         response = self._client.text_detection(image=image)
+        return self._get_text(response)
 
+    def get_batch_size(self) -> int:
+        return self._batch_size
+
+    @GOOGLE_VISION_FIND_TEXT_BATCH_TIME.time()
+    def find_text_batch(self, images: [bytes]) -> [str or None or AnalysisError]:
+        if len(images) > self._batch_size:
+            raise ValueError("Batch too large: {} > {}".format(len(images), self._batch_size))
+
+        requests = list(map(lambda x: {
+            "image": {"content": x},
+            "features": [{"type_": FEATURE_TYPE_TEXT_DETECTION}]
+        }, images))
+        response = self._client.batch_annotate_images(requests=requests)
+
+        texts = []
+        for image_response in response.responses:
+            # a failed image doesn't affect the results of the other images of the batch
+            try:
+                texts.append(self._get_text(image_response))
+            except AnalysisError as ex:
+                texts.append(ex)
+        return texts
+
+    @staticmethod
+    def _get_text(response) -> str or None:
+        """
+        Extracts the detected text of a single image
+        :param response: the annotation response of the image
+        :return: the detected text
+        :raises AnalysisError: if the image could not be analysed
+        """
         if response.error.message:
-            raise Exception(
+            raise AnalysisError(
                 '{}\nFor more info on error messages, check: '
                 'https://cloud.google.com/apis/design/errors'.format(
                     response.error.message))
@@ -14,11 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import requests
-
 from infinitewisdom.analysis import ImageAnalyser
-from infinitewisdom.const import REQUESTS_TIMEOUT
 from infinitewisdom.stats import MICROSOFT_AZURE_FIND_TEXT_TIME
+from infinitewisdom.util import HTTP_CLIENT
 
 
 class AzureComputerVision(ImageAnalyser):
@@ -26,14 +24,17 @@ class AzureComputerVision(ImageAnalyser):
     Microsoft Azure Computer Vision API implementation
     """
 
-    def __init__(self, subscription_key: str, region: str = "francecentral", monthly_capacity: float = None):
+    def __init__(self, subscription_key: str, region: str = "francecentral", monthly_capacity: float = None,
+                 concurrency: int = 0):
         """
         :param subscription_key: subscription key
         :param region: You must use the same region in your REST call as you used to get your subscription keys.
         :param monthly_capacity: custom monthly capacity (optional)
+        :param concurrency: maximum number of concurrent requests, 0 to run requests in the analysis thread
         """
         self._subscription_key = subscription_key
         self._region = region
+        self._concurrency = concurrency
 
         vision_base_url = "https://{}.api.cognitive.microsoft.com/vision/v2.0/".format(self._region)
         self._ocr_url = vision_base_url + "ocr"
@@ -53,6 +54,9 @@ class AzureComputerVision(ImageAnalyser):
     def get_monthly_capacity(self) -> float:
         return self._monthly_capacity
 
+    def get_max_concurrency(self) -> int:
+        return self._concurrency
+
     @MICROSOFT_AZURE_FIND_TEXT_TIME.time()
     def find_text(self, image: bytes):
         headers = {
@@ -68,10 +72,10 @@ class AzureComputerVision(ImageAnalyser):
 
         # a url can also be used
         # json_data = {'url': image_url}
-        # response = requests.post(self._ocr_url, headers=headers, params=params, json=json_data,
-        #                          timeout=REQUESTS_TIMEOUT)
+        # response = HTTP_CLIENT.post(self._ocr_url, headers=headers, params=params, json=json_data)
 
-        response = requests.post(self._ocr_url, headers=headers, params=params, data=image, timeout=REQUESTS_TIMEOUT)
+        # the ocr request doesn't modify anything, so it can be retried safely
+        response = HTTP_CLIENT.post(self._ocr_url, retry=True, headers=headers, params=params, data=image)
         response.raise_for_status()
         analysis = response.json()
 
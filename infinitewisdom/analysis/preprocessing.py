@@ -0,0 +1,259 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import math
+import threading
+
+import numpy as np
+
+from infinitewisdom.stats import IMAGE_PREPROCESSING_TIME
+
+LOGGER = logging.getLogger(__name__)
+
+# encoded image data (f.ex. to upload it to a cloud service)
+INPUT_FORMAT_JPEG = "jpeg"
+# decoded single channel 8 bit image as a 2d numpy array
+INPUT_FORMAT_GRAYSCALE = "grayscale"
+
+STAGE_DECODE = "decode"
+STAGE_CROP = "crop"
+STAGE_DOWNSCALE = "downscale"
+STAGE_GRAYSCALE = "grayscale"
+STAGE_BINARISE = "binarise"
+STAGE_ENCODE = "encode"
+
+
+class ImagePreprocessor:
+    """
+    Configurable preprocessing applied to images before they are analysed.
+    """
+
+    def __init__(self, crop: float = 0.0, max_size: int = 0, grayscale: bool = False, binarise: bool = False,
+                 jpeg_quality: int = 90):
+        """
+        :param crop: ratio of the width and height to remove at each border
+        :param max_size: maximum width and height of the image in pixels, larger images are downscaled, 0 to disable
+        :param grayscale: whether to convert images to grayscale before encoding them
+        :param binarise: whether to convert grayscale images to black and white
+        :param jpeg_quality: quality of re-encoded images
+        """
+        if not 0 <= crop < 0.5:
+            raise ValueError("Crop ratio must be in [0, 0.5): {}".format(crop))
+        self.crop = crop
+        self.max_size = max_size
+        self.grayscale = grayscale
+        self.binarise = binarise
+        self.jpeg_quality = jpeg_quality
+
+    def prepare(self, image_data: bytes) -> "PreprocessedImage":
+        """
+        :param image_data: encoded image data
+        :return: the image, decoded and preprocessed lazily when a representation is requested
+        """
+        return PreprocessedImage(self, image_data)
+
+    def get_fingerprint(self, input_format: str) -> str:
+        """
+        :param input_format: an input format
+        :return: a description of all settings affecting the given representation, empty if it is the original image
+        """
+        settings = []
+        if self.crop > 0:
+            settings.append("crop={}".format(self.crop))
+        if self.max_size > 0:
+            settings.append("max_size={}".format(self.max_size))
+        if input_format == INPUT_FORMAT_JPEG:
+            if not self.modifies_image():
+                return ""
+            if self.grayscale:
+                settings.append("grayscale")
+            if self.grayscale and self.binarise:
+                settings.append("binarise")
+            settings.append("jpeg_quality={}".format(self.jpeg_quality))
+        elif self.binarise:
+            settings.append("binarise")
+        return ",".join(settings)
+
+    def get_analyser_version(self, analyser) -> str:
+        """
+        :param analyser: an analyser
+        :return: the version of the given analyser including the preprocessing of its input,
+        used to identify (cached) results of the analyser
+        """
+        fingerprint = self.get_fingerprint(analyser.get_input_format())
+        if len(fingerprint) <= 0:
+            return analyser.get_version()
+        return "{}+{}".format(analyser.get_version(), fingerprint)
+
+    def modifies_image(self) -> bool:
+        """
+        :return: True if any operation is enabled that may change the image before it is encoded again
+        """
+        return self.crop > 0 or self.max_size > 0 or self.grayscale
+
+
+class PreprocessedImage:
+    """
+    An image that is decoded at most once and provides (cached) representations for different analysers.
+    Instances are thread safe, so a single instance can be shared by all analyses of an image.
+    """
+
+    def __init__(self, preprocessor: ImagePreprocessor, image_data: bytes):
+        """
+        :param preprocessor: the preprocessing to apply
+        :param image_data: encoded image data
+        """
+        self._preprocessor = preprocessor
+        self._image_data = image_data
+        self._lock = threading.Lock()
+        # decoded color image, only decoded if a color representation is required
+        self._color = None
+        # input format -> representation
+        self._representations = {}
+
+    def get(self, input_format: str) -> bytes or np.ndarray:
+        """
+        :param input_format: the format required by an analyser
+        :return: the image in the given format
+        """
+        with self._lock:
+            return self._get(input_format)
+
+    def _get(self, input_format: str) -> bytes or np.ndarray:
+        representation = self._representations.get(input_format, None)
+        if representation is None:
+            if input_format == INPUT_FORMAT_JPEG:
+                representation = self._create_jpeg()
+            elif input_format == INPUT_FORMAT_GRAYSCALE:
+                representation = self._create_grayscale()
+            else:
+                raise ValueError("Unsupported input format: {}".format(input_format))
+            self._representations[input_format] = representation
+        return representation
+
+    def _create_jpeg(self) -> bytes:
+        if not self._preprocessor.modifies_image():
+            # the original data is the cheapest representation
+            return self._image_data
+
+        if self._preprocessor.grayscale:
+            image = self._get(INPUT_FORMAT_GRAYSCALE)
+        else:
+            original = self._get_color()
+            image = self._crop_and_downscale(original)
+            if image is original:
+                return self._image_data
+
+        with IMAGE_PREPROCESSING_TIME.labels(stage=STAGE_ENCODE).time():
+            import cv2
+            success, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self._preprocessor.jpeg_quality])
+        if not success:
+            raise ValueError("Error encoding image")
+        return encoded.tobytes()
+
+    def _create_grayscale(self) -> np.ndarray:
+        import cv2
+
+        if self._color is not None:
+            with IMAGE_PREPROCESSING_TIME.labels(stage=STAGE_GRAYSCALE).time():
+                image = cv2.cvtColor(self._color, cv2.COLOR_BGR2GRAY)
+        else:
+            # decoding directly to grayscale is cheaper than decoding and converting the color image
+            image = self._decode(cv2.IMREAD_GRAYSCALE)
+
+        image = self._crop_and_downscale(image)
+        if self._preprocessor.binarise:
+            with IMAGE_PREPROCESSING_TIME.labels(stage=STAGE_BINARISE).time():
+                image = binarise(image)
+        return image
+
+    def _get_color(self) -> np.ndarray:
+        """
+        :return: the decoded color (BGR) image
+        """
+        if self._color is None:
+            import cv2
+            self._color = self._decode(cv2.IMREAD_COLOR)
+        return self._color
+
+    def _decode(self, flags: int) -> np.ndarray:
+        """
+        :param flags: cv2 imread flags
+        :return: the decoded image
+        """
+        with IMAGE_PREPROCESSING_TIME.labels(stage=STAGE_DECODE).time():
+            import cv2
+            image = cv2.imdecode(np.frombuffer(self._image_data, dtype=np.uint8), flags)
+        if image is None:
+            raise ValueError("Error decoding image")
+        return image
+
+    def _crop_and_downscale(self, image: np.ndarray) -> np.ndarray:
+        """
+        :param image: decoded image
+        :return: the image with crop and downscale applied
+        """
+        if self._preprocessor.crop > 0:
+            with IMAGE_PREPROCESSING_TIME.labels(stage=STAGE_CROP).time():
+                image = crop(image, self._preprocessor.crop)
+        if self._preprocessor.max_size > 0:
+            with IMAGE_PREPROCESSING_TIME.labels(stage=STAGE_DOWNSCALE).time():
+                image = downscale(image, self._preprocessor.max_size)
+        return image
+
+
+def crop(image: np.ndarray, ratio: float) -> np.ndarray:
+    """
+    Removes the given ratio of the width and height at each border
+    :param image: the image
+    :param ratio: ratio to remove
+    :return: view of the cropped image
+    """
+    height, width = image.shape[:2]
+    dy, dx = int(height * ratio), int(width * ratio)
+    return image[dy:height - dy, dx:width - dx]
+
+
+def downscale(image: np.ndarray, max_size: int) -> np.ndarray:
+    """
+    Downscales an image by an integer factor (averaging blocks of pixels) so that it fits the given size
+    :param image: the image
+    :param max_size: maximum width and height
+    :return: the downscaled image or the image itself if it is small enough
+    """
+    height, width = image.shape[:2]
+    factor = math.ceil(max(height, width) / max_size)
+    if factor <= 1:
+        return image
+
+    height, width = height // factor * factor, width // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor, *image.shape[2:])
+    return blocks.mean(axis=(1, 3)).round().astype(np.uint8)
+
+
+def binarise(image: np.ndarray) -> np.ndarray:
+    """
+    Converts a grayscale image to black and white using a threshold found by Otsu's method
+    :param image: grayscale image
+    :return: image only containing 0 and 255
+    """
+    histogram = np.bincount(image.ravel(), minlength=256).astype(np.float64)
+    probability = np.cumsum(histogram) / image.size
+    mean = np.cumsum(histogram * np.arange(256)) / image.size
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (mean[-1] * probability - mean) ** 2 / (probability * (1 - probability))
+    threshold = np.argmax(np.nan_to_num(variance, nan=0.0, posinf=0.0))
+    return np.where(image > threshold, 255, 0).astype(np.uint8)
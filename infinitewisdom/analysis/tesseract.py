@@ -16,7 +16,10 @@
 import logging
 import math
 
+import numpy as np
+
 from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.preprocessing import INPUT_FORMAT_GRAYSCALE
 from infinitewisdom.stats import TESSERACT_FIND_TEXT_TIME
 
 LOGGER = logging.getLogger(__name__)
@@ -37,8 +40,14 @@ class Tesseract(ImageAnalyser):
     def get_monthly_capacity(self):
         return math.inf
 
+    def is_cpu_bound(self) -> bool:
+        return True
+
+    def get_input_format(self) -> str:
+        return INPUT_FORMAT_GRAYSCALE
+
     @TESSERACT_FIND_TEXT_TIME.time()
-    def find_text(self, image: bytes):
+    def find_text(self, image: bytes or np.ndarray):
         try:
             from PIL import Image
         except ImportError:
@@ -46,29 +55,27 @@ class Tesseract(ImageAnalyser):
         import pytesseract
 
         # pytesseract.pytesseract.tesseract_cmd = r'<full_path_to_your_tesseract_executable>'
-        try:
-            image = self._preprocess(image)
+        image = self._preprocess(image)
 
-            # We'll use Pillow's Image class to open the image and pytesseract to detect the string in the image
-            text = pytesseract.image_to_string(image)
-            return text
-        except Exception as ex:
-            LOGGER.error(ex)
-            return None
+        # We'll use Pillow's Image class to open the image and pytesseract to detect the string in the image
+        # errors are raised, so they are not mistaken for (and cached as) images without text
+        return pytesseract.image_to_string(image)
 
     @staticmethod
-    def _preprocess(image: bytes) -> bytes:
+    def _preprocess(image: bytes or np.ndarray) -> np.ndarray:
         """
         Applies pre-processing to a given image to improve text recognition
-        :param image: the original image to process
+        :param image: the decoded grayscale image or the original image data
         :return: the processed image
         """
         import cv2
-        import numpy as np
 
-        bytes_as_np_array = np.frombuffer(image, dtype=np.uint8)
-        flags = cv2.IMREAD_GRAYSCALE
-        image = cv2.imdecode(bytes_as_np_array, flags)
+        if isinstance(image, bytes):
+            bytes_as_np_array = np.frombuffer(image, dtype=np.uint8)
+            flags = cv2.IMREAD_GRAYSCALE
+            image = cv2.imdecode(bytes_as_np_array, flags)
+            if image is None:
+                raise ValueError("Error decoding image")
 
         # apply slight blur
         image = cv2.medianBlur(image, 3)
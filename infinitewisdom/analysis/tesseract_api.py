@@ -0,0 +1,70 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import threading
+
+import numpy as np
+
+from infinitewisdom.analysis.tesseract import Tesseract
+from infinitewisdom.stats import TESSERACT_FIND_TEXT_TIME
+
+LOGGER = logging.getLogger(__name__)
+
+# tesseract API handles are not thread safe, so every thread (and process) gets its own
+_THREAD_LOCAL = threading.local()
+
+
+class TesseractApi(Tesseract):
+    """
+    tesserocr implementation
+
+    In contrast to pytesseract, which starts a tesseract process for every image, this uses
+    a long-lived tesseract API handle and passes the decoded image buffer to it directly.
+    """
+
+    def __init__(self, language: str = "eng"):
+        """
+        :param language: tesseract language
+        """
+        # fail early if tesserocr is not installed
+        import tesserocr  # noqa: F401
+
+        self._language = language
+
+    def get_version(self) -> str:
+        # results differ slightly from the pytesseract implementation
+        return "tesserocr-1"
+
+    @TESSERACT_FIND_TEXT_TIME.time()
+    def find_text(self, image: bytes or np.ndarray):
+        image = self._preprocess(image)
+        height, width = image.shape
+
+        api = self._get_api()
+        api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        return api.GetUTF8Text()
+
+    def _get_api(self):
+        """
+        :return: the tesseract API handle of the current thread
+        """
+        api = getattr(_THREAD_LOCAL, "api", None)
+        if api is None:
+            import tesserocr
+            api = tesserocr.PyTessBaseAPI(lang=self._language)
+            _THREAD_LOCAL.api = api
+            LOGGER.debug("Created tesseract API handle with tesseract {}".format(tesserocr.tesseract_version()))
+        return api
@@ -15,21 +15,64 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
 import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 
 from infinitewisdom import RegularIntervalWorker
-from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis import ImageAnalyser, AnalysisError
+from infinitewisdom.analysis.analysis_queue import AnalysisQueue
+from infinitewisdom.analysis.capacity import AnalyserCapacityLedger
+from infinitewisdom.analysis.executor import AnalysisProcessPool, AnalysisThreadPool
+from infinitewisdom.analysis.preprocessing import ImagePreprocessor, PreprocessedImage
 from infinitewisdom.config.config import AppConfig
 from infinitewisdom.persistence import ImageDataPersistence, _session_scope
-from infinitewisdom.stats import ANALYSER_TIME, ANALYSER_CAPACITY, IMAGE_ANALYSIS_QUEUE_LENGTH
-from infinitewisdom.util import select_best_available_analyser, format_for_single_line_log, remaining_capacity, \
+from infinitewisdom.persistence.sqlalchemy import Image
+from infinitewisdom.stats import ANALYSER_TIME, ANALYSER_CAPACITY, IMAGE_ANALYSIS_QUEUE_LENGTH, \
+    IMAGE_ANALYSIS_PENDING, ANALYSIS_RESULT_CACHE_HITS, ANALYSIS_RESULT_CACHE_MISSES, IMAGE_ANALYSIS_HEDGED
+from infinitewisdom.util import select_best_available_analyser, format_for_single_line_log, \
     download_image_bytes
 
 LOGGER = logging.getLogger(__name__)
 
+# maximum time in seconds to wait for a result of the process or thread pool in a single run
+RESULT_WAIT_TIMEOUT = 60
+# maximum number of failed analyses of an image before it is skipped until the next pass through the queue
+MAX_ANALYSIS_ATTEMPTS = 3
+
+
+class PendingAnalysis:
+    """
+    An analysis running in the process or thread pool
+    """
+
+    def __init__(self, analyser: ImageAnalyser, images: [(int, str, float)], prepared: [PreprocessedImage],
+                 batch: bool, hedge: bool = False):
+        """
+        :param analyser: the analyser used
+        :param images: (entity id, image hash, analysis quality before this analysis) of the analysed images
+        :param prepared: the analysed images, in the same order, shared with hedges of this analysis
+        :param batch: whether the analysis results in a list of texts (one for each image) or a single text
+        :param hedge: whether this analysis has been started because another analysis was too slow
+        """
+        self.analyser = analyser
+        self.images = images
+        self.prepared = prepared
+        self.batch = batch
+        self.hedge = hedge
+        self.started = time.time()
+        # hedge analyses started for the images of this analysis
+        self.hedges = None
+
 
 class AnalysisWorker(RegularIntervalWorker):
     """
     Worker that continuously scans the persistence and tries to add or upgrade their analysis.
+
+    CPU bound analysers are run in a process pool which is kept busy by submitting
+    as many images as there are processes, results are applied in subsequent runs.
+    Analysers calling remote services are run in a thread pool with a limited number
+    of concurrent requests per analyser. Images of requests that take longer than the
+    hedge delay are additionally analysed by the next best analyser, the better
+    result is kept.
     """
 
     def __init__(self, config: AppConfig, persistence: ImageDataPersistence, image_analysers: [ImageAnalyser]):
@@ -51,21 +94,49 @@ class AnalysisWorker(RegularIntervalWorker):
             self._target_quality = sorted(self._image_analysers, key=lambda x: x.get_quality(), reverse=True)[
                 0].get_quality()
 
+        self._preprocessor = ImagePreprocessor(
+            crop=config.IMAGE_ANALYSIS_PREPROCESSING_CROP.value,
+            max_size=config.IMAGE_ANALYSIS_PREPROCESSING_MAX_SIZE.value,
+            grayscale=config.IMAGE_ANALYSIS_PREPROCESSING_GRAYSCALE.value,
+            binarise=config.IMAGE_ANALYSIS_PREPROCESSING_BINARISE.value,
+            jpeg_quality=config.IMAGE_ANALYSIS_PREPROCESSING_JPEG_QUALITY.value)
+        # analyser -> version used for cached results, changes with the preprocessing settings
+        self._analyser_versions = {x: self._preprocessor.get_analyser_version(x) for x in self._image_analysers}
+
+        processes = config.IMAGE_ANALYSIS_PROCESSES.value
+        if processes > 0 and any(map(lambda x: x.is_cpu_bound(), self._image_analysers)):
+            self._process_pool = AnalysisProcessPool(processes)
+        else:
+            self._process_pool = None
+        self._thread_pool = AnalysisThreadPool(
+            list(filter(lambda x: not self._runs_in_process_pool(x), self._image_analysers)))
+        self._hedge_delay = config.IMAGE_ANALYSIS_HEDGE_DELAY.value
+        # future -> PendingAnalysis of analyses running in the process or thread pool
+        self._pending = {}
+        # entity id -> number of failed analyses
+        self._failed_attempts = {}
+
         with _session_scope() as session:
-            self._not_optimal_ids = set(self._persistence.find_non_optimal(session, self._target_quality))
+            self._persistence.remove_outdated_analysis_results(session, self._analyser_versions)
+            self._capacity_ledger = AnalyserCapacityLedger(session, self._persistence, self._image_analysers)
+        self._queue = AnalysisQueue(self._persistence, self._target_quality)
 
     def start(self):
         if len(self._image_analysers) <= 0:
             LOGGER.warning("No image analyser provided, not starting.")
             return
 
-        with _session_scope(False) as session:
-            self._update_stats(session)
-
+        self._update_stats()
         super().start()
 
+    def stop(self):
+        super().stop()
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+        self._thread_pool.shutdown()
+
     def add_image_to_queue(self, image_entity_id: int):
-        self._not_optimal_ids.add(image_entity_id)
+        self._queue.push(image_entity_id)
 
     @ANALYSER_TIME.time()
     def _run(self):
@@ -73,88 +144,401 @@ class AnalysisWorker(RegularIntervalWorker):
         The job that is executed regularly by this crawler
         """
         with _session_scope() as session:
-            queue_length = len(self._not_optimal_ids)
-            IMAGE_ANALYSIS_QUEUE_LENGTH.set(queue_length)
-            if queue_length <= 0:
+            self._apply_results(session)
+            self._hedge_slow_analyses(session)
+            while self._analyse_next(session):
+                # fill up the process and thread pool
+                pass
+
+        if len(self._pending) > 0:
+            wait(list(self._pending.keys()), timeout=self._get_wait_timeout(), return_when=FIRST_COMPLETED)
+            with _session_scope() as session:
+                self._apply_results(session)
+
+    def _analyse_next(self, session) -> bool:
+        """
+        Analyses the next image in the queue
+        :return: True if the analysis has been submitted to the process or thread pool, False otherwise
+        """
+        analyser = select_best_available_analyser(self._image_analysers, self._capacity_ledger)
+        if analyser is None:
+            if len(self._pending) > 0:
+                return False
+            # No analyser available, skipping
+            # sleep for a longer time period to reduce db load
+            time.sleep(60)
+            return False
+
+        if not self._has_free_slot(analyser):
+            # wait for running analyses of this analyser
+            return False
+
+        entity = None
+        while entity is None:
+            image_id = self._queue.pop(session)
+            IMAGE_ANALYSIS_QUEUE_LENGTH.set(len(self._queue))
+            if image_id is None:
+                if len(self._pending) > 0:
+                    # wait for running analyses before looking for more work
+                    return False
                 # sleep for a longer time period to reduce load
                 time.sleep(60)
-                self._not_optimal_ids = set(self._persistence.find_non_optimal(session, self._target_quality))
-                return
-
-            entity = None
-            while entity is None:
-                if queue_length <= 0:
-                    return
-                image_id = self._not_optimal_ids.pop()
-                queue_length -= 1
-                IMAGE_ANALYSIS_QUEUE_LENGTH.set(queue_length)
-                entity = self._persistence.get_image(session, image_id)
-                if entity is None:
-                    LOGGER.warning(f"Image id scheduled for analysis not found: {image_id}")
-                    # the entity has probably been removed in the meantime
-                    continue
+                self._queue.restart()
+                return False
+            if self._is_pending(image_id):
+                # already being analysed
+                continue
+            entity = self._persistence.get_image(session, image_id)
+            if entity is None:
+                LOGGER.warning(f"Image id scheduled for analysis not found: {image_id}")
+                # the entity has probably been removed in the meantime
+                continue
 
-            analyser = select_best_available_analyser(session, self._image_analysers, self._persistence)
-            if analyser is None:
-                # No analyser available, skipping
+        if entity.analyser_quality is not None and entity.analyser_quality >= analyser.get_quality():
+            LOGGER.debug(
+                "Not analysing '{}' with '{}' because it wouldn't improve analysis quality ({} vs {})".format(
+                    entity.url, analyser.get_identifier(), entity.analyser_quality, analyser.get_quality()))
+            if len(self._pending) <= 0:
                 # sleep for a longer time period to reduce db load
                 time.sleep(60)
-                return
+            return False
 
-            if entity.analyser_quality is not None and entity.analyser_quality >= analyser.get_quality():
-                LOGGER.debug(
-                    "Not analysing '{}' with '{}' because it wouldn't improve analysis quality ({} vs {})".format(
-                        entity.url, analyser.get_identifier(), entity.analyser_quality, analyser.get_quality()))
-                # sleep for a longer time period to reduce db load
-                time.sleep(60)
-                return
+        if self._apply_cached_result(session, entity, analyser):
+            return False
+
+        image_data = self._persistence.get_image_data(entity)
+        if image_data is None:
+            LOGGER.warning(
+                "No image data found for entity with image_hash {}, it will not be analysed.".format(
+                    entity.image_hash))
+            try:
+                image_data = download_image_bytes(entity.url)
+                self._persistence.update(session, entity, image_data)
+            except Exception as e:
+                # if len(entity.telegram_ids) > 0:
+                #     LOGGER.warning(
+                #         "Error downloading image data from original source, using telegram upload instead. {}".format(
+                #             entity))
+                #     # TODO:
+                # else:
+                LOGGER.error(
+                    "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url),
+                    e)
+                self._persistence.delete(session, entity)
+            return False
+
+        # the image is decoded (at most) once and shared by all analyses of this image
+        prepared = self._preprocessor.prepare(image_data)
+        if self._runs_in_process_pool(analyser):
+            self._submit(analyser, [(entity, prepared)])
+            return True
+
+        if analyser.get_batch_size() > 1:
+            batch = self._take_batch(session, analyser, [(entity, prepared)])
+        else:
+            batch = [(entity, prepared)]
+
+        if self._thread_pool.supports(analyser):
+            self._submit(analyser, batch)
+            return True
+
+        self._capacity_ledger.record(analyser, len(batch))
+        try:
+            texts = analyser.find_text_batch(list(map(lambda x: x[1].get(analyser.get_input_format()), batch)))
+        except Exception as e:
+            LOGGER.error("Error analysing images with '{}': {}".format(analyser.get_identifier(), e), exc_info=True)
+            texts = [AnalysisError(str(e))] * len(batch)
+        for (entity, _), text in zip(batch, texts):
+            self._apply_result(session, entity.id, entity.image_hash, analyser, text)
+        return False
+
+    def _runs_in_process_pool(self, analyser: ImageAnalyser) -> bool:
+        """
+        :param analyser: the analyser
+        :return: True if analyses of the given analyser are run in the process pool
+        """
+        return self._process_pool is not None and analyser.is_cpu_bound()
+
+    def _has_free_slot(self, analyser: ImageAnalyser) -> bool:
+        """
+        :param analyser: the analyser
+        :return: True if another analysis of the given analyser can be started right away
+        """
+        # finished analyses occupy their slot until their results have been applied
+        if self._runs_in_process_pool(analyser):
+            running = len(list(filter(lambda x: self._runs_in_process_pool(x.analyser), self._pending.values())))
+            return running < self._process_pool.get_process_count()
+        if self._thread_pool.supports(analyser):
+            running = len(list(filter(lambda x: x.analyser is analyser, self._pending.values())))
+            return running < analyser.get_max_concurrency()
+        # analyses are run in the analysis thread
+        return True
 
+    def _submit(self, analyser: ImageAnalyser, batch: [(Image, PreprocessedImage)], hedge: bool = False) -> Future:
+        """
+        Starts the analysis of the given images in the process or thread pool
+        :param analyser: the analyser to use
+        :param batch: entities and their images, a single one for the process pool
+        :param hedge: whether this analysis is started because another analysis was too slow
+        :return: the running analysis
+        """
+        self._capacity_ledger.record(analyser, len(batch))
+        images = list(map(lambda x: (x[0].id, x[0].image_hash, x[0].analyser_quality or 0), batch))
+        prepared = list(map(lambda x: x[1], batch))
+        if self._runs_in_process_pool(analyser):
+            try:
+                # only the representation required by the analyser is sent to the worker process
+                image = prepared[0].get(analyser.get_input_format())
+                future = self._process_pool.submit(analyser, image)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            pending = PendingAnalysis(analyser, images, prepared, batch=False, hedge=hedge)
+        else:
+            future = self._thread_pool.submit(analyser, prepared)
+            pending = PendingAnalysis(analyser, images, prepared, batch=True, hedge=hedge)
+        self._pending[future] = pending
+        IMAGE_ANALYSIS_PENDING.set(len(self._pending))
+        return future
+
+    def _hedge_slow_analyses(self, session):
+        """
+        Additionally analyses the images of analyses that are running for longer than the hedge delay
+        using the next best analyser, so the images get at least some result in a timely manner
+        """
+        if self._hedge_delay <= 0:
+            return
+
+        now = time.time()
+        for future, pending in list(self._pending.items()):
+            if pending.hedge or pending.hedges is not None or future.done():
+                continue
+            if now - pending.started < self._hedge_delay:
+                continue
+
+            pending.hedges = []
+            for (entity_id, image_hash, old_quality), prepared in zip(pending.images, pending.prepared):
+                analyser = self._select_hedge_analyser(pending.analyser, old_quality)
+                if analyser is None:
+                    break
+                entity = self._persistence.get_image(session, entity_id)
+                if entity is None:
+                    continue
+                if self._apply_cached_result(session, entity, analyser):
+                    continue
+
+                LOGGER.debug("Analysis of '{}' with '{}' is slow, hedging with '{}'".format(
+                    entity.url, pending.analyser.get_identifier(), analyser.get_identifier()))
+                IMAGE_ANALYSIS_HEDGED.labels(name=analyser.get_identifier()).inc()
+                pending.hedges.append(self._submit(analyser, [(entity, prepared)], hedge=True))
+
+    def _select_hedge_analyser(self, analyser: ImageAnalyser, old_quality: float) -> ImageAnalyser or None:
+        """
+        Selects an analyser to hedge a slow analysis with
+        :param analyser: the analyser of the slow analysis
+        :param old_quality: the analysis quality of the image before the slow analysis
+        :return: the best analyser that is worse than the given one but would still improve the image
+        and is able to start an analysis right away, or None
+        """
+        candidates = list(filter(
+            lambda x: old_quality < x.get_quality() < analyser.get_quality()
+                      and (self._runs_in_process_pool(x) or self._thread_pool.supports(x))
+                      and self._has_free_slot(x)
+                      and self._capacity_ledger.get_remaining(x) > 0,
+            self._image_analysers))
+        if len(candidates) <= 0:
+            return None
+        return sorted(candidates, key=lambda x: x.get_quality(), reverse=True)[0]
+
+    def _get_wait_timeout(self) -> float:
+        """
+        :return: the time in seconds to wait for results of running analyses before the next run
+        """
+        timeout = RESULT_WAIT_TIMEOUT
+        if self._hedge_delay > 0:
+            now = time.time()
+            for pending in self._pending.values():
+                if pending.hedge or pending.hedges is not None:
+                    continue
+                timeout = min(timeout, max(0.0, pending.started + self._hedge_delay - now))
+        return timeout
+
+    def _apply_cached_result(self, session, entity: Image, analyser: ImageAnalyser) -> bool:
+        """
+        Updates an entity using a cached analysis result, if there is one
+        :param entity: the entity to analyse
+        :param analyser: the analyser to use
+        :return: True if a cached result was used, False if the image has to be analysed
+        """
+        result = self._persistence.get_analysis_result(session, entity.image_hash, analyser,
+                                                       self._analyser_versions[analyser])
+        if result is None:
+            ANALYSIS_RESULT_CACHE_MISSES.labels(name=analyser.get_identifier()).inc()
+            return False
+
+        ANALYSIS_RESULT_CACHE_HITS.labels(name=analyser.get_identifier()).inc()
+        LOGGER.debug("Using cached analysis result of '{}' for '{}'".format(analyser.get_identifier(), entity.url))
+        self._update_analysis(session, entity, analyser, result.text)
+        return True
+
+    def _take_batch(self, session, analyser: ImageAnalyser,
+                    batch: [(Image, PreprocessedImage)]) -> [(Image, PreprocessedImage)]:
+        """
+        Takes more images from the queue that can be analysed together with the given ones,
+        respecting the batch size and remaining capacity of the analyser
+        :param analyser: the analyser to use
+        :param batch: entities and their images that are already part of the batch
+        :return: entities and their images to analyse
+        """
+        batch_size = int(max(1, min(analyser.get_batch_size(),
+                                    self._capacity_ledger.get_remaining(analyser))))
+        skipped = []
+        while len(batch) < batch_size:
+            image_id = self._queue.pop(session)
+            if image_id is None:
+                break
+            if self._is_pending(image_id):
+                continue
+            entity = self._persistence.get_image(session, image_id)
+            if entity is None:
+                continue
+            if entity.analyser_quality is not None and entity.analyser_quality >= analyser.get_quality():
+                continue
+            if self._apply_cached_result(session, entity, analyser):
+                continue
             image_data = self._persistence.get_image_data(entity)
             if image_data is None:
-                LOGGER.warning(
-                    "No image data found for entity with image_hash {}, it will not be analysed.".format(
-                        entity.image_hash))
-                try:
-                    image_data = download_image_bytes(entity.url)
-                    self._persistence.update(session, entity, image_data)
-                except Exception as e:
-                    # if len(entity.telegram_ids) > 0:
-                    #     LOGGER.warning(
-                    #         "Error downloading image data from original source, using telegram upload instead. {}".format(
-                    #             entity))
-                    #     # TODO:
-                    # else:
-                    LOGGER.error(
-                        "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url),
-                        e)
-                    self._persistence.delete(session, entity)
-                return
-
-            old_analyser = entity.analyser
-            old_quality = entity.analyser_quality
-            if old_quality is None:
-                old_quality = 0
-
-            entity.analyser = analyser.get_identifier()
-            entity.analyser_quality = analyser.get_quality()
-            new_text = analyser.find_text(image_data)
-
-            if (new_text is None or len(new_text) <= 0) and entity.text is not None and len(entity.text) > 0:
-                LOGGER.debug("Ignoring new analysis text because it would delete it")
-            else:
-                entity.text = new_text
-
-            self._persistence.update(session, entity, image_data)
-            LOGGER.debug(
-                "Updated analysis of '{}' with '{}' (was '{}') with a quality improvement of {} ({} -> {}): {}".format(
-                    entity.url, analyser.get_identifier(), old_analyser, entity.analyser_quality - old_quality,
-                    old_quality,
-                    entity.analyser_quality,
-                    format_for_single_line_log(entity.text)))
+                # missing image data is handled when the image is analysed on its own
+                skipped.append(image_id)
+                continue
+            batch.append((entity, self._preprocessor.prepare(image_data)))
+
+        for image_id in skipped:
+            self._queue.push(image_id)
+        IMAGE_ANALYSIS_QUEUE_LENGTH.set(len(self._queue))
+        return batch
+
+    def _is_pending(self, image_id: int) -> bool:
+        """
+        :param image_id: entity id
+        :return: True if the image is currently being analysed in the process or thread pool
+        """
+        for pending in self._pending.values():
+            if image_id in map(lambda x: x[0], pending.images):
+                return True
+        return False
+
+    def _apply_results(self, session):
+        """
+        Updates the entities of all analyses that have been finished by the process or thread pool
+        """
+        done = list(filter(lambda x: x.done(), self._pending.keys()))
+        for future in done:
+            pending = self._pending.pop(future)
+            if pending.hedges is not None:
+                # hedges that haven't been started yet are not necessary anymore
+                for hedge in pending.hedges:
+                    if hedge.cancel():
+                        # the capacity charged on submit hasn't been used
+                        cancelled = self._pending.pop(hedge)
+                        self._capacity_ledger.release(cancelled.analyser, len(cancelled.images))
+            if future.cancelled():
+                continue
+
+            try:
+                result = future.result()
+                texts = result if pending.batch else [result]
+            except Exception as e:
+                LOGGER.error("Error analysing images {} with '{}': {}".format(
+                    list(map(lambda x: x[0], pending.images)), pending.analyser.get_identifier(), e), exc_info=True)
+                texts = [AnalysisError(str(e))] * len(pending.images)
+
+            for (entity_id, image_hash, _), text in zip(pending.images, texts):
+                self._apply_result(session, entity_id, image_hash, pending.analyser, text, retry=not pending.hedge)
+        IMAGE_ANALYSIS_PENDING.set(len(self._pending))
+
+    def _apply_result(self, session, entity_id: int, image_hash: str, analyser: ImageAnalyser,
+                      new_text: str or None or AnalysisError, retry: bool = True):
+        """
+        Updates an entity with the result of an analysis
+        :param entity_id: id of the analysed entity
+        :param image_hash: hash of the analysed image data
+        :param analyser: the analyser used
+        :param new_text: recognized text or the error that occurred analysing the image
+        :param retry: whether to queue the image again if the analysis failed
+        """
+        if isinstance(new_text, AnalysisError):
+            self._handle_failure(entity_id, analyser, new_text, retry)
+            return
+
+        # only successful analyses are cached, analysers raise errors instead of returning no text
+        self._failed_attempts.pop(entity_id, None)
+        self._persistence.add_analysis_result(session, image_hash, analyser, self._analyser_versions[analyser],
+                                              new_text)
+
+        entity = self._persistence.get_image(session, entity_id)
+        if entity is None:
+            # the entity has been removed in the meantime
+            return
+        if entity.analyser_quality is not None and entity.analyser_quality >= analyser.get_quality():
+            # the entity has been analysed by someone else (or a better analyser) in the meantime
+            return
+
+        self._update_analysis(session, entity, analyser, new_text)
+
+    def _handle_failure(self, entity_id: int, analyser: ImageAnalyser, error: AnalysisError, retry: bool):
+        """
+        Queues an image whose analysis failed again, up to MAX_ANALYSIS_ATTEMPTS times
+        :param entity_id: id of the entity
+        :param analyser: the analyser used
+        :param error: the error that occurred
+        :param retry: whether to queue the image again
+        """
+        LOGGER.warning("Error analysing image #{} with '{}': {}".format(entity_id, analyser.get_identifier(), error))
+        if not retry:
+            return
+
+        attempts = self._failed_attempts.get(entity_id, 0) + 1
+        if attempts >= MAX_ANALYSIS_ATTEMPTS:
+            LOGGER.error("Giving up analysing image #{} after {} failed attempts".format(entity_id, attempts))
+            self._failed_attempts.pop(entity_id, None)
+            return
+
+        self._failed_attempts[entity_id] = attempts
+        self._queue.push(entity_id)
+        IMAGE_ANALYSIS_QUEUE_LENGTH.set(len(self._queue))
+
+    def _update_analysis(self, session, entity: Image, analyser: ImageAnalyser, new_text: str or None):
+        """
+        Updates the analysis of an entity
+        :param entity: the analysed entity
+        :param analyser: the analyser used
+        :param new_text: recognized text
+        """
+        old_analyser = entity.analyser
+        old_quality = entity.analyser_quality
+        if old_quality is None:
+            old_quality = 0
+
+        entity.analyser = analyser.get_identifier()
+        entity.analyser_quality = analyser.get_quality()
+
+        if (new_text is None or len(new_text) <= 0) and entity.text is not None and len(entity.text) > 0:
+            LOGGER.debug("Ignoring new analysis text because it would delete it")
+        else:
+            entity.text = new_text
+
+        self._persistence.update(session, entity)
+        LOGGER.debug(
+            "Updated analysis of '{}' with '{}' (was '{}') with a quality improvement of {} ({} -> {}): {}".format(
+                entity.url, analyser.get_identifier(), old_analyser, entity.analyser_quality - old_quality,
+                old_quality,
+                entity.analyser_quality,
+                format_for_single_line_log(entity.text)))
 
-            self._update_stats(session)
+        self._update_stats()
 
-    def _update_stats(self, session):
+    def _update_stats(self):
         for analyser in self._image_analysers:
-            remaining = remaining_capacity(session, analyser, self._persistence)
+            remaining = self._capacity_ledger.get_remaining(analyser)
             ANALYSER_CAPACITY.labels(name=analyser.get_identifier()).set(remaining)
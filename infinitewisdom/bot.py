@@ -31,7 +31,7 @@ from infinitewisdom.const import COMMAND_START, REPLY_COMMAND_DELETE, IMAGE_ANAL
     COMMAND_CONFIG
 from infinitewisdom.persistence import Image, ImageDataPersistence, _session_scope
 from infinitewisdom.stats import INSPIRE_TIME, INLINE_TIME, START_TIME, CHOSEN_INLINE_RESULTS, format_metrics
-from infinitewisdom.util import send_photo, send_message, cryptographic_hash, download_image_bytes
+from infinitewisdom.util import send_photo, send_message, download_image_bytes
 
 LOGGER = logging.getLogger(__name__)
 
@@ -462,7 +462,9 @@ class InfiniteWisdomBot:
             else:
                 entities = self._persistence.get_random(session, page_size=badge_size)
 
-            results = list(map(lambda x: self._entity_to_inline_query_result(x), entities))
+            file_ids = self._persistence.find_telegram_file_ids(session, self.bot.token,
+                                                                list(map(lambda x: x.id, entities)))
+            results = list(map(lambda x: self._entity_to_inline_query_result(x, file_ids.get(x.id, None)), entities))
         
         LOGGER.debug('Inline query "{}": {}+{} results'.format(query, len(results), offset))
         if len(results) > 0:
@@ -506,10 +508,9 @@ class InfiniteWisdomBot:
             if self._config.TELEGRAM_CAPTION_IMAGES_WITH_TEXT.value:
                 caption = entity.text
 
-            telegram_file_ids_for_current_bot = self.find_telegram_file_ids_for_current_bot(bot.token, entity)
-            if len(telegram_file_ids_for_current_bot) > 0:
-                file_ids = send_photo(bot=bot, chat_id=chat_id, file_id=telegram_file_ids_for_current_bot[0].id,
-                                      caption=caption)
+            telegram_file_id = self._persistence.find_telegram_file_ids(session, bot.token, [entity.id]).get(entity.id)
+            if telegram_file_id is not None:
+                file_ids = send_photo(bot=bot, chat_id=chat_id, file_id=telegram_file_id, caption=caption)
                 bot_token = self._persistence.get_bot_token(session, bot.token)
                 for file_id in file_ids:
                     entity.add_file_id(bot_token, file_id)
@@ -535,17 +536,18 @@ class InfiniteWisdomBot:
                 entity.add_file_id(bot_token, file_id)
             self._persistence.update(session, entity, image_bytes)
 
-    def _entity_to_inline_query_result(self, entity: Image):
+    @staticmethod
+    def _entity_to_inline_query_result(entity: Image, telegram_file_id: str or None):
         """
         Creates a telegram inline query result object for the given entity
         :param entity: the entity to use
+        :param telegram_file_id: a telegram file id of the entity usable by this bot (if any)
         :return: inline result object
         """
-        telegram_file_ids_for_current_bot = self.find_telegram_file_ids_for_current_bot(self.bot.token, entity)
-        if len(telegram_file_ids_for_current_bot) > 0:
+        if telegram_file_id is not None:
             return InlineQueryResultCachedPhoto(
                 id=entity.image_hash,
-                photo_file_id=str(telegram_file_ids_for_current_bot[0].id),
+                photo_file_id=str(telegram_file_id),
             )
         else:
             return InlineQueryResultPhoto(
@@ -555,18 +557,3 @@ class InfiniteWisdomBot:
                 photo_height=50,
                 photo_width=50
             )
-
-    @staticmethod
-    def find_telegram_file_ids_for_current_bot(token: str, entity: Image) -> []:
-        """
-        Filters all telegram file ids of an image for the current bot
-        :param token: the bot token
-        :param entity: the image entity
-        :return: list of matching telegram file ids
-        """
-        hashed_bot_token = cryptographic_hash(token)
-        result = []
-        for file_id in entity.telegram_file_ids:
-            if hashed_bot_token in list(map(lambda x: x.hashed_token, file_id.bot_tokens)):
-                result.append(file_id)
-        return result
@@ -33,7 +33,9 @@ from infinitewisdom.const import CONFIG_FILE_NAME, \
     CONFIG_NODE_CRAWLER, CONFIG_NODE_TELEGRAM, CONFIG_NODE_GOOGLE_VISION, \
     CONFIG_NODE_TESSERACT, CONFIG_NODE_ENABLED, CONFIG_NODE_CAPACITY_PER_MONTH, CONFIG_NODE_INTERVAL, \
     CONFIG_NODE_UPLOADER, DEFAULT_FILE_PERSISTENCE_BASE_PATH, CONFIG_NODE_MICROSOFT_AZURE, CONFIG_NODE_PORT, \
-    CONFIG_NODE_STATS
+    CONFIG_NODE_STATS, FILE_PERSISTENCE_STORE_FILES, FILE_PERSISTENCE_STORE_PACKED, CONFIG_NODE_SCRUBBER, \
+    TESSERACT_ENGINE_PYTESSERACT, TESSERACT_ENGINE_TESSEROCR, CONFIG_NODE_PREPROCESSING, \
+    CONFIG_NODE_CONCURRENCY
 
 
 class AppConfig(ConfigBase):
@@ -126,6 +128,38 @@ class AppConfig(ConfigBase):
         default=None,
         example=12345678)
 
+    SCRUBBER_ENABLED = BoolConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SCRUBBER,
+            CONFIG_NODE_ENABLED
+        ],
+        default=True)
+
+    SCRUBBER_INTERVAL = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SCRUBBER,
+            CONFIG_NODE_INTERVAL
+        ],
+        default=10.0)
+
+    SCRUBBER_BATCH_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SCRUBBER,
+            "batch_size"
+        ],
+        default=10)
+
+    UPLOADER_BATCH_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_UPLOADER,
+            "batch_size"
+        ],
+        default=1)
+
     CRAWLER_INTERVAL = FloatConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -134,6 +168,86 @@ class AppConfig(ConfigBase):
         ],
         default=1.0)
 
+    CRAWLER_MAX_INTERVAL = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "max_interval"
+        ],
+        default=300.0)
+
+    CRAWLER_NOVELTY_WINDOW = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "novelty_window"
+        ],
+        default=100)
+
+    CRAWLER_MIN_NOVELTY = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "min_novelty"
+        ],
+        default=0.1)
+
+    CRAWLER_URL_WORKERS = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "url_workers"
+        ],
+        default=1)
+
+    CRAWLER_DOWNLOAD_WORKERS = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "download_workers"
+        ],
+        default=4)
+
+    CRAWLER_HASH_WORKERS = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "hash_workers"
+        ],
+        default=1)
+
+    CRAWLER_PERSIST_WORKERS = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "persist_workers"
+        ],
+        default=1)
+
+    CRAWLER_QUEUE_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "queue_size"
+        ],
+        default=16)
+
+    CRAWLER_URL_FILTER_CAPACITY = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "url_filter_capacity"
+        ],
+        default=1000000)
+
+    CRAWLER_URL_FILTER_ERROR_RATE = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "url_filter_error_rate"
+        ],
+        default=0.001)
+
     SQL_PERSISTENCE_URL = StringConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -151,6 +265,39 @@ class AppConfig(ConfigBase):
         ],
         default=DEFAULT_FILE_PERSISTENCE_BASE_PATH)
 
+    FILE_PERSISTENCE_STORE = StringConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "file_store"
+        ],
+        regex=re.compile(f"^({FILE_PERSISTENCE_STORE_FILES}|{FILE_PERSISTENCE_STORE_PACKED})$"),
+        default=FILE_PERSISTENCE_STORE_FILES)
+
+    FILE_PERSISTENCE_SEGMENT_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "segment_size"
+        ],
+        default=256 * 1024 * 1024)
+
+    FILE_PERSISTENCE_CACHE_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "cache_size"
+        ],
+        default=64 * 1024 * 1024)
+
+    PERSISTENCE_IN_MEMORY_TEXT_INDEX = BoolConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "in_memory_text_index"
+        ],
+        default=False)
+
     IMAGE_ANALYSIS_INTERVAL = FloatConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -159,6 +306,67 @@ class AppConfig(ConfigBase):
         ],
         default=1.0)
 
+    IMAGE_ANALYSIS_PROCESSES = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            "processes"
+        ],
+        default=os.cpu_count() or 1)
+
+    IMAGE_ANALYSIS_HEDGE_DELAY = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            "hedge_delay"
+        ],
+        default=0.0)
+
+    IMAGE_ANALYSIS_PREPROCESSING_CROP = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_PREPROCESSING,
+            "crop"
+        ],
+        default=0.0)
+
+    IMAGE_ANALYSIS_PREPROCESSING_MAX_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_PREPROCESSING,
+            "max_size"
+        ],
+        default=0)
+
+    IMAGE_ANALYSIS_PREPROCESSING_GRAYSCALE = BoolConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_PREPROCESSING,
+            "grayscale"
+        ],
+        default=False)
+
+    IMAGE_ANALYSIS_PREPROCESSING_BINARISE = BoolConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_PREPROCESSING,
+            "binarise"
+        ],
+        default=False)
+
+    IMAGE_ANALYSIS_PREPROCESSING_JPEG_QUALITY = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_PREPROCESSING,
+            "jpeg_quality"
+        ],
+        default=90)
+
     IMAGE_ANALYSIS_TESSERACT_ENABLED = BoolConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -168,6 +376,16 @@ class AppConfig(ConfigBase):
         ],
         default=False)
 
+    IMAGE_ANALYSIS_TESSERACT_ENGINE = StringConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_TESSERACT,
+            "engine"
+        ],
+        regex=re.compile(f"^({TESSERACT_ENGINE_PYTESSERACT}|{TESSERACT_ENGINE_TESSEROCR})$"),
+        default=TESSERACT_ENGINE_PYTESSERACT)
+
     IMAGE_ANALYSIS_GOOGLE_VISION_ENABLED = BoolConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -197,6 +415,24 @@ class AppConfig(ConfigBase):
         default=None,
         example=1000)
 
+    IMAGE_ANALYSIS_GOOGLE_VISION_BATCH_SIZE = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_GOOGLE_VISION,
+            "batch_size"
+        ],
+        default=16)
+
+    IMAGE_ANALYSIS_GOOGLE_VISION_CONCURRENCY = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_GOOGLE_VISION,
+            CONFIG_NODE_CONCURRENCY
+        ],
+        default=4)
+
     IMAGE_ANALYSIS_MICROSOFT_AZURE_ENABLED = BoolConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -235,6 +471,15 @@ class AppConfig(ConfigBase):
         ],
         default=5000)
 
+    IMAGE_ANALYSIS_MICROSOFT_AZURE_CONCURRENCY = IntConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_MICROSOFT_AZURE,
+            CONFIG_NODE_CONCURRENCY
+        ],
+        default=4)
+
     STATS_PORT = IntConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -244,6 +489,15 @@ class AppConfig(ConfigBase):
         default=8000
     )
 
+    STATS_RECONCILE_INTERVAL = FloatConfigEntry(
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_STATS,
+            "reconcile_interval"
+        ],
+        default=600.0
+    )
+
     def _validate(self):
         """
         Validates the current configuration and throws an exception if something is wrong
@@ -253,6 +507,27 @@ class AppConfig(ConfigBase):
         if self.CRAWLER_INTERVAL.value < 0:
             raise AssertionError("Image polling interval must be >= 0!")
 
+        if self.IMAGE_ANALYSIS_PROCESSES.value < 0:
+            raise AssertionError("Number of image analysis processes must be >= 0!")
+
+        if self.IMAGE_ANALYSIS_HEDGE_DELAY.value < 0:
+            raise AssertionError("Image analysis hedge delay must be >= 0!")
+
+        if self.IMAGE_ANALYSIS_GOOGLE_VISION_CONCURRENCY.value < 0:
+            raise AssertionError("Google Vision concurrency must be >= 0!")
+
+        if self.IMAGE_ANALYSIS_MICROSOFT_AZURE_CONCURRENCY.value < 0:
+            raise AssertionError("Microsoft Azure concurrency must be >= 0!")
+
+        if not 0 <= self.IMAGE_ANALYSIS_PREPROCESSING_CROP.value < 0.5:
+            raise AssertionError("Image preprocessing crop ratio must be in [0, 0.5)!")
+
+        if self.IMAGE_ANALYSIS_PREPROCESSING_MAX_SIZE.value < 0:
+            raise AssertionError("Image preprocessing max size must be >= 0!")
+
+        if not 0 < self.IMAGE_ANALYSIS_PREPROCESSING_JPEG_QUALITY.value <= 100:
+            raise AssertionError("Image preprocessing jpeg quality must be in (0, 100]!")
+
         if self.IMAGE_ANALYSIS_GOOGLE_VISION_ENABLED.value:
             if self.IMAGE_ANALYSIS_GOOGLE_VISION_AUTH_FILE.value is None:
                 raise AssertionError("Google Vision authentication file is required")
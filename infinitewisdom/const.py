@@ -21,6 +21,16 @@ Holds important constants
 __version__ = "4.6.13"
 
 TELEGRAM_CAPTION_LENGTH_LIMIT = 200
+# messages per second the bot may send to all chats
+TELEGRAM_GLOBAL_RATE_LIMIT = 30
+# messages per second the bot may send to a single private chat
+TELEGRAM_CHAT_RATE_LIMIT = 1
+# messages per second the bot may send to a single group chat
+TELEGRAM_GROUP_RATE_LIMIT = 20 / 60
+# number of messages that may be sent to a single chat at once
+TELEGRAM_CHAT_BURST = 3
+# number of attempts to send a message when telegram asks to retry later
+TELEGRAM_SEND_ATTEMPTS = 3
 
 COMMAND_START = 'start'
 COMMAND_COMMANDS = ['help', 'h']
@@ -38,6 +48,12 @@ REPLY_COMMAND_DELETE = ['delete', 'd']
 DEFAULT_SQL_PERSISTENCE_URL = "sqlite:///infinitewisdom.db"
 DEFAULT_FILE_PERSISTENCE_BASE_PATH = "./.image_data"
 
+FILE_PERSISTENCE_STORE_FILES = "files"
+FILE_PERSISTENCE_STORE_PACKED = "packed"
+
+TESSERACT_ENGINE_PYTESSERACT = "pytesseract"
+TESSERACT_ENGINE_TESSEROCR = "tesserocr"
+
 CONFIG_FILE_NAME = "infinitewisdom"
 
 IMAGE_ANALYSIS_TYPE_HUMAN = "human"
@@ -49,6 +65,7 @@ CONFIG_NODE_ROOT = "InfiniteWisdom"
 CONFIG_NODE_TELEGRAM = "telegram"
 CONFIG_NODE_CRAWLER = "crawler"
 CONFIG_NODE_UPLOADER = "uploader"
+CONFIG_NODE_SCRUBBER = "scrubber"
 CONFIG_NODE_PERSISTENCE = "persistence"
 CONFIG_NODE_IMAGE_ANALYSIS = "image_analysis"
 CONFIG_NODE_INTERVAL = "interval"
@@ -58,8 +75,24 @@ CONFIG_NODE_PORT = "port"
 CONFIG_NODE_TESSERACT = "tesseract"
 CONFIG_NODE_GOOGLE_VISION = "google_vision"
 CONFIG_NODE_MICROSOFT_AZURE = "microsoft_azure"
+CONFIG_NODE_PREPROCESSING = "preprocessing"
 
 CONFIG_NODE_ENABLED = "enabled"
 CONFIG_NODE_CAPACITY_PER_MONTH = "capacity_per_month"
+CONFIG_NODE_CONCURRENCY = "concurrency"
 
 REQUESTS_TIMEOUT = (5, 5)
+# maximum size of a downloaded image in bytes
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+# size of the chunks an image is downloaded in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# maximum number of concurrent requests (and pooled connections) per host
+HTTP_MAX_CONNECTIONS_PER_HOST = 8
+# number of retries for failed requests
+HTTP_RETRIES = 3
+# base delay in seconds for the exponential backoff between retries
+HTTP_BACKOFF_FACTOR = 0.5
+# upper limit in seconds for a single backoff delay
+HTTP_BACKOFF_MAX = 30
+# maximum time in seconds to wait for a free pooled connection
+HTTP_POOL_TIMEOUT = 30
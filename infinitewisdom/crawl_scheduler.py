@@ -0,0 +1,149 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import threading
+import time
+from collections import deque
+
+from infinitewisdom.stats import CRAWLER_CURRENT_INTERVAL, CRAWLER_NOVELTY_RATIO
+
+LOGGER = logging.getLogger(__name__)
+
+# smallest interval in seconds used when backing off, so a minimum interval of 0 can be doubled
+MIN_BACKOFF_INTERVAL = 1.0
+
+
+class IntervalRateLimiter:
+    """
+    Limits the rate of an action to once per interval, shared by all threads
+    """
+
+    def __init__(self, interval: float):
+        """
+        :param interval: minimum time in seconds between two actions
+        """
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def set_interval(self, interval: float):
+        """
+        :param interval: new minimum time in seconds between two actions
+        """
+        with self._lock:
+            self._interval = interval
+
+    def acquire(self, cancel_event: threading.Event = None):
+        """
+        Blocks until the action may be executed
+        :param cancel_event: event that ends waiting early when it is set
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self._interval
+        if wait_time > 0:
+            if cancel_event is None:
+                time.sleep(wait_time)
+            else:
+                cancel_event.wait(wait_time)
+
+
+class AdaptiveCrawlScheduler:
+    """
+    Adapts the interval between image api requests to the ratio of new images in the most recent results.
+    The interval is doubled while only few new images are found (up to a maximum)
+    and halved again (down to the minimum) when the ratio of new images rises.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, window: int, min_novelty: float):
+        """
+        :param min_interval: shortest interval in seconds between two requests
+        :param max_interval: longest interval in seconds between two requests
+        :param window: number of most recent results to calculate the novelty ratio from
+        :param min_novelty: ratio of new images below which the crawler backs off,
+                            it speeds up again above twice this ratio
+        """
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+        self._min_novelty = min_novelty
+        self._interval = min_interval
+        self._rate_limiter = IntervalRateLimiter(min_interval)
+
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)
+        # the interval is reevaluated after this many new results
+        self._evaluation_period = max(1, window // 4)
+        self._results_since_evaluation = 0
+
+        CRAWLER_CURRENT_INTERVAL.set(self._interval)
+
+    def acquire(self, cancel_event: threading.Event = None):
+        """
+        Blocks until the next request may be executed
+        :param cancel_event: event that ends waiting early when it is set
+        """
+        self._rate_limiter.acquire(cancel_event)
+
+    def record(self, novel: bool):
+        """
+        Records the result of a request
+        :param novel: True if the request resulted in a new image, False if it was a duplicate
+        """
+        with self._lock:
+            self._results.append(novel)
+            self._results_since_evaluation += 1
+            if self._results_since_evaluation < self._evaluation_period:
+                return
+            self._results_since_evaluation = 0
+
+            novelty = self.get_novelty()
+            CRAWLER_NOVELTY_RATIO.set(novelty)
+
+            if len(self._results) < self._results.maxlen:
+                # not enough data yet
+                return
+
+            if novelty < self._min_novelty:
+                interval = min(max(self._interval * 2, MIN_BACKOFF_INTERVAL), self._max_interval)
+            elif novelty >= 2 * self._min_novelty:
+                interval = self._interval / 2
+                if interval < MIN_BACKOFF_INTERVAL:
+                    interval = self._min_interval
+                interval = max(interval, self._min_interval)
+            else:
+                return
+
+            if interval != self._interval:
+                LOGGER.debug("Novelty ratio is {:.2f}, changing crawl interval from {:.2f} to {:.2f} seconds".format(
+                    novelty, self._interval, interval))
+                self._interval = interval
+                self._rate_limiter.set_interval(interval)
+                CRAWLER_CURRENT_INTERVAL.set(interval)
+
+    def get_novelty(self) -> float:
+        """
+        :return: ratio of new images in the most recent results
+        """
+        if len(self._results) <= 0:
+            return 1.0
+        return sum(self._results) / len(self._results)
+
+    def get_interval(self) -> float:
+        """
+        :return: the current interval in seconds
+        """
+        return self._interval
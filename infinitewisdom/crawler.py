@@ -14,29 +14,50 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+import os
+import queue
+import threading
 import time
 
-import requests
-
-from infinitewisdom import RegularIntervalWorker
 from infinitewisdom.analysis import ImageAnalyser
 from infinitewisdom.analysis.worker import AnalysisWorker
 from infinitewisdom.config.config import AppConfig
-from infinitewisdom.const import REQUESTS_TIMEOUT
+from infinitewisdom.crawl_scheduler import AdaptiveCrawlScheduler
 from infinitewisdom.persistence import ImageDataPersistence
 from infinitewisdom.persistence.sqlalchemy import Image, _session_scope
-from infinitewisdom.stats import CRAWLER_TIME
+from infinitewisdom.stats import CRAWLER_STAGE_TIME, CRAWLER_QUEUE_LENGTH
 from infinitewisdom.uploader import TelegramUploader
-from infinitewisdom.util import download_image_bytes, create_hash
+from infinitewisdom.url_filter import BloomFilter
+from infinitewisdom.util import download_image, HTTP_CLIENT
 
 LOGGER = logging.getLogger(__name__)
 
+STAGE_URL = "url"
+STAGE_DOWNLOAD = "download"
+STAGE_HASH = "hash"
+STAGE_PERSIST = "persist"
+
+# seconds to wait for a queue item before checking if the crawler has been stopped
+QUEUE_POLL_TIMEOUT = 1
+
+URL_FILTER_FILE_NAME = "url_filter.bin"
+# seconds between two saves of the url filter
+URL_FILTER_SAVE_INTERVAL = 60
+# urls of entities changed this many seconds before the last save are added again after loading the url filter,
+# to cover entities that were still being persisted while saving
+URL_FILTER_SAVE_MARGIN = 300
+
 
-class Crawler(RegularIntervalWorker):
+class Crawler:
     """
-    Crawler used to fetch new images from the image API
+    Crawler used to fetch new images from the image API.
+
+    Crawling is split into a pipeline of stages (url generation, download, deduplication and persistence),
+    each running in its own configurable number of threads and connected by bounded queues.
+    Requests to the image API are limited to one per interval, regardless of the number of threads.
+    The interval grows while mostly known images are returned and shrinks again when new images show up.
+    Already processed urls are skipped using a bloom filter that is persisted to disk.
     """
-    URL_CACHE = {}
 
     def __init__(self, config: AppConfig, persistence: ImageDataPersistence,
                  telegram_uploader: TelegramUploader, image_analysers: [ImageAnalyser],
@@ -45,30 +66,191 @@ class Crawler(RegularIntervalWorker):
         Creates a crawler instance.
         :param persistence: crawled data is added here
         """
-        super().__init__(config.CRAWLER_INTERVAL.value)
         self._persistence = persistence
         self._image_analysers = image_analysers
         self._telegram_uploader = telegram_uploader
         self._analysis_worker = analysis_worker
 
-    @CRAWLER_TIME.time()
-    def _run(self):
-        with _session_scope() as session:
-            self._add_image_url_to_pool(session)
+        self._scheduler = AdaptiveCrawlScheduler(
+            min_interval=config.CRAWLER_INTERVAL.value,
+            max_interval=config.CRAWLER_MAX_INTERVAL.value,
+            window=config.CRAWLER_NOVELTY_WINDOW.value,
+            min_novelty=config.CRAWLER_MIN_NOVELTY.value)
+
+        self._url_filter_file_path = os.path.join(config.FILE_PERSISTENCE_BASE_PATH.value, URL_FILTER_FILE_NAME)
+        self._url_filter = self._load_url_filter(config.CRAWLER_URL_FILTER_CAPACITY.value,
+                                                 config.CRAWLER_URL_FILTER_ERROR_RATE.value)
+        self._url_filter_saved = time.time()
+        # guards the time of the last save, so only one persist worker saves the url filter
+        self._url_filter_save_lock = threading.Lock()
+
+        queue_size = config.CRAWLER_QUEUE_SIZE.value
+        self._download_queue = queue.Queue(maxsize=queue_size)
+        self._hash_queue = queue.Queue(maxsize=queue_size)
+        self._persist_queue = queue.Queue(maxsize=queue_size)
+
+        self._stage_workers = {
+            STAGE_URL: config.CRAWLER_URL_WORKERS.value,
+            STAGE_DOWNLOAD: config.CRAWLER_DOWNLOAD_WORKERS.value,
+            STAGE_HASH: config.CRAWLER_HASH_WORKERS.value,
+            STAGE_PERSIST: config.CRAWLER_PERSIST_WORKERS.value,
+        }
 
-    def _add_image_url_to_pool(self, session) -> str or None:
+        # hashes of images that are currently on their way to the persistence
+        self._pending_hashes = set()
+        self._lock = threading.Lock()
+
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
         """
-        Requests a new image url and adds it to the pool
-        :return: the added url
+        Starts the worker threads of all stages
+        """
+        if len(self._threads) > 0:
+            LOGGER.debug("Already running, ignoring start() call")
+            return
+
+        LOGGER.debug("Starting crawler with workers: {}".format(self._stage_workers))
+        self._stop_event.clear()
+        stages = {
+            STAGE_URL: (None, self._generate_url),
+            STAGE_DOWNLOAD: (self._download_queue, self._download),
+            STAGE_HASH: (self._hash_queue, self._hash),
+            STAGE_PERSIST: (self._persist_queue, self._persist),
+        }
+        for stage, (source, target) in stages.items():
+            for i in range(self._stage_workers[stage]):
+                thread = threading.Thread(target=self._run_stage, args=(stage, source, target),
+                                          name="crawler-{}-{}".format(stage, i), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stops all worker threads and discards the images that are still queued
+        """
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._clear_queues()
+        self._save_url_filter()
+
+    def _clear_queues(self):
+        """
+        Removes all queued items and the temporary files of queued images
+        """
+        self._drain(self._download_queue)
+        for url, temp_file_path, image_hash in self._drain(self._hash_queue) + self._drain(self._persist_queue):
+            self._remove_temp_file(temp_file_path)
+        with self._lock:
+            self._pending_hashes.clear()
+        self._update_queue_stats()
+
+    def _run_stage(self, stage: str, source: queue.Queue or None, target):
+        """
+        Runs a single stage until the crawler is stopped
+        :param stage: name of the stage
+        :param source: queue to take items from, None if the stage creates items on its own
+        :param target: function processing a single item of this stage
+        """
+        stage_time = CRAWLER_STAGE_TIME.labels(stage=stage)
+        while not self._stop_event.is_set():
+            if source is None:
+                args = []
+            else:
+                item = self._get(source)
+                if item is None:
+                    continue
+                args = [item]
+
+            try:
+                with stage_time.time():
+                    target(*args)
+            except Exception as e:
+                LOGGER.error(e, exc_info=True)
+            finally:
+                self._update_queue_stats()
+
+    def _generate_url(self):
         """
+        Requests a new image url from the image api
+        """
+        self._scheduler.acquire(self._stop_event)
+        if self._stop_event.is_set():
+            return
         url = self._fetch_generated_image_url()
-        if url in self.URL_CACHE:
+        if url in self._url_filter:
             # skip already processed url
-            return None
+            self._scheduler.record(novel=False)
+            return
+        self._put(self._download_queue, url)
+
+    def _download(self, url: str):
+        """
+        Streams the image data of a generated url to a temporary file of the image data store, hashing it on the way
+        :param url: image url
+        """
+        temp_file, temp_file_path = self._persistence.create_temp_image_file()
+        try:
+            with temp_file:
+                image_hash = download_image(url, temp_file)
+        except BaseException:
+            self._remove_temp_file(temp_file_path)
+            raise
+
+        if not self._put(self._hash_queue, (url, temp_file_path, image_hash)):
+            self._remove_temp_file(temp_file_path)
+
+    def _hash(self, item: (str, str, str)):
+        """
+        Drops downloaded images whose hash is already on its way to the persistence
+        :param item: image url, temporary file path and hash
+        """
+        url, temp_file_path, image_hash = item
+
+        with self._lock:
+            if image_hash in self._pending_hashes:
+                self._remove_temp_file(temp_file_path)
+                self._url_filter.add(url)
+                self._scheduler.record(novel=False)
+                return
+            self._pending_hashes.add(image_hash)
+
+        if not self._put(self._persist_queue, item):
+            self._remove_temp_file(temp_file_path)
+            with self._lock:
+                self._pending_hashes.discard(image_hash)
+
+    def _persist(self, item: (str, str, str)):
+        """
+        Adds a downloaded image to the pool
+        :param item: image url, temporary file path and hash
+        """
+        url, temp_file_path, image_hash = item
+        try:
+            with _session_scope() as session:
+                added_url = self._add_image_to_pool(session, url, temp_file_path, image_hash)
+            self._scheduler.record(novel=added_url is not None)
+        finally:
+            # the file has been moved if the image was added
+            self._remove_temp_file(temp_file_path)
+            with self._lock:
+                self._pending_hashes.discard(image_hash)
 
-        image_data = download_image_bytes(url)
-        image_hash = create_hash(image_data)
+        self._url_filter.add(url)
+        self._url_filter.publish_stats()
+        self._save_url_filter(force=False)
 
+    def _add_image_to_pool(self, session, url: str, image_file_path: str, image_hash: str) -> str or None:
+        """
+        Adds a new image to the pool
+        :param url: image url
+        :param image_file_path: path of the temporary image data file
+        :param image_hash: hash of the image data
+        :return: the added url
+        """
         existing = self._persistence.find_by_image_hash(session, image_hash)
         if existing is not None:
             if existing.url != url:
@@ -76,26 +258,116 @@ class Crawler(RegularIntervalWorker):
                     'Found already known image hash for a different url than expected. Old: {} New: {} Hash: {}'.format(
                         existing.url, url, image_hash))
                 existing.url = url
+                with open(image_file_path, 'rb') as f:
+                    image_data = f.read()
                 self._persistence.update(session, existing, image_data)
                 self._telegram_uploader.add_image_to_queue(existing.id)
-            self.URL_CACHE[url] = True
             return None
 
         entity = Image(url=url, created=time.time())
-        self._persistence.add(session, entity, image_data)
+        self._persistence.add_file(session, entity, image_hash, image_file_path)
         self._telegram_uploader.add_image_to_queue(entity.id)
         self._analysis_worker.add_image_to_queue(entity.id)
-        LOGGER.debug('Added image #{} with URL: "{}"'.format(self._persistence.count(session), url))
-
-        self.URL_CACHE[url] = True
+        LOGGER.debug('Added image #{} with URL: "{}"'.format(entity.id, url))
         return url
 
+    def _load_url_filter(self, capacity: int, error_rate: float) -> BloomFilter:
+        """
+        Loads the persisted url filter and adds urls that have been changed since it was saved.
+        If there is no usable persisted filter a new one is created from all known urls.
+        :param capacity: expected number of urls
+        :param error_rate: desired false positive rate
+        :return: url filter
+        """
+        with _session_scope(False) as session:
+            url_filter, timestamp = BloomFilter.load(self._url_filter_file_path)
+            if url_filter is not None and url_filter.get_false_positive_rate() <= error_rate:
+                for url in self._persistence.get_all_urls(session, timestamp - URL_FILTER_SAVE_MARGIN):
+                    url_filter.add(url)
+                LOGGER.debug("Loaded url filter with {} urls".format(len(url_filter)))
+            else:
+                # leave room for future urls
+                capacity = max(capacity, 2 * self._persistence.count(session))
+                url_filter = BloomFilter(capacity, error_rate)
+                for url in self._persistence.get_all_urls(session):
+                    url_filter.add(url)
+                LOGGER.debug("Created url filter with {} urls".format(len(url_filter)))
+
+        url_filter.publish_stats()
+        return url_filter
+
+    @staticmethod
+    def _remove_temp_file(file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def _save_url_filter(self, force: bool = True):
+        """
+        Saves the url filter to disk
+        :param force: False to only save the filter if the save interval has passed
+        """
+        with self._url_filter_save_lock:
+            now = time.time()
+            if not force and now - self._url_filter_saved <= URL_FILTER_SAVE_INTERVAL:
+                return
+            self._url_filter_saved = now
+            os.makedirs(os.path.dirname(self._url_filter_file_path) or ".", exist_ok=True)
+            self._url_filter.save(self._url_filter_file_path, now)
+
+    @staticmethod
+    def _get(source: queue.Queue):
+        """
+        Takes the next item from a queue
+        :param source: the queue
+        :return: the item or None if no item was available in time
+        """
+        try:
+            return source.get(timeout=QUEUE_POLL_TIMEOUT)
+        except queue.Empty:
+            return None
+
+    @staticmethod
+    def _drain(source: queue.Queue) -> list:
+        """
+        Takes all items from a queue
+        :param source: the queue
+        :return: the items
+        """
+        items = []
+        while True:
+            try:
+                items.append(source.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        """
+        Adds an item to a queue, waiting for free space as long as the crawler is running
+        :param target: the queue
+        :param item: the item
+        :return: True if the item was added, False if the crawler was stopped in the meantime
+        """
+        while not self._stop_event.is_set():
+            try:
+                target.put(item, timeout=QUEUE_POLL_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _update_queue_stats(self):
+        CRAWLER_QUEUE_LENGTH.labels(stage=STAGE_DOWNLOAD).set(self._download_queue.qsize())
+        CRAWLER_QUEUE_LENGTH.labels(stage=STAGE_HASH).set(self._hash_queue.qsize())
+        CRAWLER_QUEUE_LENGTH.labels(stage=STAGE_PERSIST).set(self._persist_queue.qsize())
+
     @staticmethod
     def _fetch_generated_image_url() -> str:
         """
         Requests the image api to generate a new image url
         :return: the image url
         """
-        url_page = requests.get('https://inspirobot.me/api', params={'generate': 'true'}, timeout=REQUESTS_TIMEOUT)
+        url_page = HTTP_CLIENT.get('https://inspirobot.me/api', params={'generate': 'true'})
         url_page.raise_for_status()
         return url_page.text
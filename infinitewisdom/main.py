@@ -30,11 +30,15 @@ if __name__ == '__main__':
     from infinitewisdom.analysis.googlevision import GoogleVision
     from infinitewisdom.analysis.microsoftazure import AzureComputerVision
     from infinitewisdom.analysis.tesseract import Tesseract
+    from infinitewisdom.analysis.tesseract_api import TesseractApi
     from infinitewisdom.analysis.worker import AnalysisWorker
     from infinitewisdom.bot import InfiniteWisdomBot
     from infinitewisdom.config.config import AppConfig
+    from infinitewisdom.const import TESSERACT_ENGINE_TESSEROCR
     from infinitewisdom.crawler import Crawler
     from infinitewisdom.persistence import ImageDataPersistence
+    from infinitewisdom.persistence.statistics import StatisticsReconciler
+    from infinitewisdom.scrubber import ImageDataScrubber
     from infinitewisdom.uploader import TelegramUploader
 
     config = AppConfig()
@@ -48,16 +52,26 @@ if __name__ == '__main__':
 
     image_analysers = []
     if config.IMAGE_ANALYSIS_TESSERACT_ENABLED.value:
-        image_analysers.append(Tesseract())
+        if config.IMAGE_ANALYSIS_TESSERACT_ENGINE.value == TESSERACT_ENGINE_TESSEROCR:
+            try:
+                image_analysers.append(TesseractApi())
+            except ImportError as e:
+                LOGGER.warning("tesserocr is not available, falling back to pytesseract: {}".format(e))
+                image_analysers.append(Tesseract())
+        else:
+            image_analysers.append(Tesseract())
     if config.IMAGE_ANALYSIS_GOOGLE_VISION_ENABLED.value:
         auth_file = config.IMAGE_ANALYSIS_GOOGLE_VISION_AUTH_FILE.value
         capacity = config.IMAGE_ANALYSIS_GOOGLE_VISION_CAPACITY.value
-        image_analysers.append(GoogleVision(auth_file, capacity))
+        batch_size = config.IMAGE_ANALYSIS_GOOGLE_VISION_BATCH_SIZE.value
+        concurrency = config.IMAGE_ANALYSIS_GOOGLE_VISION_CONCURRENCY.value
+        image_analysers.append(GoogleVision(auth_file, capacity, batch_size, concurrency))
     if config.IMAGE_ANALYSIS_MICROSOFT_AZURE_ENABLED.value:
         key = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_SUBSCRIPTION_KEY.value
         region = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_REGION.value
         capacity = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_CAPACITY.value
-        image_analysers.append(AzureComputerVision(key, region, capacity))
+        concurrency = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_CONCURRENCY.value
+        image_analysers.append(AzureComputerVision(key, region, capacity, concurrency))
 
     # start prometheus server
     start_http_server(config.STATS_PORT.value)
@@ -66,9 +80,18 @@ if __name__ == '__main__':
     telegram_uploader = TelegramUploader(config, persistence, wisdom_bot._updater.bot)
     analysis_worker = AnalysisWorker(config, persistence, image_analysers)
     crawler = Crawler(config, persistence, telegram_uploader, image_analysers, analysis_worker)
+    statistics_reconciler = StatisticsReconciler(config.STATS_RECONCILE_INTERVAL.value, persistence)
+    image_data_scrubber = ImageDataScrubber(config, persistence)
 
     crawler.start()
+    statistics_reconciler.start()
+    image_data_scrubber.start()
     analysis_worker.start()
     telegram_uploader.start()
 
-    wisdom_bot.start()
+    try:
+        # blocks until the bot is shut down
+        wisdom_bot.start()
+    finally:
+        # saves the url filter and removes temporary files of images that are still in the pipeline
+        crawler.stop()
@@ -14,22 +14,57 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+import os
+import time
 
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Iterator, Dict, BinaryIO, Tuple
 
+from infinitewisdom.analysis import ImageAnalyser
 from infinitewisdom.config.config import AppConfig
-from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_TESSERACT, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION, \
-    IMAGE_ANALYSIS_TYPE_AZURE, IMAGE_ANALYSIS_TYPE_HUMAN
-from infinitewisdom.persistence.image_persistence import ImageDataStore
-from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, BotToken, _session_scope
-from infinitewisdom.stats import POOL_SIZE, TELEGRAM_ENTITIES_COUNT, IMAGE_ANALYSIS_TYPE_COUNT, \
-    IMAGE_ANALYSIS_HAS_TEXT_COUNT, ENTITIES_WITH_IMAGE_DATA_COUNT
-from infinitewisdom.util import create_hash
+from infinitewisdom.const import FILE_PERSISTENCE_STORE_PACKED
+from infinitewisdom.persistence.cached_image_persistence import CachedImageDataStore
+from infinitewisdom.persistence.image_persistence import ImageDataStore, FileImageDataStore
+from infinitewisdom.persistence.packed_image_persistence import PackedImageDataStore
+from infinitewisdom.persistence.random_index import RandomIdIndex
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, BotToken, AnalysisResult, \
+    _session_scope
+from infinitewisdom.persistence.statistics import PersistenceStatistics, EntityState, ANALYSER_TYPES
+from infinitewisdom.persistence.text_index import InvertedTextIndex
+from infinitewisdom.util import create_hash, hash_bot_token
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _get_column_stats_state(entity: Image) -> EntityState:
+    """
+    :param entity: the entity
+    :return: the statistics relevant state of the columns of the given entity, without its telegram uploads
+    """
+    return EntityState(has_image_data=entity.image_hash is not None,
+                       uploaded=False,
+                       analyser=entity.analyser,
+                       has_text=entity.text is not None and len(entity.text) > 0)
+
+
+@event.listens_for(Image, "load")
+def _remember_stats_state(entity: Image, context):
+    """
+    Remembers the state of a loaded entity before it is changed, the stored state may already
+    contain the changes once they are (auto-)flushed
+    """
+    entity.stats_state = _get_column_stats_state(entity)
+
+
+def get_packed_store_path(base_path: str) -> str:
+    """
+    :param base_path: the configured image data base path
+    :return: the directory used by the packed image data store
+    """
+    return os.path.join(base_path, "packed")
+
+
 class ImageDataPersistence:
     """
     Persistence main class
@@ -39,10 +74,36 @@ class ImageDataPersistence:
         self._config = config
 
         self._database = SQLAlchemyPersistence(config.SQL_PERSISTENCE_URL.value)
-        self._image_data_store = ImageDataStore(config.FILE_PERSISTENCE_BASE_PATH.value)
+        self._image_data_store = self._create_image_data_store(config)
+        self._hashed_bot_token = hash_bot_token(config.TELEGRAM_BOT_TOKEN.value)
+        self._stats = PersistenceStatistics()
 
         with _session_scope() as session:
-            self._update_stats(session)
+            self._random_id_index = RandomIdIndex(self._database.get_all_ids(session))
+            if config.PERSISTENCE_IN_MEMORY_TEXT_INDEX.value:
+                self._text_index = InvertedTextIndex(self._database.get_all_texts(session))
+                LOGGER.debug("In-memory text index loaded: {} entities".format(len(self._text_index)))
+            else:
+                self._text_index = None
+            self.reconcile_stats(session)
+
+    @staticmethod
+    def _create_image_data_store(config: AppConfig) -> ImageDataStore:
+        """
+        Creates the image data store selected in the given configuration
+        :param config: the configuration
+        :return: image data store
+        """
+        base_path = config.FILE_PERSISTENCE_BASE_PATH.value
+        if config.FILE_PERSISTENCE_STORE.value == FILE_PERSISTENCE_STORE_PACKED:
+            store = PackedImageDataStore(get_packed_store_path(base_path), config.FILE_PERSISTENCE_SEGMENT_SIZE.value)
+        else:
+            store = FileImageDataStore(base_path)
+
+        cache_size = config.FILE_PERSISTENCE_CACHE_SIZE.value
+        if cache_size > 0:
+            store = CachedImageDataStore(store, cache_size)
+        return store
 
     def get_bot_token(self, session: Session, bot_token: str) -> BotToken:
         """
@@ -62,13 +123,36 @@ class ImageDataPersistence:
         :param image: the entity to add
         :param image_data: image data
         """
-        try:
-            image_hash = create_hash(image_data)
-            image.image_hash = image_hash
-            self._database.add(session, image)
-            self._image_data_store.put(image_hash, image_data)
-        finally:
-            self._update_stats(session)
+        image_hash = create_hash(image_data)
+        self._add(session, image, image_hash)
+        self._image_data_store.put(image_hash, image_data)
+
+    def add_file(self, session: Session, image: Image, image_hash: str, file_path: str) -> None:
+        """
+        Persists a new entity with image data from a file created by create_temp_image_file
+        :param image: the entity to add
+        :param image_hash: hash of the image data
+        :param file_path: path of the image data file, the file is moved (or removed) by this call
+        """
+        self._add(session, image, image_hash)
+        self._image_data_store.put_file(image_hash, file_path)
+
+    def _add(self, session: Session, image: Image, image_hash: str) -> None:
+        image.image_hash = image_hash
+        self._database.add(session, image)
+        self._stats.added(self._get_stats_state(image))
+        image.stats_state = _get_column_stats_state(image)
+        image.newly_uploaded_by = frozenset()
+        self._random_id_index.add(image.id)
+        if self._text_index is not None:
+            self._text_index.update(image.id, image.text)
+
+    def create_temp_image_file(self) -> Tuple[BinaryIO, str]:
+        """
+        Creates a temporary file in the image data store, see add_file
+        :return: the opened file and its path
+        """
+        return self._image_data_store.create_temp_file()
 
     def has_image_data(self, entity: Image) -> bool:
         """
@@ -86,6 +170,26 @@ class ImageDataPersistence:
         """
         return self._image_data_store.get(entity.image_hash)
 
+    def get_image_hashes(self) -> Iterator[str]:
+        """
+        :return: the hashes of all stored image data
+        """
+        return self._image_data_store.get_hashes()
+
+    def verify_image_data(self, image_hash: str) -> bool:
+        """
+        Verifies stored image data against its hash and removes it if it is corrupted.
+        Removed image data is downloaded again when it is needed the next time.
+        :param image_hash: image hash
+        :return: True if the image data is valid, False otherwise
+        """
+        if self._image_data_store.verify(image_hash):
+            return True
+
+        LOGGER.warning("Removing corrupted image data: {}".format(image_hash))
+        self._image_data_store.put(image_hash, None)
+        return False
+
     def get_random(self, session: Session, page_size: int = None) -> Image or [Image]:
         """
         Returns a random entity or number of random entities depending on parameters.
@@ -93,7 +197,54 @@ class ImageDataPersistence:
         :param page_size: number of elements to return
         :return: the entity
         """
-        return self._database.get_random(session, page_size)
+        count = 1 if page_size is None else page_size
+        entities = self._sample_random(session, count)
+
+        if page_size is None:
+            return entities[0] if len(entities) > 0 else None
+        else:
+            return entities
+
+    def _sample_random(self, session: Session, count: int, attempts: int = 3) -> [Image]:
+        """
+        Draws random entities using the in-memory id index
+        :param count: number of distinct entities to return
+        :param attempts: number of times to redraw ids that have been deleted in the meantime
+        :return: list of at most count entities in random order
+        """
+        if len(self._random_id_index) <= 0:
+            # nothing indexed (yet), let the database decide
+            entities = self._database.get_random(session, count)
+            for entity in entities:
+                self._random_id_index.add(entity.id)
+            return entities
+
+        result = {}
+        for _ in range(attempts):
+            missing = count - len(result)
+            if missing <= 0:
+                break
+            sample = list(filter(lambda x: x not in result, self._random_id_index.sample(count)))[:missing]
+            if len(sample) <= 0:
+                break
+
+            entities = {e.id: e for e in self._database.get_by_ids(session, sample)}
+            for entity_id in sample:
+                entity = entities.get(entity_id, None)
+                if entity is None:
+                    # the entity has been removed in the meantime
+                    self._random_id_index.remove(entity_id)
+                else:
+                    result[entity_id] = entity
+
+        return list(result.values())
+
+    def get_all_urls(self, session: Session, changed_after: float = None) -> Iterator[str]:
+        """
+        :param changed_after: only return urls of entities created or updated after this timestamp
+        :return: the urls of all entities
+        """
+        return self._database.get_all_urls(session, changed_after)
 
     def find_by_url(self, session: Session, url: str) -> [Image]:
         """
@@ -119,6 +270,15 @@ class ImageDataPersistence:
         """
         return self._database.find_by_telegram_file_id(session, telegram_file_id)
 
+    def find_telegram_file_ids(self, session: Session, bot_token: str, image_ids: [int]) -> Dict[int, str]:
+        """
+        Finds a telegram file id for each of the given images that can be used with the given bot token
+        :param bot_token: the bot token
+        :param image_ids: ids of the image entities
+        :return: dictionary of image id -> telegram file id (images without a matching file id are omitted)
+        """
+        return self._database.find_telegram_file_ids(session, bot_token, image_ids)
+
     def find_by_text(self, session: Session, text: str = None, limit: int = None, offset: int = None) -> [Image]:
         """
         Finds a list of entities containing the given text
@@ -127,26 +287,41 @@ class ImageDataPersistence:
         :param offset: item offset
         :return: list of entities
         """
-        return self._database.find_by_text(session, text, limit, offset)
+        if self._text_index is None:
+            return self._database.find_by_text(session, text, limit, offset)
+
+        if limit is None:
+            limit = 16
+        if offset is None:
+            offset = 0
 
-    def find_non_optimal(self, session: Session, target_quality: int) -> Image or None:
+        entity_ids = self._text_index.search(text)[offset:offset + limit]
+        entities = {e.id: e for e in self._database.get_by_ids(session, entity_ids)}
+        return [entities[entity_id] for entity_id in entity_ids if entity_id in entities]
+
+    def find_non_optimal(self, session: Session, target_quality: float, after: tuple or None = None,
+                         limit: int = 1000) -> [Tuple[tuple, int]]:
         """
-        Finds an image with suboptimal analysis quality.
+        Finds a page of images with suboptimal analysis quality.
 
-        If multiple images exist they are sorted by the following criteria:
-          - quality (None first, lowest first)
+        Images are sorted by the following criteria:
+          - never analysed first, then lowest quality first
+          - images without text first
           - date (oldest first)
 
         :param target_quality: the target quality to reach
-        :return: a non-optimal entity or None
+        :param after: sort key of the last image of the previous page, None to start with the first page
+        :param limit: maximum number of images to return
+        :return: list of (sort key, entity id) tuples
         """
-        return self._database.find_all_non_optimal(session, target_quality)
+        return self._database.find_non_optimal(session, target_quality, after, limit)
 
-    def get_not_uploaded_image_ids(self, session: Session, bot_token: str) -> List[int]:
+    def get_not_uploaded_image_ids(self, session: Session, bot_token: str) -> Iterator[int]:
         """
-        Finds an image that has not yet been uploaded to telegram servers
+        Finds the ids of all images that have not yet been uploaded to telegram servers.
+        The ids are streamed from the database in chunks, so the result must be consumed within the session.
         :param bot_token: the bot token
-        :return: entity or None
+        :return: iterator of image ids
         """
         return self._database.get_not_uploaded_image_ids(session, bot_token)
 
@@ -171,46 +346,110 @@ class ImageDataPersistence:
         :param entity: the entity with modified fields
         :param image_data: the image data of the entity, passing None will not change existing image data
         """
-        try:
-            existing_entity = self._database.find_by_image_hash(session, entity.image_hash)
-
-            new_hash = None
-            if image_data is not None:
-                new_hash = create_hash(image_data)
-
-            if new_hash is not None and existing_entity.image_hash != new_hash:
-                LOGGER.debug(
-                    "Hash changed from {} to {} for entity with url: {}".format(existing_entity.image_hash,
-                                                                                new_hash,
-                                                                                entity.url))
-                entity.image_hash = new_hash
-            if self.has_image_data(entity) is None:
-                self._image_data_store.put(entity.image_hash, image_data)
-                LOGGER.debug("Saved new image data for hash: {}".format(entity.image_hash))
-            self._database.update(session, entity)
-        finally:
-            self._update_stats(session)
-
-    def count_items_this_month(self, session: Session, analyser: str) -> int:
-        """
-        Returns the number of items added this month by the given analyser
+        stored_state = None
+        if entity.stats_state is None and entity.id is not None:
+            # the entity hasn't been loaded from the database
+            row = self._database.get_stats_state(session, entity.id, self._hashed_bot_token)
+            if row is not None:
+                stored_state = EntityState(has_image_data=bool(row[0]), uploaded=bool(row[1]), analyser=row[2],
+                                           has_text=bool(row[3]))
+
+        existing_entity = self._database.find_by_image_hash(session, entity.image_hash)
+
+        new_hash = None
+        if image_data is not None:
+            new_hash = create_hash(image_data)
+
+        if new_hash is not None and existing_entity.image_hash != new_hash:
+            LOGGER.debug(
+                "Hash changed from {} to {} for entity with url: {}".format(existing_entity.image_hash,
+                                                                            new_hash,
+                                                                            entity.url))
+            entity.image_hash = new_hash
+        if image_data is not None:
+            # this is cheap if the image data already exists
+            self._image_data_store.put(entity.image_hash, image_data)
+        self._database.update(session, entity)
+        if self._text_index is not None:
+            self._text_index.update(entity.id, entity.text)
+
+        if entity.stats_state is not None:
+            # uploads are tracked by add_file_id, so the telegram file ids don't have to be checked on every update
+            old_state = entity.stats_state
+            new_state = _get_column_stats_state(entity)._replace(
+                uploaded=self._hashed_bot_token in entity.newly_uploaded_by)
+        else:
+            old_state = stored_state
+            new_state = self._get_stats_state(entity)
+        self._stats.changed(old_state, new_state)
+        entity.stats_state = _get_column_stats_state(entity)
+        entity.newly_uploaded_by = frozenset()
+
+    def get_analysis_timestamps(self, session: Session, analyser: str, since: float) -> Iterator[float]:
+        """
+        Returns the time of the last change of all items analysed by the given analyser since the given time
         :param analyser: analyser to check
-        :return: number of items
-        """
-        return self._database.count_items_this_month(session, analyser)
+        :param since: timestamp
+        :return: timestamps
+        """
+        return self._database.get_analysis_timestamps(session, analyser, since)
+
+    def get_analysis_result(self, session: Session, image_hash: str, analyser: ImageAnalyser,
+                            version: str) -> AnalysisResult or None:
+        """
+        Finds a cached analysis result
+        :param image_hash: hash of the analysed image
+        :param analyser: the analyser
+        :param version: the current version of the analyser (including preprocessing), results of other
+        versions are not considered
+        :return: the analysis result or None if the image hasn't been analysed by this analyser (version) yet
+        """
+        if image_hash is None:
+            return None
+        return self._database.get_analysis_result(session, image_hash, analyser.get_identifier(), version)
+
+    def add_analysis_result(self, session: Session, image_hash: str, analyser: ImageAnalyser, version: str,
+                            text: str or None) -> None:
+        """
+        Caches an analysis result
+        :param image_hash: hash of the analysed image
+        :param analyser: the analyser used
+        :param version: the version of the analyser (including preprocessing)
+        :param text: recognized text
+        """
+        if image_hash is None:
+            return
+        self._database.add_analysis_result(session, AnalysisResult(
+            image_hash=image_hash,
+            analyser=analyser.get_identifier(),
+            analyser_version=version,
+            text=text,
+            quality=analyser.get_quality(),
+            created=time.time()))
+
+    def remove_outdated_analysis_results(self, session: Session, versions: {ImageAnalyser: str}) -> None:
+        """
+        Removes cached analysis results of older (or newer) versions of the given analysers
+        :param versions: analysers and their current version (including preprocessing)
+        """
+        for analyser, version in versions.items():
+            count = self._database.delete_analysis_results(session, analyser.get_identifier(), version)
+            if count > 0:
+                LOGGER.info("Removed {} outdated analysis results of '{}'".format(count, analyser.get_identifier()))
 
     def delete(self, session: Session, entity: Image) -> None:
         """
         Removes an entity from the persistence
         :param entity: the entity to delete
         """
-        try:
-            entity = self._database.find_by_image_hash(session, entity.image_hash)
-            if entity is not None:
-                self._image_data_store.put(entity.image_hash, None)
-                self._database.delete(session, entity.id)
-        finally:
-            self._update_stats(session)
+        entity = self._database.find_by_image_hash(session, entity.image_hash)
+        if entity is not None:
+            self._image_data_store.put(entity.image_hash, None)
+            self._database.delete(session, entity.id)
+            self._stats.removed(self._get_stats_state(entity))
+            self._random_id_index.remove(entity.id)
+            if self._text_index is not None:
+                self._text_index.remove(entity.id)
 
     def clear(self, session: Session) -> None:
         """
@@ -219,8 +458,11 @@ class ImageDataPersistence:
         try:
             self._database.clear()
             self._image_data_store.clear()
+            self._random_id_index.reset([])
+            if self._text_index is not None:
+                self._text_index = InvertedTextIndex()
         finally:
-            self._update_stats(session)
+            self.reconcile_stats(session)
 
     @staticmethod
     def _contains_words(words: [str], text):
@@ -240,33 +482,28 @@ class ImageDataPersistence:
 
         return True
 
-    def _update_stats(self, session: Session):
+    def reconcile_stats(self, session: Session):
         """
-        Updates prometheus statistics related to persistence
+        Recounts all prometheus statistics related to persistence
         """
-        POOL_SIZE.set(self.count(session))
-
-        entites_with_image_data_count = self.count_items_with_image_data(session)
-        ENTITIES_WITH_IMAGE_DATA_COUNT.set(entites_with_image_data_count)
-
         bot_token = self._config.TELEGRAM_BOT_TOKEN.value
-        uploaded_entites_count = self.count_items_with_telegram_upload(session, bot_token)
-        TELEGRAM_ENTITIES_COUNT.set(uploaded_entites_count)
-
-        tesseract_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_TESSERACT)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_TESSERACT).set(tesseract_entites_count)
-
-        google_vision_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION).set(google_vision_entites_count)
-
-        microsoft_azure_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_AZURE)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_AZURE).set(microsoft_azure_entites_count)
-
-        human_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_HUMAN)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_HUMAN).set(human_entites_count)
-
-        entities_with_text_count = self.count_items_with_text(session)
-        IMAGE_ANALYSIS_HAS_TEXT_COUNT.set(entities_with_text_count)
+        self._stats.set(
+            pool_size=self.count(session),
+            with_image_data=self.count_items_with_image_data(session),
+            uploaded=self.count_items_with_telegram_upload(session, bot_token),
+            with_text=self.count_items_with_text(session),
+            analysers={analyser: self.count_items_by_analyser(session, analyser) for analyser in ANALYSER_TYPES}
+        )
+
+    def _get_stats_state(self, entity: Image) -> EntityState:
+        """
+        :param entity: the entity
+        :return: the statistics relevant state of the given entity
+        """
+        uploaded = any(map(
+            lambda x: self._hashed_bot_token in map(lambda y: y.hashed_token, x.bot_tokens),
+            entity.telegram_file_ids))
+        return _get_column_stats_state(entity)._replace(uploaded=uploaded)
 
     def count_items_with_telegram_upload(self, session: Session, bot_token: str) -> int:
         """
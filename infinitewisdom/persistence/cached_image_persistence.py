@@ -0,0 +1,149 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterator, BinaryIO, Tuple
+
+from infinitewisdom.persistence.image_persistence import ImageDataStore
+from infinitewisdom.stats import IMAGE_DATA_CACHE_HITS, IMAGE_DATA_CACHE_MISSES, IMAGE_DATA_CACHE_EVICTIONS, \
+    IMAGE_DATA_CACHE_SIZE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CachedImageDataStore(ImageDataStore):
+    """
+    Image data store keeping recently used image data of another store in memory.
+    The cache is bounded by the total size of the cached image data,
+    the least recently used image data is evicted first.
+    """
+
+    def __init__(self, store: ImageDataStore, max_size: int):
+        """
+        :param store: the image data store to cache
+        :param max_size: maximum size of all cached image data in bytes
+        """
+        self._store = store
+        self._max_size = max_size
+        self._lock = Lock()
+        # image hash -> image data, least recently used first
+        self._cache = OrderedDict()
+        self._size = 0
+        # incremented on every write to detect writes while reading from the underlying store
+        self._generation = 0
+
+    def has(self, image_hash: str) -> bool:
+        with self._lock:
+            if image_hash in self._cache:
+                return True
+        return self._store.has(image_hash)
+
+    def get(self, image_hash: str) -> bytes or None:
+        with self._lock:
+            image_data = self._cache.get(image_hash, None)
+            if image_data is not None:
+                self._cache.move_to_end(image_hash)
+                IMAGE_DATA_CACHE_HITS.inc()
+                return image_data
+            generation = self._generation
+
+        IMAGE_DATA_CACHE_MISSES.inc()
+        image_data = self._store.get(image_hash)
+        if image_data is not None:
+            with self._lock:
+                # don't cache data that was replaced or removed in the meantime
+                if generation == self._generation:
+                    self._insert(image_hash, image_data)
+        return image_data
+
+    def put(self, image_hash: str, image_data: bytes or None):
+        self._store.put(image_hash, image_data)
+        if image_hash is None:
+            return
+
+        with self._lock:
+            self._generation += 1
+            self._remove(image_hash)
+            if image_data is not None:
+                # image data is usually read again shortly after it was added
+                self._insert(image_hash, image_data)
+
+    def create_temp_file(self) -> Tuple[BinaryIO, str]:
+        return self._store.create_temp_file()
+
+    def put_file(self, image_hash: str, file_path: str):
+        image_data = None
+        if os.path.getsize(file_path) <= self._max_size:
+            # image data is usually read again shortly after it was added
+            with open(file_path, 'rb') as f:
+                image_data = f.read()
+
+        self._store.put_file(image_hash, file_path)
+
+        with self._lock:
+            self._generation += 1
+            self._remove(image_hash)
+            if image_data is not None:
+                self._insert(image_hash, image_data)
+
+    def get_hashes(self) -> Iterator[str]:
+        return self._store.get_hashes()
+
+    def verify(self, image_hash: str) -> bool:
+        # always check the persisted data and don't pollute the cache
+        return self._store.verify(image_hash)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+            self._size = 0
+            IMAGE_DATA_CACHE_SIZE.set(0)
+        self._store.clear()
+
+    def _insert(self, image_hash: str, image_data: bytes):
+        """
+        Adds image data to the cache and evicts least recently used entries if necessary.
+        Must be called while holding the lock.
+        :param image_hash: image hash
+        :param image_data: image data
+        """
+        if len(image_data) > self._max_size:
+            return
+
+        self._remove(image_hash)
+        self._cache[image_hash] = image_data
+        self._size += len(image_data)
+
+        while self._size > self._max_size:
+            _, evicted = self._cache.popitem(last=False)
+            self._size -= len(evicted)
+            IMAGE_DATA_CACHE_EVICTIONS.inc()
+
+        IMAGE_DATA_CACHE_SIZE.set(self._size)
+
+    def _remove(self, image_hash: str):
+        """
+        Removes image data from the cache.
+        Must be called while holding the lock.
+        :param image_hash: image hash
+        """
+        image_data = self._cache.pop(image_hash, None)
+        if image_data is not None:
+            self._size -= len(image_data)
+            IMAGE_DATA_CACHE_SIZE.set(self._size)
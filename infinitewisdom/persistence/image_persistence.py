@@ -15,38 +15,33 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
 import os
+import re
+import tempfile
 from threading import Lock
+from typing import Iterator, BinaryIO, Tuple
 
 from infinitewisdom.util import create_hash
 
 LOGGER = logging.getLogger(__name__)
 
-lock = Lock()
+DEFAULT_LOCK_STRIPES = 64
+
+FILE_NAME_PATTERN = re.compile(r"^(\w+)\.jpg$")
+TEMP_FOLDER_NAME = "tmp"
 
 
 class ImageDataStore:
     """
-    Image data store
+    Base class for image data stores
     """
 
-    def __init__(self, base_path: str):
-        self._base_path = base_path
-
     def has(self, image_hash: str) -> bool:
         """
         Checks if image data for a given image_hash exists
         :param image_hash: expected image hash
         :return: True if data exists, False otherwise
         """
-        with lock:
-            return self._has(image_hash)
-
-    def _has(self, image_hash: str) -> bool:
-        if image_hash is None:
-            return False
-
-        file_path = self._get_file_path(image_hash)
-        return os.path.exists(file_path)
+        raise NotImplementedError()
 
     def get(self, image_hash: str) -> bytes or None:
         """
@@ -54,61 +49,209 @@ class ImageDataStore:
         :param image_hash: expected image hash
         :return: image bytes or None if no data exist
         """
-        with lock:
-            return self._get(image_hash)
-
-    def _get(self, image_hash: str) -> bytes or None:
-        if not self._has(image_hash):
-            return None
-
-        file_path = self._get_file_path(image_hash)
-        with open(file_path, 'rb') as f:
-            return f.read()
+        raise NotImplementedError()
 
     def put(self, image_hash: str, image_data: bytes or None):
         """
         Stores image data for
         :param image_hash: the image hash
-        :param image_data: the image data
+        :param image_data: the image data, None removes existing data
         """
-        with lock:
-            if image_hash is None:
-                LOGGER.debug("Trying to put with a None hash is ignored")
-                return
+        raise NotImplementedError()
+
+    def create_temp_file(self) -> Tuple[BinaryIO, str]:
+        """
+        Creates a temporary file that image data can be written to before it is added using put_file
+        :return: the opened file and its path
+        """
+        raise NotImplementedError()
+
+    def put_file(self, image_hash: str, file_path: str):
+        """
+        Stores the image data of a file created by create_temp_file.
+        The file is moved (or removed) by this call.
+        :param image_hash: the image hash
+        :param file_path: path of the temporary file
+        """
+        raise NotImplementedError()
+
+    def get_hashes(self) -> Iterator[str]:
+        """
+        :return: the hashes of all images in this store
+        """
+        raise NotImplementedError()
+
+    def verify(self, image_hash: str) -> bool:
+        """
+        Checks if the stored image data actually matches its hash.
+        This reads and hashes the complete image data.
+        :param image_hash: expected image hash
+        :return: True if the image data exists and is valid, False otherwise
+        """
+        image_data = self.get(image_hash)
+        return image_data is not None and create_hash(image_data) == image_hash
+
+    def clear(self):
+        """
+        Removes all image data
+        """
+        raise NotImplementedError()
+
+
+class FileImageDataStore(ImageDataStore):
+    """
+    Image data store using a single file per image.
+
+    Reads don't need any lock since files are only ever replaced atomically.
+    Writers of the same image hash are serialized using striped locks.
+    """
+
+    def __init__(self, base_path: str, lock_stripes: int = DEFAULT_LOCK_STRIPES):
+        """
+        :param base_path: directory to store image files in
+        :param lock_stripes: number of locks used to serialize writers
+        """
+        self._base_path = base_path
+        self._locks = [Lock() for _ in range(lock_stripes)]
+
+    def has(self, image_hash: str) -> bool:
+        if image_hash is None:
+            return False
+
+        file_path = self._get_file_path(image_hash)
+        return os.path.exists(file_path)
 
+    def get(self, image_hash: str) -> bytes or None:
+        if image_hash is None:
+            return None
+
+        file_path = self._get_file_path(image_hash)
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, image_hash: str, image_data: bytes or None):
+        if image_hash is None:
+            LOGGER.debug("Trying to put with a None hash is ignored")
+            return
+
+        with self._get_lock(image_hash):
             file_path = self._get_file_path(image_hash)
-            folder, file = os.path.split(file_path)
 
             if image_data is None:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if os.path.exists(folder) and len(os.listdir(folder)) == 0:
-                    os.rmdir(folder)
-
+                self._remove_file(file_path)
                 LOGGER.debug("Image data removed: {}".format(image_hash))
                 return
 
-            image = self._get(image_hash)
-            if image is not None:
-                existing_hash = create_hash(image)
-                if existing_hash != image_hash:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                    if os.path.exists(folder) and len(os.listdir(folder)) == 0:
-                        os.remove(folder)
-                else:
-                    LOGGER.debug("Image data already present: {}".format(image_hash))
-                    return
-
-            os.makedirs(folder, exist_ok=True)
-            with open(file_path, 'wb') as f:
-                f.write(image_data)
+            # the file name is the hash of its content, so a matching size is considered
+            # good enough here, full verification is done by the ImageDataScrubber
+            if self._get_file_size(file_path) == len(image_data):
+                LOGGER.debug("Image data already present: {}".format(image_hash))
+                return
+
+            self._write_file(file_path, image_data)
+            LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    def create_temp_file(self) -> Tuple[BinaryIO, str]:
+        temp_folder = os.path.join(self._base_path, TEMP_FOLDER_NAME)
+        os.makedirs(temp_folder, exist_ok=True)
+        fd, temp_file_path = tempfile.mkstemp(suffix=".tmp", dir=temp_folder)
+        return os.fdopen(fd, 'wb'), temp_file_path
+
+    def put_file(self, image_hash: str, file_path: str):
+        with self._get_lock(image_hash):
+            target_file_path = self._get_file_path(image_hash)
+            if self._get_file_size(target_file_path) == os.path.getsize(file_path):
+                os.remove(file_path)
+                LOGGER.debug("Image data already present: {}".format(image_hash))
+                return
+
+            folder, file = os.path.split(target_file_path)
+            while True:
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                    os.replace(file_path, target_file_path)
+                    break
+                except (FileNotFoundError, FileExistsError):
+                    if not os.path.exists(file_path):
+                        raise
+                    # the folder was removed by a concurrent delete of another image
 
             LOGGER.debug("Image data saved: {}".format(image_hash))
 
+    def get_hashes(self) -> Iterator[str]:
+        for _, _, files in os.walk(self._base_path):
+            for file in files:
+                match = FILE_NAME_PATTERN.match(file)
+                if match is not None:
+                    yield match.group(1)
+
     def clear(self):
-        with lock:
-            raise NotImplementedError()
+        raise NotImplementedError()
+
+    def _get_lock(self, image_hash: str) -> Lock:
+        """
+        :param image_hash: image hash
+        :return: the lock responsible for the given image hash
+        """
+        return self._locks[hash(image_hash) % len(self._locks)]
+
+    @staticmethod
+    def _write_file(file_path: str, image_data: bytes):
+        """
+        Writes image data to a temporary file and atomically moves it to its final location,
+        so readers never see partially written data
+        :param file_path: final file path
+        :param image_data: the data to write
+        """
+        folder, file = os.path.split(file_path)
+        while True:
+            try:
+                os.makedirs(folder, exist_ok=True)
+                fd, temp_file_path = tempfile.mkstemp(prefix=".{}".format(file), suffix=".tmp", dir=folder)
+                break
+            except (FileNotFoundError, FileExistsError):
+                # the folder was removed by a concurrent delete of another image,
+                # makedirs raises FileExistsError if that happens while it is checking the folder
+                continue
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image_data)
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            os.remove(temp_file_path)
+            raise
+
+    @staticmethod
+    def _get_file_size(file_path: str) -> int or None:
+        """
+        :param file_path: file path
+        :return: size of the file in bytes or None if it doesn't exist
+        """
+        try:
+            return os.path.getsize(file_path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove_file(file_path: str):
+        """
+        Removes an image file and its folder if it is empty afterwards
+        :param file_path: file path
+        """
+        folder, file = os.path.split(file_path)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(folder)
+        except OSError:
+            # folder doesn't exist or is not empty
+            pass
 
     def _get_file_path(self, image_hash) -> os.path:
         """
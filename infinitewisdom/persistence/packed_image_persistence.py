@@ -0,0 +1,340 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from collections import namedtuple
+from threading import RLock
+from typing import Iterator, BinaryIO, Tuple
+
+from infinitewisdom.persistence.image_persistence import ImageDataStore, TEMP_FOLDER_NAME
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+
+INDEX_FILE_NAME = "index.log"
+SEGMENT_FILE_PATTERN = re.compile(r"^segment-(\d+)\.dat$")
+
+INDEX_RECORD_PUT = "P"
+INDEX_RECORD_DELETE = "D"
+
+IndexEntry = namedtuple("IndexEntry", ["segment", "offset", "length"])
+
+
+class PackedImageDataStore(ImageDataStore):
+    """
+    Image data store that appends image data to large segment files.
+
+    The location of every image is recorded in an append-only index log
+    which is replayed on startup. Removed (or replaced) image data stays in its segment
+    until the store is compacted.
+
+    Reads use memory maps of the segment files and only need the lock
+    when a segment has to be (re)mapped. Memory maps are never closed explicitly
+    so readers can still use a map after its segment was removed.
+    """
+
+    def __init__(self, base_path: str, segment_size: int = DEFAULT_SEGMENT_SIZE, compaction_threshold: float = 0.5):
+        """
+        :param base_path: directory to store segment and index files in
+        :param segment_size: size in bytes after which a new segment file is started
+        :param compaction_threshold: ratio of unused bytes that triggers a compaction on startup
+        """
+        self._base_path = base_path
+        self._segment_size = segment_size
+        self._lock = RLock()
+
+        # image hash -> location of its data
+        self._index = {}
+        # segment number -> size of the segment file
+        self._segment_sizes = {}
+        # segment number -> read only memory map of the segment file
+        self._maps = {}
+
+        os.makedirs(self._base_path, exist_ok=True)
+        self._load()
+
+        self._index_file = open(self._get_index_file_path(), 'a')
+        self._active_segment = None
+        self._segment_file = None
+        self._open_segment(max(self._segment_sizes.keys(), default=1))
+
+        dead_ratio = self.get_dead_ratio()
+        if dead_ratio > compaction_threshold:
+            LOGGER.info("{:.0%} of packed image data is unused, compacting...".format(dead_ratio))
+            self.compact()
+
+    def has(self, image_hash: str) -> bool:
+        return image_hash in self._index
+
+    def get(self, image_hash: str) -> bytes or None:
+        entry = self._index.get(image_hash, None)
+        if entry is None:
+            return None
+
+        segment_map = self._maps.get(entry.segment, None)
+        if segment_map is None or len(segment_map) < entry.offset + entry.length:
+            # the segment is not mapped yet, has grown since or was removed by a compaction
+            with self._lock:
+                entry = self._index.get(image_hash, None)
+                if entry is None:
+                    return None
+                segment_map = self._get_map(entry.segment, entry.offset + entry.length)
+
+        return segment_map[entry.offset:entry.offset + entry.length]
+
+    def put(self, image_hash: str, image_data: bytes or None):
+        if image_hash is None:
+            LOGGER.debug("Trying to put with a None hash is ignored")
+            return
+
+        with self._lock:
+            if image_data is None:
+                if self._index.pop(image_hash, None) is not None:
+                    self._append_index_record(INDEX_RECORD_DELETE, image_hash)
+                    LOGGER.debug("Image data removed: {}".format(image_hash))
+                return
+
+            existing = self._index.get(image_hash, None)
+            if existing is not None and existing.length == len(image_data):
+                LOGGER.debug("Image data already present: {}".format(image_hash))
+                return
+
+            entry = self._append_data(image_data)
+            self._append_index_record(INDEX_RECORD_PUT, image_hash, *entry)
+            self._index[image_hash] = entry
+            LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    def create_temp_file(self) -> Tuple[BinaryIO, str]:
+        temp_folder = os.path.join(self._base_path, TEMP_FOLDER_NAME)
+        os.makedirs(temp_folder, exist_ok=True)
+        fd, temp_file_path = tempfile.mkstemp(suffix=".tmp", dir=temp_folder)
+        return os.fdopen(fd, 'wb'), temp_file_path
+
+    def put_file(self, image_hash: str, file_path: str):
+        try:
+            length = os.path.getsize(file_path)
+            with self._lock:
+                existing = self._index.get(image_hash, None)
+                if existing is not None and existing.length == length:
+                    LOGGER.debug("Image data already present: {}".format(image_hash))
+                    return
+
+                with open(file_path, 'rb') as f:
+                    entry = self._append(length, lambda segment_file: shutil.copyfileobj(f, segment_file))
+                self._append_index_record(INDEX_RECORD_PUT, image_hash, *entry)
+                self._index[image_hash] = entry
+                LOGGER.debug("Image data saved: {}".format(image_hash))
+        finally:
+            os.remove(file_path)
+
+    def get_hashes(self) -> Iterator[str]:
+        return iter(list(self._index.keys()))
+
+    def clear(self):
+        with self._lock:
+            self._segment_file.close()
+            self._index_file.close()
+            self._maps = {}
+            for segment in self._segment_sizes.keys():
+                os.remove(self._get_segment_file_path(segment))
+            os.remove(self._get_index_file_path())
+
+            # segment numbers are never reused while running, so concurrent readers
+            # holding an outdated index entry can't read data of another image
+            next_segment = max(self._segment_sizes.keys(), default=0) + 1
+            self._index = {}
+            self._segment_sizes = {}
+            self._index_file = open(self._get_index_file_path(), 'a')
+            self._open_segment(next_segment)
+
+    def get_dead_ratio(self) -> float:
+        """
+        :return: the ratio of bytes in segment files that are not referenced by any image
+        """
+        with self._lock:
+            total = sum(self._segment_sizes.values())
+            if total <= 0:
+                return 0.0
+            live = sum(map(lambda x: x.length, self._index.values()))
+            return (total - live) / total
+
+    def compact(self):
+        """
+        Rewrites all referenced image data into new segment files and removes the old ones.
+        """
+        with self._lock:
+            old_segments = list(self._segment_sizes.keys())
+            old_maps = self._maps
+            entries = sorted(self._index.items(), key=lambda x: (x[1].segment, x[1].offset))
+
+            self._segment_file.close()
+            self._maps = {}
+            self._open_segment(max(old_segments, default=0) + 1)
+
+            new_index = {}
+            for image_hash, entry in entries:
+                segment_map = old_maps.get(entry.segment, None)
+                if segment_map is None or len(segment_map) < entry.offset + entry.length:
+                    segment_map = self._map_segment(entry.segment)
+                    old_maps[entry.segment] = segment_map
+                new_index[image_hash] = self._append_data(segment_map[entry.offset:entry.offset + entry.length])
+
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+
+            # replace the index log with one only referencing the new segments
+            temp_index_file_path = self._get_index_file_path() + ".tmp"
+            with open(temp_index_file_path, 'w') as f:
+                for image_hash, entry in new_index.items():
+                    f.write(self._format_index_record(INDEX_RECORD_PUT, image_hash, *entry))
+                f.flush()
+                os.fsync(f.fileno())
+            self._index_file.close()
+            os.replace(temp_index_file_path, self._get_index_file_path())
+            self._index_file = open(self._get_index_file_path(), 'a')
+            self._index = new_index
+
+            for segment in old_segments:
+                self._segment_sizes.pop(segment, None)
+                os.remove(self._get_segment_file_path(segment))
+
+            LOGGER.info("Compacted {} segments into {}".format(len(old_segments), len(self._segment_sizes)))
+
+    def _load(self):
+        """
+        Reads existing segment sizes and replays the index log
+        """
+        for file in os.listdir(self._base_path):
+            match = SEGMENT_FILE_PATTERN.match(file)
+            if match is not None:
+                segment = int(match.group(1))
+                self._segment_sizes[segment] = os.path.getsize(self._get_segment_file_path(segment))
+
+        index_file_path = self._get_index_file_path()
+        if not os.path.exists(index_file_path):
+            return
+
+        with open(index_file_path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 5 and parts[0] == INDEX_RECORD_PUT:
+                    entry = IndexEntry(*map(int, parts[2:]))
+                    if entry.offset + entry.length > self._segment_sizes.get(entry.segment, 0):
+                        LOGGER.warning("Ignoring index record pointing to missing data: {}".format(line.strip()))
+                        continue
+                    self._index[parts[1]] = entry
+                elif len(parts) == 2 and parts[0] == INDEX_RECORD_DELETE:
+                    self._index.pop(parts[1], None)
+                else:
+                    # most likely the last record of a crashed process
+                    LOGGER.warning("Ignoring invalid index record: {}".format(line.strip()))
+
+        LOGGER.debug("Packed image data store loaded: {} images in {} segments".format(
+            len(self._index), len(self._segment_sizes)))
+
+    def _append_data(self, image_data: bytes) -> IndexEntry:
+        """
+        Appends image data to the active segment, starting a new segment if necessary
+        :param image_data: the data to write
+        :return: the location of the written data
+        """
+        return self._append(len(image_data), lambda segment_file: segment_file.write(image_data))
+
+    def _append(self, length: int, write) -> IndexEntry:
+        """
+        Appends data to the active segment, starting a new segment if necessary
+        :param length: number of bytes that will be written
+        :param write: function writing exactly length bytes to the given segment file
+        :return: the location of the written data
+        """
+        # the file position is the source of truth, the cached size may be outdated
+        offset = self._segment_file.tell()
+        if offset > 0 and offset + length > self._segment_size:
+            self._segment_file.close()
+            self._open_segment(self._active_segment + 1)
+            offset = self._segment_file.tell()
+
+        try:
+            write(self._segment_file)
+            self._segment_file.flush()
+        except Exception:
+            # remove partially written data, so following data is appended at the expected offset
+            self._truncate_segment(offset)
+            raise
+
+        length = self._segment_file.tell() - offset
+        self._segment_sizes[self._active_segment] = offset + length
+        return IndexEntry(self._active_segment, offset, length)
+
+    def _truncate_segment(self, size: int):
+        """
+        Truncates the active segment file to the given size and reopens it
+        :param size: size in bytes
+        """
+        try:
+            # discards buffered data that could not be written
+            self._segment_file.close()
+        except OSError as e:
+            LOGGER.warning("Error closing segment file: {}".format(e))
+        os.truncate(self._get_segment_file_path(self._active_segment), size)
+        self._open_segment(self._active_segment)
+
+    def _append_index_record(self, record_type: str, image_hash: str, *args):
+        self._index_file.write(self._format_index_record(record_type, image_hash, *args))
+        self._index_file.flush()
+
+    @staticmethod
+    def _format_index_record(record_type: str, image_hash: str, *args) -> str:
+        return " ".join(map(str, [record_type, image_hash, *args])) + "\n"
+
+    def _open_segment(self, segment: int):
+        """
+        Opens the given segment file for appending
+        :param segment: segment number
+        """
+        self._segment_file = open(self._get_segment_file_path(segment), 'ab')
+        self._segment_file.seek(0, os.SEEK_END)
+        self._segment_sizes[segment] = self._segment_file.tell()
+        self._active_segment = segment
+
+    def _get_map(self, segment: int, required_size: int) -> mmap.mmap:
+        """
+        Returns a memory map of a segment file that is at least the given size
+        :param segment: segment number
+        :param required_size: number of bytes that have to be mapped
+        :return: memory map
+        """
+        segment_map = self._maps.get(segment, None)
+        if segment_map is None or len(segment_map) < required_size:
+            # the segment has grown since it was mapped
+            segment_map = self._map_segment(segment)
+            self._maps[segment] = segment_map
+        return segment_map
+
+    def _map_segment(self, segment: int) -> mmap.mmap:
+        with open(self._get_segment_file_path(segment), 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _get_index_file_path(self) -> str:
+        return os.path.join(self._base_path, INDEX_FILE_NAME)
+
+    def _get_segment_file_path(self, segment: int) -> str:
+        return os.path.join(self._base_path, "segment-{:06d}.dat".format(segment))
@@ -0,0 +1,93 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import random
+from array import array
+from threading import Lock
+from typing import Iterable, List
+
+
+class RandomIdIndex:
+    """
+    Array backed index of entity ids that allows drawing random samples in O(k)
+    """
+
+    def __init__(self, entity_ids: Iterable[int] = ()):
+        self._lock = Lock()
+        self._ids = array('q')
+        self._positions = {}
+        self.reset(entity_ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self._positions
+
+    def reset(self, entity_ids: Iterable[int]):
+        """
+        Replaces the content of this index
+        :param entity_ids: the entity ids to index
+        """
+        ids = array('q')
+        positions = {}
+        for entity_id in entity_ids:
+            if entity_id in positions:
+                continue
+            positions[entity_id] = len(ids)
+            ids.append(entity_id)
+
+        with self._lock:
+            self._ids = ids
+            self._positions = positions
+
+    def add(self, entity_id: int):
+        """
+        Adds an entity id to the index
+        :param entity_id: the id to add
+        """
+        with self._lock:
+            if entity_id in self._positions:
+                return
+            self._positions[entity_id] = len(self._ids)
+            self._ids.append(entity_id)
+
+    def remove(self, entity_id: int):
+        """
+        Removes an entity id from the index (if present)
+        :param entity_id: the id to remove
+        """
+        with self._lock:
+            position = self._positions.pop(entity_id, None)
+            if position is None:
+                return
+
+            # swap the last element into the free slot to keep the array dense
+            last = self._ids.pop()
+            if last != entity_id:
+                self._ids[position] = last
+                self._positions[last] = position
+
+    def sample(self, count: int) -> List[int]:
+        """
+        Draws distinct random entity ids
+        :param count: number of ids to draw
+        :return: list of at most count distinct ids
+        """
+        with self._lock:
+            count = min(count, len(self._ids))
+            if count <= 0:
+                return []
+            return random.sample(self._ids, count)
@@ -14,27 +14,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+import re
 import time
-from collections import Counter
 from contextlib import contextmanager
 from datetime import datetime
-from typing import List
+from typing import List, Iterable, Iterator, Dict, Tuple
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, func, and_, ForeignKey, Table, or_
+from sqlalchemy import create_engine, Column, Integer, String, Float, func, and_, ForeignKey, Table, or_, Index, \
+    case, tuple_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.sql import text as sql_text
 
 from infinitewisdom.const import DEFAULT_SQL_PERSISTENCE_URL
-from infinitewisdom.util import cryptographic_hash
+from infinitewisdom.util import hash_bot_token
 
 LOGGER = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# first element of the sort key of images returned by find_non_optimal
+NON_OPTIMAL_NEVER_ANALYSED = 1
+NON_OPTIMAL_IMPROVABLE = 2
+
 association_table = Table(
     'association', Base.metadata,
     Column('bot_token_id', Integer, ForeignKey('bot_tokens.id')),
-    Column('telegram_file_id_id', String, ForeignKey('telegram_file_ids.id'))
+    Column('telegram_file_id_id', String, ForeignKey('telegram_file_ids.id')),
+    Index('ix_association_telegram_file_id_id_bot_token_id', 'telegram_file_id_id', 'bot_token_id')
 )
 
 
@@ -72,6 +79,11 @@ class Image(Base):
                                      cascade="all, delete-orphan",
                                      lazy="joined")
 
+    # statistics relevant state when the entity was loaded or last updated, see ImageDataPersistence.update
+    stats_state = None
+    # hashed tokens of bots that uploaded this image since then, see add_file_id
+    newly_uploaded_by = frozenset()
+
     def __str__(self):
         return ", ".join(
             ["Created: `{}`".format(datetime.fromtimestamp(self.created)),
@@ -89,6 +101,11 @@ class Image(Base):
         :param bot_token: the bot token that was used to upload the image
         :param file_id: the file id
         """
+        uploaded = any(map(lambda x: bot_token.hashed_token in map(lambda y: y.hashed_token, x.bot_tokens),
+                           self.telegram_file_ids))
+        if not uploaded:
+            self.newly_uploaded_by = self.newly_uploaded_by | {bot_token.hashed_token}
+
         existing = list(filter(lambda x: x.id == file_id, self.telegram_file_ids))
         if len(existing) > 0:
             # update existing entity with (possibly) new bot_token
@@ -112,7 +129,7 @@ class TelegramFileId(Base):
     __tablename__ = 'telegram_file_ids'
 
     id = Column(String, primary_key=True)
-    image_id = Column(Integer, ForeignKey('images.id'))
+    image_id = Column(Integer, ForeignKey('images.id'), index=True)
     bot_tokens = relationship("BotToken",
                               secondary=association_table,
                               back_populates="telegram_file_ids",
@@ -120,6 +137,20 @@ class TelegramFileId(Base):
     image = relationship("Image", back_populates="telegram_file_ids")
 
 
+class AnalysisResult(Base):
+    """
+    Data model of a cached image analysis result
+    """
+    __tablename__ = 'analysis_results'
+
+    image_hash = Column(String, primary_key=True)
+    analyser = Column(String, primary_key=True)
+    analyser_version = Column(String, primary_key=True)
+    text = Column(String)
+    quality = Column(Float)
+    created = Column(Float)
+
+
 _sessionmaker = sessionmaker()
 
 
@@ -154,8 +185,28 @@ class SQLAlchemyPersistence:
         engine = create_engine(url)
         _sessionmaker.configure(bind=engine)
 
+        self._dialect = engine.dialect.name
         with _session_scope() as session:
+            self._full_text_search = self._detect_full_text_search(session, self._dialect)
             LOGGER.debug("SQLAlchemy persistence loaded: {} entities".format(self.count(session)))
+            if not self._full_text_search:
+                LOGGER.warning("No full text search index found, falling back to ILIKE text search")
+
+    @staticmethod
+    def _detect_full_text_search(session: Session, dialect: str) -> bool:
+        """
+        Checks if the full text search index created by alembic is available
+        :param dialect: the database dialect name
+        :return: True if the index exists, false otherwise
+        """
+        if dialect == "sqlite":
+            query = "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'"
+        elif dialect == "postgresql":
+            query = "SELECT count(*) FROM pg_indexes WHERE indexname = 'ix_images_text_fts'"
+        else:
+            return False
+
+        return session.execute(sql_text(query)).scalar() > 0
 
     @staticmethod
     def _migrate_db(url: str):
@@ -170,7 +221,7 @@ class SQLAlchemyPersistence:
 
     @staticmethod
     def get_or_add_bot_token(session: Session, bot_token: str) -> BotToken:
-        hashed_bot_token = cryptographic_hash(bot_token)
+        hashed_bot_token = hash_bot_token(bot_token)
         entity = session.query(BotToken).filter_by(hashed_token=hashed_bot_token).first()
         if entity is not None:
             return entity
@@ -199,6 +250,27 @@ class SQLAlchemyPersistence:
         session.refresh(image)
         return image
 
+    @staticmethod
+    def get_all_ids(session: Session) -> List[int]:
+        return list(map(lambda x: x[0], session.query(Image.id).yield_per(10000)))
+
+    @staticmethod
+    def get_all_texts(session: Session) -> Iterable[tuple]:
+        return session.query(Image.id, Image.text).filter(Image.text.isnot(None)).yield_per(10000)
+
+    @staticmethod
+    def get_all_urls(session: Session, changed_after: float = None) -> Iterable[str]:
+        query = session.query(Image.url)
+        if changed_after is not None:
+            query = query.filter(or_(Image.created >= changed_after, Image.updated >= changed_after))
+        return map(lambda x: x[0], query.yield_per(10000))
+
+    @staticmethod
+    def get_by_ids(session: Session, entity_ids: List[int]) -> [Image]:
+        if len(entity_ids) <= 0:
+            return []
+        return session.query(Image).filter(Image.id.in_(entity_ids)).all()
+
     @staticmethod
     def get_random(session: Session, page_size: int = None) -> Image or [Image]:
         query = session.query(Image).order_by(func.random()).limit(page_size)
@@ -219,54 +291,108 @@ class SQLAlchemyPersistence:
         return session.query(Image).filter(Image.telegram_file_ids.any(id=telegram_file_id)).first()
 
     @staticmethod
-    def find_by_text(session: Session, text: str = None, limit: int = None, offset: int = None) -> [Image]:
+    def find_telegram_file_ids(session: Session, bot_token: str, image_ids: [int]) -> Dict[int, str]:
+        if len(image_ids) <= 0:
+            return {}
+
+        rows = session.query(TelegramFileId.image_id, TelegramFileId.id).join(
+            association_table, association_table.c.telegram_file_id_id == TelegramFileId.id
+        ).join(
+            BotToken, BotToken.id == association_table.c.bot_token_id
+        ).filter(
+            BotToken.hashed_token == hash_bot_token(bot_token),
+            TelegramFileId.image_id.in_(image_ids)
+        ).all()
+
+        result = {}
+        for image_id, file_id in rows:
+            result.setdefault(image_id, file_id)
+        return result
+
+    def find_by_text(self, session: Session, text: str = None, limit: int = None, offset: int = None) -> [Image]:
         if limit is None:
             limit = 16
+        if offset is None:
+            offset = 0
+
+        if self._full_text_search:
+            words = re.findall(r"\w+", text)
+            if len(words) > 0:
+                return self._find_by_text_fts(session, words, limit, offset)
 
         words = text.split(" ")
 
         filters = list(map(lambda word: Image.text.ilike("%{}%".format(word)), words))
         return session.query(Image).filter(and_(*filters)).limit(limit).offset(offset).all()
 
-    def find_all_non_optimal(self, session: Session, target_quality: int, limit: int = None) -> [Image]:
-        never_analysed = session.query(Image.id).filter(Image.analyser_quality.is_(None)).order_by(
-            func.length(Image.text) > 0,
-            Image.created).all()
-
-        improvement_possible = session.query(Image.id).filter(
-            and_(Image.analyser_quality.isnot(None),
-                 Image.analyser_quality < target_quality)
-        ).order_by(
-            func.length(Image.text) > 0,
-            Image.analyser_quality,
-            Image.created).all()
-
-        return never_analysed + improvement_possible
+    def _find_by_text_fts(self, session: Session, words: [str], limit: int, offset: int) -> [Image]:
+        """
+        Finds entities using the full text search index, every word is treated as a prefix
+        :param words: the words to search for (all of them have to match)
+        :return: list of entities ordered by relevance
+        """
+        if self._dialect == "sqlite":
+            query = " ".join(map(lambda word: '"{}"*'.format(word.replace('"', '""')), words))
+            statement = sql_text(
+                "SELECT rowid FROM images_fts WHERE images_fts MATCH :query ORDER BY rank LIMIT :limit OFFSET :offset")
+        else:
+            query = " & ".join(map(lambda word: "{}:*".format(word), words))
+            statement = sql_text(
+                "SELECT id FROM images "
+                "WHERE to_tsvector('simple', coalesce(text, '')) @@ to_tsquery('simple', :query) "
+                "ORDER BY ts_rank(to_tsvector('simple', coalesce(text, '')), to_tsquery('simple', :query)) DESC, id "
+                "LIMIT :limit OFFSET :offset")
+
+        rows = session.execute(statement, {"query": query, "limit": limit, "offset": offset}).fetchall()
+        entity_ids = list(map(lambda x: x[0], rows))
+        entities = {e.id: e for e in self.get_by_ids(session, entity_ids)}
+        return [entities[entity_id] for entity_id in entity_ids if entity_id in entities]
 
     @staticmethod
-    def get_not_uploaded_image_ids(session: Session, bot_token: str) -> List[int]:
-        hashed_bot_token = cryptographic_hash(bot_token)
-        image_ids = session.query(Image.id).all()
-        bot_token_entity = session.query(BotToken).filter_by(hashed_token=hashed_bot_token).first()
-        if bot_token_entity is None:
-            return []
-        uploaded_image_ids = set(map(lambda x: x.image_id, bot_token_entity.telegram_file_ids))
-
-        x = image_ids
-        y = uploaded_image_ids
-        remaining = Counter(y)
-
-        # out would be the full substraction
-        out = []
-        for val in x:
-            if remaining[val]:
-                remaining[val] -= 1
-            else:
-                out.append(val)
+    def find_non_optimal(session: Session, target_quality: float, after: tuple or None = None,
+                         limit: int = 1000) -> [Tuple[tuple, int]]:
+        has_text = case((func.length(Image.text) > 0, 1), else_=0)
+        created = func.coalesce(Image.created, 0)
+        result = []
+
+        # never analysed images come first, so they are only queried while the previous page belongs to them
+        if after is None or after[0] == NON_OPTIMAL_NEVER_ANALYSED:
+            columns = [has_text, created, Image.id]
+            query = session.query(*columns).filter(Image.analyser_quality.is_(None))
+            if after is not None:
+                query = query.filter(tuple_(*columns) > tuple_(*after[1:]))
+            rows = query.order_by(*columns).limit(limit).all()
+            result += [((NON_OPTIMAL_NEVER_ANALYSED, *row), row[-1]) for row in rows]
+            after = None
+
+        if len(result) < limit:
+            columns = [has_text, Image.analyser_quality, created, Image.id]
+            query = session.query(*columns).filter(
+                and_(Image.analyser_quality.isnot(None),
+                     Image.analyser_quality < target_quality))
+            if after is not None:
+                query = query.filter(tuple_(*columns) > tuple_(*after[1:]))
+            rows = query.order_by(*columns).limit(limit - len(result)).all()
+            result += [((NON_OPTIMAL_IMPROVABLE, *row), row[-1]) for row in rows]
+
+        return result
 
-        # TODO: this still takes about 30 seconds and shifts part of the load to the client,
-        #  but its the best we have now
-        return out
+    @staticmethod
+    def get_not_uploaded_image_ids(session: Session, bot_token: str, chunk_size: int = 10000) -> Iterator[int]:
+        hashed_bot_token = hash_bot_token(bot_token)
+        bot_token_id = session.query(BotToken.id).filter_by(hashed_token=hashed_bot_token).scalar()
+        if bot_token_id is None:
+            return iter([])
+
+        uploaded = session.query(TelegramFileId.id).join(
+            association_table, association_table.c.telegram_file_id_id == TelegramFileId.id
+        ).filter(
+            TelegramFileId.image_id == Image.id,
+            association_table.c.bot_token_id == bot_token_id
+        ).exists()
+
+        query = session.query(Image.id).filter(~uploaded).yield_per(chunk_size)
+        return map(lambda x: x[0], query)
 
     @staticmethod
     def count(session: Session) -> int:
@@ -278,21 +404,54 @@ class SQLAlchemyPersistence:
         session.merge(image)
 
     @staticmethod
-    def count_items_this_month(session: Session, analyser: str) -> int:
-        divide = time.time() - 60 * 60 * 24 * 31
-        return session.query(Image).filter(Image.analyser == analyser).filter(
-            or_(Image.created > divide, Image.updated > divide)).count()
+    def get_analysis_timestamps(session: Session, analyser: str, since: float,
+                                chunk_size: int = 10000) -> Iterator[float]:
+        query = session.query(Image.created, Image.updated).filter(Image.analyser == analyser).filter(
+            or_(Image.created > since, Image.updated > since)).yield_per(chunk_size)
+        return map(lambda x: max(filter(lambda t: t is not None, x)), query)
 
     @staticmethod
     def delete(session: Session, entity_id: int) -> None:
         session.query(Image).filter_by(id=entity_id).delete()
 
+    @staticmethod
+    def get_analysis_result(session: Session, image_hash: str, analyser: str,
+                            analyser_version: str) -> AnalysisResult or None:
+        return session.query(AnalysisResult).get((image_hash, analyser, analyser_version))
+
+    @staticmethod
+    def add_analysis_result(session: Session, result: AnalysisResult) -> None:
+        session.merge(result)
+
+    @staticmethod
+    def delete_analysis_results(session: Session, analyser: str, keep_version: str) -> int:
+        return session.query(AnalysisResult).filter(
+            and_(AnalysisResult.analyser == analyser,
+                 AnalysisResult.analyser_version != keep_version)
+        ).delete(synchronize_session=False)
+
     def clear(self) -> None:
         raise NotImplementedError()
 
+    @staticmethod
+    def get_stats_state(session: Session, entity_id: int, hashed_bot_token: str) -> tuple or None:
+        """
+        Loads the statistics relevant columns of a single entity as currently stored in the database
+        :param entity_id: the entity id
+        :param hashed_bot_token: the hashed bot token used to check for telegram uploads
+        :return: (has image data, uploaded, analyser, has text) or None if the entity doesn't exist
+        """
+        uploaded = session.query(TelegramFileId).filter(
+            TelegramFileId.image_id == Image.id,
+            TelegramFileId.bot_tokens.any(BotToken.hashed_token == hashed_bot_token)).exists()
+        # don't flush pending changes of the entity, we want to know the stored state
+        with session.no_autoflush:
+            return session.query(Image.image_hash.isnot(None), uploaded, Image.analyser,
+                                 func.length(Image.text) > 0).filter(Image.id == entity_id).first()
+
     @staticmethod
     def count_items_with_telegram_upload(session: Session, bot_token: str) -> int:
-        hashed_bot_token = cryptographic_hash(bot_token)
+        hashed_bot_token = hash_bot_token(bot_token)
         return session.query(Image).filter(
             and_(Image.telegram_file_ids.any(
                 TelegramFileId.bot_tokens.any(BotToken.hashed_token.in_([hashed_bot_token]))))).count()
@@ -0,0 +1,127 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from collections import Counter, namedtuple
+from threading import Lock
+
+from infinitewisdom import RegularIntervalWorker
+from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_TESSERACT, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION, \
+    IMAGE_ANALYSIS_TYPE_AZURE, IMAGE_ANALYSIS_TYPE_HUMAN
+from infinitewisdom.persistence.sqlalchemy import _session_scope
+from infinitewisdom.stats import POOL_SIZE, TELEGRAM_ENTITIES_COUNT, IMAGE_ANALYSIS_TYPE_COUNT, \
+    IMAGE_ANALYSIS_HAS_TEXT_COUNT, ENTITIES_WITH_IMAGE_DATA_COUNT
+
+LOGGER = logging.getLogger(__name__)
+
+ANALYSER_TYPES = [
+    IMAGE_ANALYSIS_TYPE_TESSERACT,
+    IMAGE_ANALYSIS_TYPE_GOOGLE_VISION,
+    IMAGE_ANALYSIS_TYPE_AZURE,
+    IMAGE_ANALYSIS_TYPE_HUMAN
+]
+
+# the parts of an entity that are relevant for statistics
+EntityState = namedtuple("EntityState", ["has_image_data", "uploaded", "analyser", "has_text"])
+
+
+class PersistenceStatistics:
+    """
+    Keeps persistence related statistics up to date by applying the change of every write
+    instead of counting all entities again.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pool_size = 0
+        self._with_image_data = 0
+        self._uploaded = 0
+        self._with_text = 0
+        self._analysers = Counter()
+
+    def set(self, pool_size: int, with_image_data: int, uploaded: int, with_text: int, analysers: dict):
+        """
+        Replaces all values with the given (freshly counted) ones
+        """
+        with self._lock:
+            self._pool_size = pool_size
+            self._with_image_data = with_image_data
+            self._uploaded = uploaded
+            self._with_text = with_text
+            self._analysers = Counter(analysers)
+            self._publish()
+
+    def added(self, state: EntityState):
+        """
+        Accounts for a new entity
+        :param state: state of the new entity
+        """
+        self.changed(None, state)
+
+    def removed(self, state: EntityState):
+        """
+        Accounts for a removed entity
+        :param state: state of the entity before it was removed
+        """
+        self.changed(state, None)
+
+    def changed(self, old: EntityState or None, new: EntityState or None):
+        """
+        Accounts for a changed entity
+        :param old: state before the change (None if the entity is new)
+        :param new: state after the change (None if the entity was removed)
+        """
+        with self._lock:
+            if old is not None:
+                self._apply(old, -1)
+            if new is not None:
+                self._apply(new, 1)
+            self._publish()
+
+    def _apply(self, state: EntityState, sign: int):
+        self._pool_size += sign
+        self._with_image_data += sign * int(state.has_image_data)
+        self._uploaded += sign * int(state.uploaded)
+        self._with_text += sign * int(state.has_text)
+        if state.analyser is not None:
+            self._analysers[state.analyser] += sign
+
+    def _publish(self):
+        POOL_SIZE.set(self._pool_size)
+        ENTITIES_WITH_IMAGE_DATA_COUNT.set(self._with_image_data)
+        TELEGRAM_ENTITIES_COUNT.set(self._uploaded)
+        IMAGE_ANALYSIS_HAS_TEXT_COUNT.set(self._with_text)
+        for analyser in ANALYSER_TYPES:
+            IMAGE_ANALYSIS_TYPE_COUNT.labels(type=analyser).set(self._analysers[analyser])
+
+
+class StatisticsReconciler(RegularIntervalWorker):
+    """
+    Worker that regularly recounts persistence statistics to correct any drift
+    (f.ex. caused by other processes writing to the same database)
+    """
+
+    def __init__(self, interval: float, persistence):
+        """
+        :param interval: interval in seconds
+        :param persistence: the ImageDataPersistence to reconcile
+        """
+        super().__init__(interval)
+        self._persistence = persistence
+
+    def _run(self):
+        with _session_scope(False) as session:
+            self._persistence.reconcile_stats(session)
+        LOGGER.debug("Reconciled persistence statistics")
@@ -0,0 +1,146 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import re
+from array import array
+from bisect import bisect_left, insort
+from threading import Lock
+from typing import Iterable, List, Tuple
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str or None) -> [str]:
+    """
+    Splits a text into lowercase word tokens
+    :param text: the text to split
+    :return: list of tokens
+    """
+    if text is None:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _array_contains(values: array, value: int) -> bool:
+    index = bisect_left(values, value)
+    return index < len(values) and values[index] == value
+
+
+class InvertedTextIndex:
+    """
+    In-memory inverted index mapping text tokens to sorted arrays of entity ids
+    """
+
+    def __init__(self, entries: Iterable[Tuple[int, str or None]] = ()):
+        """
+        :param entries: (entity id, text) tuples to index initially
+        """
+        self._lock = Lock()
+        # token -> sorted array of entity ids
+        self._postings = {}
+        # sorted list of all known tokens, used for prefix lookups
+        self._vocabulary = []
+        # entity id -> tokens of its current text
+        self._entity_tokens = {}
+
+        for entity_id, text in entries:
+            self.update(entity_id, text)
+
+    def __len__(self) -> int:
+        return len(self._entity_tokens)
+
+    def update(self, entity_id: int, text: str or None):
+        """
+        Sets the text of an entity
+        :param entity_id: the entity id
+        :param text: the new text of the entity
+        """
+        tokens = frozenset(tokenize(text))
+        with self._lock:
+            old_tokens = self._entity_tokens.get(entity_id, frozenset())
+            if old_tokens == tokens:
+                return
+
+            for token in old_tokens - tokens:
+                self._remove_posting(token, entity_id)
+            for token in tokens - old_tokens:
+                self._add_posting(token, entity_id)
+
+            if len(tokens) > 0:
+                self._entity_tokens[entity_id] = tokens
+            else:
+                self._entity_tokens.pop(entity_id, None)
+
+    def remove(self, entity_id: int):
+        """
+        Removes an entity from the index
+        :param entity_id: the entity id
+        """
+        self.update(entity_id, None)
+
+    def search(self, text: str) -> List[int]:
+        """
+        Finds all entities whose text contains a token starting with each of the words in the given text
+        :param text: the text to search for
+        :return: sorted list of matching entity ids
+        """
+        words = set(tokenize(text))
+        if len(words) <= 0:
+            return []
+
+        with self._lock:
+            candidates = sorted(map(self._find_prefix_matches, words), key=len)
+
+        result, others = candidates[0], candidates[1:]
+        return [entity_id for entity_id in result if all(_array_contains(x, entity_id) for x in others)]
+
+    def _find_prefix_matches(self, word: str) -> array:
+        """
+        :param word: the prefix to look for
+        :return: sorted array of all entity ids having a token starting with the given prefix
+        """
+        matches = []
+        index = bisect_left(self._vocabulary, word)
+        while index < len(self._vocabulary) and self._vocabulary[index].startswith(word):
+            matches.append(self._postings[self._vocabulary[index]])
+            index += 1
+
+        if len(matches) == 1:
+            return array('q', matches[0])
+        return array('q', sorted(set().union(*matches)))
+
+    def _add_posting(self, token: str, entity_id: int):
+        posting = self._postings.get(token, None)
+        if posting is None:
+            self._postings[token] = array('q', [entity_id])
+            insort(self._vocabulary, token)
+            return
+
+        index = bisect_left(posting, entity_id)
+        if index >= len(posting) or posting[index] != entity_id:
+            posting.insert(index, entity_id)
+
+    def _remove_posting(self, token: str, entity_id: int):
+        posting = self._postings.get(token, None)
+        if posting is None:
+            return
+
+        index = bisect_left(posting, entity_id)
+        if index < len(posting) and posting[index] == entity_id:
+            posting.pop(index)
+
+        if len(posting) <= 0:
+            del self._postings[token]
+            del self._vocabulary[bisect_left(self._vocabulary, token)]
@@ -0,0 +1,192 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import threading
+import time
+
+from telegram.error import RetryAfter
+
+from infinitewisdom.const import TELEGRAM_GLOBAL_RATE_LIMIT, TELEGRAM_CHAT_RATE_LIMIT, TELEGRAM_GROUP_RATE_LIMIT, \
+    TELEGRAM_CHAT_BURST, TELEGRAM_SEND_ATTEMPTS
+from infinitewisdom.stats import TELEGRAM_RATE_LIMIT_WAIT_TIME, TELEGRAM_RATE_LIMIT_WAITING, TELEGRAM_RETRY_AFTER
+
+LOGGER = logging.getLogger(__name__)
+
+# messages sent as a direct reaction to a user
+PRIORITY_USER = 0
+# messages sent by background workers (f.ex. the uploader)
+PRIORITY_BACKGROUND = 1
+
+PRIORITY_NAMES = {
+    PRIORITY_USER: "user",
+    PRIORITY_BACKGROUND: "background"
+}
+
+# number of chat buckets after which idle ones are removed
+MAX_IDLE_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Token bucket that is refilled at a constant rate up to its capacity.
+    Taking more tokens than available puts the bucket into debt, which is paid off by later refills.
+    Not thread safe.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def get_wait_time(self, count: int, now: float) -> float:
+        """
+        :param count: number of tokens
+        :param now: current monotonic time
+        :return: seconds until the given number of tokens (at most the capacity) can be taken
+        """
+        self._refill(now)
+        missing = min(count, self._capacity) - self._tokens
+        return max(0.0, missing / self._rate)
+
+    def take(self, count: int):
+        """
+        :param count: number of tokens to take
+        """
+        self._tokens -= count
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= self._capacity
+
+
+class TelegramRateLimiter:
+    """
+    Limits messages sent to telegram using a global token bucket and one token bucket per chat.
+    Messages with user priority are always sent before waiting background messages.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE_LIMIT, chat_rate: float = TELEGRAM_CHAT_RATE_LIMIT,
+                 group_rate: float = TELEGRAM_GROUP_RATE_LIMIT, chat_burst: int = TELEGRAM_CHAT_BURST):
+        """
+        :param global_rate: messages per second for all chats
+        :param chat_rate: messages per second for a single private chat
+        :param group_rate: messages per second for a single group chat
+        :param chat_burst: number of messages that may be sent to a single chat at once
+        """
+        self._chat_rate = chat_rate
+        self._group_rate = group_rate
+        self._chat_burst = chat_burst
+
+        self._condition = threading.Condition()
+        self._global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chat_buckets = {}
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES.keys()}
+        # monotonic time until which telegram asked us not to send anything
+        self._blocked_until = 0.0
+
+    def send(self, chat_id: int or str, func, priority: int = PRIORITY_USER, count: int = 1):
+        """
+        Waits until a message may be sent and sends it, retrying when telegram asks to wait
+        :param chat_id: the chat the message is sent to
+        :param func: function sending the message
+        :param priority: PRIORITY_USER or PRIORITY_BACKGROUND
+        :param count: number of messages sent by func (f.ex. the size of a media group)
+        :return: the result of func
+        """
+        for attempt in range(1, TELEGRAM_SEND_ATTEMPTS + 1):
+            self.acquire(chat_id, priority, count)
+            try:
+                return func()
+            except RetryAfter as e:
+                TELEGRAM_RETRY_AFTER.inc()
+                self._block(e.retry_after)
+                if attempt >= TELEGRAM_SEND_ATTEMPTS:
+                    raise
+                LOGGER.warning("Telegram asked to wait for {} seconds (attempt {})".format(e.retry_after, attempt))
+
+    def acquire(self, chat_id: int or str, priority: int = PRIORITY_USER, count: int = 1):
+        """
+        Blocks until the given number of messages may be sent to a chat
+        :param chat_id: the chat the messages are sent to
+        :param priority: PRIORITY_USER or PRIORITY_BACKGROUND
+        :param count: number of messages
+        """
+        start = time.monotonic()
+        with self._condition:
+            self._waiting[priority] += 1
+            self._publish_waiting()
+            try:
+                chat_bucket = self._get_chat_bucket(chat_id)
+                while True:
+                    now = time.monotonic()
+                    wait_time = max(self._blocked_until - now,
+                                    self._global_bucket.get_wait_time(count, now),
+                                    chat_bucket.get_wait_time(count, now))
+                    if self._has_waiting_with_higher_priority(priority):
+                        # wait until the more important messages have been sent
+                        self._condition.wait()
+                    elif wait_time > 0:
+                        self._condition.wait(wait_time)
+                    else:
+                        self._global_bucket.take(count)
+                        chat_bucket.take(count)
+                        break
+            finally:
+                self._waiting[priority] -= 1
+                self._publish_waiting()
+                self._condition.notify_all()
+
+        TELEGRAM_RATE_LIMIT_WAIT_TIME.labels(priority=PRIORITY_NAMES[priority]).observe(time.monotonic() - start)
+
+    def _has_waiting_with_higher_priority(self, priority: int) -> bool:
+        return any(map(lambda x: x[0] < priority and x[1] > 0, self._waiting.items()))
+
+    def _block(self, seconds: float):
+        """
+        Stops sending any message for the given time
+        :param seconds: time in seconds
+        """
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _get_chat_bucket(self, chat_id: int or str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id, None)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_IDLE_CHAT_BUCKETS:
+                self._remove_idle_chat_buckets()
+            # group chats have negative ids
+            rate = self._group_rate if str(chat_id).startswith("-") else self._chat_rate
+            bucket = TokenBucket(rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _remove_idle_chat_buckets(self):
+        now = time.monotonic()
+        for chat_id in list(filter(lambda x: self._chat_buckets[x].is_full(now), self._chat_buckets.keys())):
+            self._chat_buckets.pop(chat_id)
+
+    def _publish_waiting(self):
+        for priority, name in PRIORITY_NAMES.items():
+            TELEGRAM_RATE_LIMIT_WAITING.labels(priority=name).set(self._waiting[priority])
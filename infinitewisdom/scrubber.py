@@ -0,0 +1,69 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+
+from infinitewisdom import RegularIntervalWorker
+from infinitewisdom.config.config import AppConfig
+from infinitewisdom.persistence import ImageDataPersistence
+from infinitewisdom.stats import SCRUBBER_TIME, IMAGE_DATA_SCRUB_VERIFIED, IMAGE_DATA_SCRUB_CORRUPTED
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ImageDataScrubber(RegularIntervalWorker):
+    """
+    Worker that slowly verifies all stored image data against its hash
+    and removes corrupted image data. Only a limited number of images
+    is verified per run to keep the additional disk load low.
+    """
+
+    def __init__(self, config: AppConfig, persistence: ImageDataPersistence):
+        super().__init__(config.SCRUBBER_INTERVAL.value)
+        self._enabled = config.SCRUBBER_ENABLED.value
+        self._batch_size = config.SCRUBBER_BATCH_SIZE.value
+        self._persistence = persistence
+        self._hashes = None
+
+    def start(self):
+        if not self._enabled:
+            LOGGER.debug("Scrubber is disabled, not starting it.")
+            return
+        super().start()
+
+    @SCRUBBER_TIME.time()
+    def _run(self):
+        for _ in range(self._batch_size):
+            image_hash = self._next_hash()
+            if image_hash is None:
+                return
+
+            IMAGE_DATA_SCRUB_VERIFIED.inc()
+            if not self._persistence.verify_image_data(image_hash):
+                IMAGE_DATA_SCRUB_CORRUPTED.inc()
+
+    def _next_hash(self) -> str or None:
+        """
+        :return: the next image hash to verify or None if the store is empty
+        """
+        if self._hashes is not None:
+            image_hash = next(self._hashes, None)
+            if image_hash is not None:
+                return image_hash
+
+        # start a new pass
+        LOGGER.debug("Starting a new image data scrub pass")
+        self._hashes = self._persistence.get_image_hashes()
+        return next(self._hashes, None)
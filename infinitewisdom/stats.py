@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from prometheus_client import Gauge, Counter, Summary
+from prometheus_client import Gauge, Counter, Summary, Histogram
 from prometheus_client.metrics import MetricWrapperBase
 
 from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_GOOGLE_VISION, IMAGE_ANALYSIS_TYPE_AZURE, \
@@ -31,7 +31,15 @@ IMAGE_ANALYSIS_TYPE_COUNT = Gauge('image_analysis_type_count',
 IMAGE_ANALYSIS_HAS_TEXT_COUNT = Gauge('image_analysis_has_text_count',
                                       'Number of entities that have a text')
 IMAGE_ANALYSIS_QUEUE_LENGTH = Gauge('image_analysis_queue_length',
-                                    'Number of entity ids in the analyser worker queue')
+                                    'Number of entity ids currently loaded into the analyser worker queue')
+IMAGE_ANALYSIS_PENDING = Gauge('image_analysis_pending',
+                               'Number of analyses currently running in the analysis process or thread pool')
+IMAGE_ANALYSIS_IN_FLIGHT = Gauge('image_analysis_in_flight',
+                                 'Number of concurrent requests currently sent to an analyser',
+                                 ['name'])
+IMAGE_ANALYSIS_HEDGED = Counter('image_analysis_hedged',
+                                'Number of images analysed by an analyser because another analyser was too slow',
+                                ['name'])
 START_TIME = Summary('start_processing_seconds', 'Time spent in the /start handler')
 INSPIRE_TIME = Summary('inspire_processing_seconds', 'Time spent in the /inspire handler')
 INLINE_TIME = Summary('inline_processing_seconds', 'Time spent in the inline query handler')
@@ -41,10 +49,23 @@ REGULAR_INTERVAL_WORKER_TIME = Summary('regular_interval_worker_processing_secon
                                        'Time spent for a single run cycle of this workercrawler run cycle',
                                        ['name'])
 
-CRAWLER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="crawler")
 UPLOADER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="uploader")
 ANALYSER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="analyser")
 
+CRAWLER_STAGE_TIME = Summary('crawler_stage_processing_seconds',
+                             'Time spent to process a single item in a crawler pipeline stage',
+                             ['stage'])
+CRAWLER_QUEUE_LENGTH = Gauge('crawler_queue_length',
+                             'Number of items waiting for a crawler pipeline stage',
+                             ['stage'])
+CRAWLER_URL_FILTER_FALSE_POSITIVE_RATE = Gauge('crawler_url_filter_false_positive_rate',
+                                               'Estimated false positive rate of the crawler url filter')
+CRAWLER_URL_FILTER_SIZE_BYTES = Gauge('crawler_url_filter_size_bytes', 'Memory used by the crawler url filter')
+CRAWLER_URL_FILTER_COUNT = Gauge('crawler_url_filter_count', 'Number of urls in the crawler url filter')
+CRAWLER_CURRENT_INTERVAL = Gauge('crawler_current_interval_seconds',
+                                 'Current interval between two image api requests of the crawler')
+CRAWLER_NOVELTY_RATIO = Gauge('crawler_novelty_ratio', 'Ratio of new images in the most recent crawler results')
+
 UPLOADER_QUEUE_LENGTH = Gauge('uploader_queue_length',
                               'Number of entity ids in the uploader worker queue')
 
@@ -56,11 +77,50 @@ GOOGLE_VISION_FIND_TEXT_TIME = ANALYSER_FIND_TEXT_TIME.labels(name=IMAGE_ANALYSI
 MICROSOFT_AZURE_FIND_TEXT_TIME = ANALYSER_FIND_TEXT_TIME.labels(name=IMAGE_ANALYSIS_TYPE_AZURE)
 TESSERACT_FIND_TEXT_TIME = ANALYSER_FIND_TEXT_TIME.labels(name=IMAGE_ANALYSIS_TYPE_TESSERACT)
 
+ANALYSER_FIND_TEXT_BATCH_TIME = Summary('analyser_find_text_batch_processing_seconds',
+                                        'Time spent to find text for a batch of images',
+                                        ['name'])
+GOOGLE_VISION_FIND_TEXT_BATCH_TIME = ANALYSER_FIND_TEXT_BATCH_TIME.labels(name=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION)
+
+ANALYSIS_RESULT_CACHE_HITS = Counter('analysis_result_cache_hits',
+                                     'Number of analyses that have been answered by a cached result',
+                                     ['name'])
+ANALYSIS_RESULT_CACHE_MISSES = Counter('analysis_result_cache_misses',
+                                       'Number of analyses that had to be done by the analyser',
+                                       ['name'])
+
+IMAGE_PREPROCESSING_TIME = Summary('image_preprocessing_seconds',
+                                   'Time spent in a single image preprocessing stage',
+                                   ['stage'])
+
 ANALYSER_CAPACITY = Gauge('analyser_remaining_monthly_capacity',
                           'Current capacity of a given analyser',
                           ['name'])
 
 
+IMAGE_DATA_CACHE_HITS = Counter('image_data_cache_hits', 'Number of image data reads served from memory')
+IMAGE_DATA_CACHE_MISSES = Counter('image_data_cache_misses', 'Number of image data reads not served from memory')
+IMAGE_DATA_CACHE_EVICTIONS = Counter('image_data_cache_evictions',
+                                     'Number of image data entries evicted from memory')
+IMAGE_DATA_CACHE_SIZE = Gauge('image_data_cache_size_bytes', 'Total size of image data held in memory')
+
+IMAGE_DATA_SCRUB_VERIFIED = Counter('image_data_scrub_verified', 'Number of image data entries verified by the scrubber')
+IMAGE_DATA_SCRUB_CORRUPTED = Counter('image_data_scrub_corrupted',
+                                     'Number of corrupted image data entries found by the scrubber')
+SCRUBBER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="scrubber")
+
+TELEGRAM_RATE_LIMIT_WAIT_TIME = Histogram('telegram_rate_limit_wait_seconds',
+                                          'Time a message waited for the telegram rate limiter',
+                                          ['priority'])
+TELEGRAM_RATE_LIMIT_WAITING = Gauge('telegram_rate_limit_waiting',
+                                    'Number of messages currently waiting for the telegram rate limiter',
+                                    ['priority'])
+TELEGRAM_RETRY_AFTER = Counter('telegram_retry_after', 'Number of times telegram asked to retry a message later')
+
+HTTP_REQUEST_TIME = Histogram('http_request_duration_seconds', 'Duration of outgoing HTTP requests', ['host'])
+HTTP_REQUEST_ERRORS = Counter('http_request_errors', 'Number of failed outgoing HTTP requests', ['host', 'reason'])
+
+
 def get_metrics() -> []:
     entries = set()
     for name, obj in globals().items():
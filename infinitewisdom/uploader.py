@@ -17,12 +17,15 @@ import logging
 import time
 
 from telegram import Bot
+from telegram.error import RetryAfter
 
 from infinitewisdom import RegularIntervalWorker
 from infinitewisdom.config.config import AppConfig
 from infinitewisdom.persistence import ImageDataPersistence, _session_scope
+from infinitewisdom.persistence.sqlalchemy import Image
+from infinitewisdom.rate_limiter import PRIORITY_BACKGROUND
 from infinitewisdom.stats import UPLOADER_TIME, UPLOADER_QUEUE_LENGTH
-from infinitewisdom.util import send_photo, download_image_bytes
+from infinitewisdom.util import send_photo, send_media_group, download_image_bytes
 
 LOGGER = logging.getLogger(__name__)
 
@@ -38,6 +41,8 @@ class TelegramUploader(RegularIntervalWorker):
         self._persistence = persistence
         self._bot = bot
         self._chat_id = config.UPLOADER_CHAT_ID.value
+        # telegram allows up to 10 photos per media group
+        self._batch_size = max(1, min(config.UPLOADER_BATCH_SIZE.value, 10))
 
         with _session_scope() as session:
             self._not_uploaded_ids = set(self._persistence.get_not_uploaded_image_ids(session, self._bot.token))
@@ -61,31 +66,85 @@ class TelegramUploader(RegularIntervalWorker):
                 time.sleep(60)
                 return
 
-            image_id = self._not_uploaded_ids.pop()
+            image_ids = [self._not_uploaded_ids.pop() for _ in range(min(self._batch_size, queue_length))]
+            images = list(filter(lambda x: x is not None, map(lambda x: self._load_image(session, x), image_ids)))
+            if len(images) <= 0:
+                return
 
-            entity = self._persistence.get_image(session, image_id)
-            if entity is None:
-                LOGGER.warning("Ignoring missing entity for image_id {}".format(image_id))
+            uploaded = self._upload(images)
+            if len(uploaded) <= 0:
                 return
-            image_data = self._persistence.get_image_data(entity)
-            if image_data is None:
-                LOGGER.warning("Missing image data for entity, trying to download: {}".format(entity))
-                try:
-                    image_data = download_image_bytes(entity.url)
-                    self._persistence.update(session, entity, image_data)
-                    entity = self._persistence.get_image(session, image_id)
-                except Exception as e:
-                    LOGGER.error(
-                        "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url),
-                        e)
-                    self._persistence.delete(session, entity)
-                    return
-
-            file_ids = send_photo(bot=self._bot, chat_id=self._chat_id, image_data=image_data)
+
             bot_token = self._persistence.get_bot_token(session, self._bot.token)
-            for file_id in file_ids:
-                entity.add_file_id(bot_token, file_id)
-            self._persistence.update(session, entity, image_data)
-            LOGGER.debug(
-                "Send image '{}' to chat '{}' and updated entity with file_id {}.".format(
-                    entity.url, self._chat_id, file_ids))
+            for entity, entity_file_ids in uploaded:
+                for file_id in entity_file_ids:
+                    entity.add_file_id(bot_token, file_id)
+                self._persistence.update(session, entity)
+                LOGGER.debug(
+                    "Send image '{}' to chat '{}' and updated entity with file_id {}.".format(
+                        entity.url, self._chat_id, entity_file_ids))
+
+    def _upload(self, images: [(Image, bytes)]) -> [(Image, {str})]:
+        """
+        Sends images to the upload chat, images that could not be sent are queued again
+        :param images: entities and their image data
+        :return: the sent entities and their file ids
+        """
+        if len(images) > 1:
+            try:
+                file_ids = send_media_group(bot=self._bot, chat_id=self._chat_id,
+                                            images=list(map(lambda x: x[1], images)), priority=PRIORITY_BACKGROUND)
+                return list(zip(map(lambda x: x[0], images), file_ids))
+            except RetryAfter as e:
+                self._retry_later(images, e)
+                return []
+            except Exception as e:
+                # a single bad image fails the whole media group
+                LOGGER.warning("Error sending media group, sending images one by one: {}".format(e))
+
+        uploaded = []
+        for i, (entity, image_data) in enumerate(images):
+            try:
+                uploaded.append((entity, send_photo(bot=self._bot, chat_id=self._chat_id, image_data=image_data,
+                                                    priority=PRIORITY_BACKGROUND)))
+            except RetryAfter as e:
+                self._retry_later(images[i:], e)
+                break
+            except Exception as e:
+                LOGGER.error("Error sending image '{}', retrying later: {}".format(entity.url, e))
+                self._not_uploaded_ids.add(entity.id)
+        return uploaded
+
+    def _retry_later(self, images: [(Image, bytes)], error: RetryAfter):
+        """
+        Queues images again, the rate limiter already blocks further messages as long as requested by telegram
+        :param images: entities and their image data
+        :param error: the rate limit error
+        """
+        LOGGER.warning("Telegram rate limit exceeded, retrying in {} seconds".format(error.retry_after))
+        self._not_uploaded_ids.update(map(lambda x: x[0].id, images))
+
+    def _load_image(self, session, image_id: int) -> (Image, bytes) or None:
+        """
+        Loads an entity and its image data, downloading missing image data if necessary
+        :param image_id: entity id
+        :return: the entity and its image data or None if it can't be uploaded
+        """
+        entity = self._persistence.get_image(session, image_id)
+        if entity is None:
+            LOGGER.warning("Ignoring missing entity for image_id {}".format(image_id))
+            return None
+        image_data = self._persistence.get_image_data(entity)
+        if image_data is None:
+            LOGGER.warning("Missing image data for entity, trying to download: {}".format(entity))
+            try:
+                image_data = download_image_bytes(entity.url)
+                self._persistence.update(session, entity, image_data)
+                entity = self._persistence.get_image(session, image_id)
+            except Exception as e:
+                LOGGER.error(
+                    "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url),
+                    e)
+                self._persistence.delete(session, entity)
+                return None
+        return entity, image_data
@@ -0,0 +1,155 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+from threading import Lock
+
+from infinitewisdom.stats import CRAWLER_URL_FILTER_FALSE_POSITIVE_RATE, CRAWLER_URL_FILTER_SIZE_BYTES, \
+    CRAWLER_URL_FILTER_COUNT
+
+LOGGER = logging.getLogger(__name__)
+
+FILE_MAGIC = b"IWBF"
+FILE_VERSION = 1
+# magic, version, number of bits, number of hash functions, number of added items, time of last save
+FILE_HEADER = struct.Struct("<4sIQIQd")
+
+
+class BloomFilter:
+    """
+    Memory bounded set of strings that may report false positives, but never false negatives.
+    Used by the crawler to skip urls that have already been processed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        :param capacity: expected number of items
+        :param error_rate: desired false positive rate when the filter holds `capacity` items
+        """
+        capacity = max(1, capacity)
+        bit_count = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        hash_count = max(1, int(round(bit_count / capacity * math.log(2))))
+        self._init(bit_count, hash_count, bytearray((bit_count + 7) // 8), 0)
+
+    def _init(self, bit_count: int, hash_count: int, bits: bytearray, count: int):
+        self._bit_count = bit_count
+        self._hash_count = hash_count
+        self._bits = bits
+        self._count = count
+        self._lock = Lock()
+
+    def add(self, item: str):
+        """
+        Adds an item to the filter
+        :param item: the item to add
+        """
+        with self._lock:
+            if self._contains(item):
+                return
+            for index in self._get_indices(item):
+                self._bits[index >> 3] |= 1 << (index & 7)
+            self._count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return self._contains(item)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _contains(self, item: str) -> bool:
+        for index in self._get_indices(item):
+            if not self._bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def _get_indices(self, item: str) -> [int]:
+        """
+        Calculates the bit indices of an item using double hashing
+        :param item: the item
+        :return: bit indices
+        """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self._bit_count for i in range(self._hash_count)]
+
+    def get_size(self) -> int:
+        """
+        :return: memory used by the filter bits in bytes
+        """
+        return len(self._bits)
+
+    def get_false_positive_rate(self) -> float:
+        """
+        :return: the estimated false positive rate for the current number of items
+        """
+        return (1 - math.exp(-self._hash_count * self._count / self._bit_count)) ** self._hash_count
+
+    def save(self, file_path: str, timestamp: float):
+        """
+        Atomically writes the filter to disk
+        :param file_path: file path
+        :param timestamp: time up to which all items have been added
+        """
+        # every save uses its own temporary file in the same directory, so os.replace is atomic
+        fd, temp_file_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + ".", suffix=".tmp",
+                                              dir=os.path.dirname(file_path) or ".")
+        try:
+            with self._lock:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self._bit_count, self._hash_count,
+                                             self._count, timestamp))
+                    f.write(self._bits)
+                # replacing under the lock prevents an older state from overwriting a newer one
+                os.replace(temp_file_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+    @classmethod
+    def load(cls, file_path: str) -> ('BloomFilter', float) or (None, None):
+        """
+        Reads a filter from disk
+        :param file_path: file path
+        :return: the filter and the timestamp it was saved with or (None, None) if it can't be read
+        """
+        if not os.path.exists(file_path):
+            return None, None
+
+        with open(file_path, 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+            bits = bytearray(f.read())
+
+        if len(header) != FILE_HEADER.size:
+            LOGGER.warning("Ignoring invalid url filter file: {}".format(file_path))
+            return None, None
+        magic, version, bit_count, hash_count, count, timestamp = FILE_HEADER.unpack(header)
+        if magic != FILE_MAGIC or version != FILE_VERSION or len(bits) != (bit_count + 7) // 8:
+            LOGGER.warning("Ignoring invalid url filter file: {}".format(file_path))
+            return None, None
+
+        bloom_filter = cls.__new__(cls)
+        bloom_filter._init(bit_count, hash_count, bits, count)
+        return bloom_filter, timestamp
+
+    def publish_stats(self):
+        CRAWLER_URL_FILTER_FALSE_POSITIVE_RATE.set(self.get_false_positive_rate())
+        CRAWLER_URL_FILTER_SIZE_BYTES.set(self.get_size())
+        CRAWLER_URL_FILTER_COUNT.set(self._count)
@@ -13,29 +13,224 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import functools
 import hashlib
 import logging
 import os
+import random
+import threading
+import time
 from io import BytesIO
+from typing import BinaryIO
+from urllib.parse import urlparse
 
 import requests
 from emoji import emojize
-from telegram import Bot
+from requests.adapters import HTTPAdapter
+from telegram import Bot, InputMediaPhoto
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
 
 from infinitewisdom.analysis import ImageAnalyser
-from infinitewisdom.const import TELEGRAM_CAPTION_LENGTH_LIMIT, REQUESTS_TIMEOUT
+from infinitewisdom.const import TELEGRAM_CAPTION_LENGTH_LIMIT, REQUESTS_TIMEOUT, HTTP_MAX_CONNECTIONS_PER_HOST, \
+    HTTP_RETRIES, HTTP_BACKOFF_FACTOR, HTTP_BACKOFF_MAX, HTTP_POOL_TIMEOUT, MAX_IMAGE_SIZE, DOWNLOAD_CHUNK_SIZE
+from infinitewisdom.rate_limiter import TelegramRateLimiter, PRIORITY_USER
+from infinitewisdom.stats import HTTP_REQUEST_TIME, HTTP_REQUEST_ERRORS
 
 LOGGER = logging.getLogger(__name__)
 
+# response status codes that indicate a temporary problem
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# methods that can be retried safely, other methods are only retried if the caller opts in
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+def _with_pool_timeout(pool_class: type, default_pool_timeout: float) -> type:
+    """
+    requests doesn't pass a pool timeout to urllib3, which makes a blocking pool wait forever
+    for a free connection if one is never returned
+    :param pool_class: urllib3 connection pool class
+    :param default_pool_timeout: maximum time in seconds to wait for a free connection
+    :return: subclass of the given pool class using the given pool timeout by default
+    """
+
+    class PoolWithTimeout(pool_class):
+        def urlopen(self, *args, pool_timeout: float = None, **kwargs):
+            if pool_timeout is None:
+                pool_timeout = default_pool_timeout
+            return super().urlopen(*args, pool_timeout=pool_timeout, **kwargs)
+
+    return PoolWithTimeout
+
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    """
+    Adapter blocking while all pooled connections to a host are in use, but only up to a timeout
+    """
+
+    def __init__(self, pool_timeout: float = HTTP_POOL_TIMEOUT, **kwargs):
+        """
+        :param pool_timeout: maximum time in seconds to wait for a free pooled connection
+        :param kwargs: additional arguments passed to the HTTPAdapter
+        """
+        self._pool_timeout = pool_timeout
+        super().__init__(pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _with_pool_timeout(HTTPConnectionPool, self._pool_timeout),
+            "https": _with_pool_timeout(HTTPSConnectionPool, self._pool_timeout),
+        }
+
+
+class HttpClient:
+    """
+    HTTP client reusing keep-alive connections for all requests.
+    Concurrent requests are limited per host and failed requests of idempotent methods
+    are retried with an exponential, jittered backoff.
+    """
+
+    def __init__(self, max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST, retries: int = HTTP_RETRIES,
+                 backoff_factor: float = HTTP_BACKOFF_FACTOR, timeout=REQUESTS_TIMEOUT,
+                 pool_timeout: float = HTTP_POOL_TIMEOUT):
+        """
+        :param max_connections_per_host: maximum number of concurrent requests to a single host
+        :param retries: number of retries for failed requests
+        :param backoff_factor: base delay in seconds between retries
+        :param timeout: default timeout of a single request
+        :param pool_timeout: maximum time in seconds to wait for a free pooled connection
+        """
+        self._max_connections_per_host = max_connections_per_host
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        self._timeout = timeout
+
+        self._session = requests.Session()
+        adapter = PoolTimeoutAdapter(pool_timeout=pool_timeout, pool_maxsize=max_connections_per_host)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._host_semaphores = {}
+
+    def get(self, url: str, retry: bool = None, **kwargs) -> requests.Response:
+        return self.request("GET", url, retry=retry, **kwargs)
+
+    def post(self, url: str, retry: bool = None, **kwargs) -> requests.Response:
+        return self.request("POST", url, retry=retry, **kwargs)
+
+    def request(self, method: str, url: str, retry: bool = None, **kwargs) -> requests.Response:
+        """
+        Executes a request, retrying on connection errors and temporary server errors
+        :param method: HTTP method
+        :param url: url
+        :param retry: whether to retry failed requests, by default only requests using an idempotent method
+        are retried, since repeating others may apply their side effects more than once
+        :param kwargs: additional arguments passed to requests
+        :return: the last response, if all attempts failed with an error status code
+        """
+        host = urlparse(url).hostname
+        kwargs.setdefault("timeout", self._timeout)
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+        retries = self._retries if retry else 0
+
+        attempt = 0
+        while True:
+            try:
+                response = self._request(host, method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                HTTP_REQUEST_ERRORS.labels(host=host, reason=response.status_code).inc()
+                if attempt >= retries:
+                    return response
+                delay = self._get_backoff(attempt, response.headers.get("Retry-After", None))
+                # return the connection of a (streamed) response that is discarded to the pool
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                HTTP_REQUEST_ERRORS.labels(host=host, reason=e.__class__.__name__).inc()
+                if attempt >= retries:
+                    raise
+                delay = self._get_backoff(attempt)
+
+            attempt += 1
+            LOGGER.debug("Retrying {} {} in {:.2f} seconds (attempt {})".format(method, url, delay, attempt))
+            time.sleep(delay)
+
+    def _request(self, host: str, method: str, url: str, **kwargs) -> requests.Response:
+        with self._get_host_semaphore(host):
+            with HTTP_REQUEST_TIME.labels(host=host).time():
+                try:
+                    return self._session.request(method, url, **kwargs)
+                except EmptyPoolError as e:
+                    raise requests.ConnectionError(e) from e
+
+    def _get_host_semaphore(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            semaphore = self._host_semaphores.get(host, None)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self._max_connections_per_host)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def _get_backoff(self, attempt: int, retry_after: str or None = None) -> float:
+        """
+        :param attempt: number of the failed attempt, starting at 0
+        :param retry_after: value of a Retry-After header (if any)
+        :return: delay in seconds before the next attempt
+        """
+        delay = random.uniform(0, self._backoff_factor * (2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return min(delay, HTTP_BACKOFF_MAX)
+
+
+# shared by all outgoing HTTP requests
+HTTP_CLIENT = HttpClient()
+# shared by all messages sent to telegram
+TELEGRAM_RATE_LIMITER = TelegramRateLimiter()
+
 
 def download_image_bytes(url: str) -> bytes:
     """
     Downloads the image from the given url
     :return: the downloaded image
     """
-    image = requests.get(url, timeout=REQUESTS_TIMEOUT)
-    image.raise_for_status()
-    return image.content
+    target = BytesIO()
+    download_image(url, target)
+    return target.getvalue()
+
+
+def download_image(url: str, target: BinaryIO, max_size: int = MAX_IMAGE_SIZE) -> str:
+    """
+    Streams the image from the given url to a file while hashing it.
+    The download is aborted as soon as the response turns out not to be an image or gets too large.
+    :param url: image url
+    :param target: file to write the image data to
+    :param max_size: maximum image size in bytes
+    :return: hash of the downloaded image
+    """
+    with HTTP_CLIENT.get(url, stream=True) as response:
+        response.raise_for_status()
+
+        content_type = response.headers.get("Content-Type", None)
+        if content_type is not None and not content_type.startswith("image/"):
+            raise ValueError("Unexpected content type '{}' for image: {}".format(content_type, url))
+        content_length = response.headers.get("Content-Length", None)
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+            raise ValueError("Image is too large ({} bytes): {}".format(content_length, url))
+
+        image_hash = hashlib.md5()
+        size = 0
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError("Image is too large (more than {} bytes): {}".format(max_size, url))
+            image_hash.update(chunk)
+            target.write(chunk)
+
+    return image_hash.hexdigest()
 
 
 def create_hash(data: bytes) -> str:
@@ -60,38 +255,37 @@ def cryptographic_hash(data: bytes or str) -> str:
     return hash
 
 
-def remaining_capacity(session, analyser, persistence) -> int:
+@functools.lru_cache(maxsize=16)
+def hash_bot_token(bot_token: str) -> str:
     """
-    Calculates the remaining capacity of an analyser
-    :param analyser: the analyser to check
-    :param persistence: persistence
-    :return: the remaining capacity of the analyser
+    Creates the cryptographic hash of a bot token, the result is cached since bot tokens don't change
+    :param bot_token: the bot token
+    :return: hash
     """
-    count = persistence.count_items_this_month(session, analyser.get_identifier())
-    remaining = analyser.get_monthly_capacity() - count
-    return remaining
+    return cryptographic_hash(bot_token)
 
 
-def select_best_available_analyser(session, analysers: [ImageAnalyser], persistence) -> ImageAnalyser or None:
+def select_best_available_analyser(analysers: [ImageAnalyser], capacity_ledger) -> ImageAnalyser or None:
     """
     Selects the best available analyser based on it's quality and remaining capacity
     :param analysers: the analysers to choose from
-    :param persistence: currently in use persistence
+    :param capacity_ledger: ledger of the analyser capacities
     :return: analyser or None
     """
 
     if len(analysers) == 1:
         return analysers[0]
 
-    available = list(filter(lambda x: remaining_capacity(session, x, persistence) > 0, analysers))
+    remaining = {analyser: capacity_ledger.get_remaining(analyser) for analyser in analysers}
+    available = list(filter(lambda x: remaining[x] > 0, analysers))
     if len(available) <= 0:
         return None
     else:
-        return sorted(available, key=lambda x: (-x.get_quality(), -remaining_capacity(session, x, persistence)))[0]
+        return sorted(available, key=lambda x: (-x.get_quality(), -remaining[x]))[0]
 
 
 def send_photo(bot: Bot, chat_id: str, file_id: int or None = None, image_data: bytes or None = None,
-               caption: str = None) -> [str]:
+               caption: str = None, priority: int = PRIORITY_USER) -> [str]:
     """
     Sends a photo to the given chat
     :param bot: the bot
@@ -99,6 +293,7 @@ def send_photo(bot: Bot, chat_id: str, file_id: int or None = None, image_data:
     :param file_id: the telegram file id of the already uploaded image
     :param image_data: the image data
     :param caption: an optional image caption
+    :param priority: rate limiter priority
     :return: a set of telegram image file_id's
     """
     if image_data is not None:
@@ -113,10 +308,38 @@ def send_photo(bot: Bot, chat_id: str, file_id: int or None = None, image_data:
     if caption is not None:
         caption = _format_caption(caption)
 
-    message = bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+    def send():
+        if isinstance(photo, BytesIO):
+            # the data may have been read by a failed attempt
+            photo.seek(0)
+        return bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+
+    message = TELEGRAM_RATE_LIMITER.send(chat_id, send, priority)
     return set(map(lambda x: x.file_id, message.photo))
 
 
+def send_media_group(bot: Bot, chat_id: str, images: [bytes], priority: int = PRIORITY_USER) -> [{str}]:
+    """
+    Sends multiple photos to the given chat in a single message group
+    :param bot: the bot
+    :param chat_id: the chat id to send the images to
+    :param images: image data of 2 to 10 images
+    :param priority: rate limiter priority
+    :return: a set of telegram image file_id's for each image, in the same order as the given images
+    """
+
+    def send():
+        media = []
+        for image_data in images:
+            image_bytes_io = BytesIO(image_data)
+            image_bytes_io.name = 'inspireme.jpeg'
+            media.append(InputMediaPhoto(media=image_bytes_io))
+        return bot.send_media_group(chat_id=chat_id, media=media)
+
+    messages = TELEGRAM_RATE_LIMITER.send(chat_id, send, priority, count=len(images))
+    return list(map(lambda message: set(map(lambda x: x.file_id, message.photo)), messages))
+
+
 def format_for_single_line_log(text: str) -> str:
     """
     Formats a text for log
@@ -140,7 +363,8 @@ def _format_caption(text: str) -> str or None:
     return text
 
 
-def send_message(bot: Bot, chat_id: str, message: str, parse_mode: str = None, reply_to: int = None):
+def send_message(bot: Bot, chat_id: str, message: str, parse_mode: str = None, reply_to: int = None,
+                 priority: int = PRIORITY_USER):
     """
     Sends a text message to the given chat
     :param bot: the bot
@@ -148,6 +372,9 @@ def send_message(bot: Bot, chat_id: str, message: str, parse_mode: str = None, r
     :param message: the message to chat (may contain emoji aliases)
     :param parse_mode: specify whether to parse the text as markdown or HTML
     :param reply_to: the message id to reply to
+    :param priority: rate limiter priority
     """
     emojized_text = emojize(message, use_aliases=True)
-    bot.send_message(chat_id=chat_id, parse_mode=parse_mode, text=emojized_text, reply_to_message_id=reply_to)
+    TELEGRAM_RATE_LIMITER.send(chat_id, lambda: bot.send_message(chat_id=chat_id, parse_mode=parse_mode,
+                                                                 text=emojized_text, reply_to_message_id=reply_to),
+                               priority)
@@ -0,0 +1,64 @@
+"""
+Helper script to move image data between the file based image data store (one file per image)
+and the packed image data store (large segment files) or to compact the packed store.
+Existing data in the source store is not removed.
+
+Usage: python migrate_image_data_store.py [files-to-packed|packed-to-files|compact]
+"""
+
+import sys
+
+from tqdm import tqdm
+
+from infinitewisdom.config.config import AppConfig
+from infinitewisdom.persistence import get_packed_store_path
+from infinitewisdom.persistence.image_persistence import FileImageDataStore
+from infinitewisdom.persistence.packed_image_persistence import PackedImageDataStore
+from infinitewisdom.util import create_hash
+
+config = AppConfig(validate=False)
+base_path = config.FILE_PERSISTENCE_BASE_PATH.value
+
+mode = sys.argv[1] if len(sys.argv) > 1 else "files-to-packed"
+
+file_store = FileImageDataStore(base_path)
+packed_store = PackedImageDataStore(get_packed_store_path(base_path), config.FILE_PERSISTENCE_SEGMENT_SIZE.value)
+
+if mode == "compact":
+    print("Unused data before compaction: {:.1%}".format(packed_store.get_dead_ratio()))
+    packed_store.compact()
+    sys.exit(0)
+elif mode == "files-to-packed":
+    source, target = file_store, packed_store
+elif mode == "packed-to-files":
+    source, target = packed_store, file_store
+else:
+    print(__doc__)
+    sys.exit(1)
+
+migrated = 0
+skipped = 0
+errored = 0
+
+hashes = list(source.get_hashes())
+progress = tqdm(total=len(hashes), unit_scale=True, mininterval=1)
+
+for image_hash in hashes:
+    progress.set_postfix_str(image_hash)
+    progress.update(n=1)
+
+    if target.has(image_hash):
+        skipped += 1
+        continue
+
+    image_data = source.get(image_hash)
+    if image_data is None or create_hash(image_data) != image_hash:
+        print("x Invalid image data: '{}'".format(image_hash))
+        errored += 1
+        continue
+
+    target.put(image_hash, image_data)
+    migrated += 1
+
+progress.close()
+print("Migrated {}\nSkipped {}\nErrored {}\nTotal {}".format(migrated, skipped, errored, len(hashes)))
@@ -0,0 +1,104 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import time
+import unittest
+
+from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.capacity import AnalyserCapacityLedger, CAPACITY_PERIOD
+from infinitewisdom.util import select_best_available_analyser
+
+
+class FakeAnalyser(ImageAnalyser):
+    """
+    Analyser with a fixed quality and capacity
+    """
+
+    def __init__(self, identifier: str, quality: float, capacity: float):
+        self.identifier = identifier
+        self.quality = quality
+        self.capacity = capacity
+
+    def get_identifier(self) -> str:
+        return self.identifier
+
+    def get_quality(self) -> float:
+        return self.quality
+
+    def get_monthly_capacity(self) -> float:
+        return self.capacity
+
+
+class FakePersistence:
+    """
+    Persistence returning fixed analysis timestamps
+    """
+
+    def __init__(self, timestamps: {str: [float]}):
+        self.timestamps = timestamps
+        self.queries = 0
+
+    def get_analysis_timestamps(self, session, analyser: str, since: float):
+        self.queries += 1
+        return filter(lambda x: x > since, self.timestamps.get(analyser, []))
+
+
+class AnalyserCapacityLedgerTests(unittest.TestCase):
+    """
+    Tests for the in-memory analyser capacity accounting
+    """
+
+    def setUp(self):
+        now = time.time()
+        self.cloud = FakeAnalyser("cloud", 0.9, 3)
+        self.local = FakeAnalyser("local", 0.25, math.inf)
+        self.persistence = FakePersistence({
+            "cloud": [now - CAPACITY_PERIOD - 10, now - 100, now - 1],
+            "local": [now] * 5
+        })
+        self.ledger = AnalyserCapacityLedger(None, self.persistence, [self.cloud, self.local])
+
+    def test_load(self):
+        self.assertEqual(1, self.ledger.get_remaining(self.cloud))
+        self.assertEqual(math.inf, self.ledger.get_remaining(self.local))
+        # analysers without a capacity limit are not loaded
+        self.assertEqual(1, self.persistence.queries)
+
+    def test_record_and_select(self):
+        self.assertEqual(self.cloud, select_best_available_analyser([self.local, self.cloud], self.ledger))
+        self.ledger.record(self.cloud)
+        self.assertEqual(0, self.ledger.get_remaining(self.cloud))
+        self.assertEqual(self.local, select_best_available_analyser([self.local, self.cloud], self.ledger))
+        self.assertEqual(1, self.persistence.queries)
+
+    def test_expire(self):
+        self.ledger._usage["cloud"][0] = time.time() - CAPACITY_PERIOD
+        self.assertEqual(2, self.ledger.get_remaining(self.cloud))
+
+    def test_release(self):
+        analyser = FakeAnalyser("limited", 0.5, 10)
+        ledger = AnalyserCapacityLedger(None, FakePersistence({}), [analyser])
+        ledger.record(analyser, 3)
+        ledger.release(analyser, 2)
+        self.assertEqual(9, ledger.get_remaining(analyser))
+        # more than recorded can't be released
+        ledger.release(analyser, 5)
+        self.assertEqual(10, ledger.get_remaining(analyser))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import os
+import time
+import unittest
+
+from prometheus_client import REGISTRY
+
+from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.executor import AnalysisProcessPool
+
+
+def get_find_text_count(name: str) -> float:
+    return REGISTRY.get_sample_value("analyser_find_text_processing_seconds_count", {"name": name}) or 0
+
+
+class ProcessIdAnalyser(ImageAnalyser):
+    """
+    Analyser returning the id of the process it is run in
+    """
+
+    def get_identifier(self) -> str:
+        return "pid"
+
+    def get_quality(self) -> float:
+        return 0.1
+
+    def get_monthly_capacity(self) -> float:
+        return math.inf
+
+    def is_cpu_bound(self) -> bool:
+        return True
+
+    def find_text(self, image: bytes) -> str or None:
+        if len(image) <= 0:
+            raise ValueError("Empty image")
+        return "{} {}".format(os.getpid(), image.decode())
+
+
+class AnalysisProcessPoolTests(unittest.TestCase):
+    """
+    Tests for the analysis process pool
+    """
+
+    def setUp(self):
+        self.pool = AnalysisProcessPool(2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_find_text(self):
+        analyser = ProcessIdAnalyser()
+        futures = [self.pool.submit(analyser, "image {}".format(i).encode()) for i in range(4)]
+        results = list(map(lambda x: x.result(timeout=60).split(" ", 1), futures))
+
+        self.assertEqual(["image {}".format(i) for i in range(4)], list(map(lambda x: x[1], results)))
+        for pid, _ in results:
+            self.assertNotEqual(os.getpid(), int(pid))
+
+    def test_error(self):
+        future = self.pool.submit(ProcessIdAnalyser(), b"")
+        self.assertRaises(ValueError, future.result, 60)
+
+    def test_find_text_time_is_observed_in_the_parent_process(self):
+        count = get_find_text_count("pid")
+        futures = [self.pool.submit(ProcessIdAnalyser(), b"image") for _ in range(2)]
+        for future in futures:
+            future.result(timeout=60)
+
+        # done callbacks are run right after the result is set
+        deadline = time.time() + 10
+        while get_find_text_count("pid") < count + 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(count + 2, get_find_text_count("pid"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from infinitewisdom.analysis.analysis_queue import AnalysisQueue
+
+
+class FakePersistence:
+    """
+    Persistence returning pages of a fixed list of (sort key, id) tuples
+    """
+
+    def __init__(self, items: [(tuple, int)]):
+        self.items = sorted(items)
+        self.pages = 0
+
+    def find_non_optimal(self, session, target_quality: float, after: tuple or None, limit: int):
+        self.pages += 1
+        remaining = list(filter(lambda x: after is None or x[0] > after, self.items))
+        return remaining[:limit]
+
+
+class AnalysisQueueTests(unittest.TestCase):
+    """
+    Tests for the analysis priority queue
+    """
+
+    def setUp(self):
+        # ids in reverse order of their sort key
+        self.persistence = FakePersistence([((1, i), 100 - i) for i in range(10)])
+        self.queue = AnalysisQueue(self.persistence, 1.0, page_size=4)
+
+    def _pop_all(self) -> [int]:
+        result = []
+        image_id = self.queue.pop(None)
+        while image_id is not None:
+            result.append(image_id)
+            image_id = self.queue.pop(None)
+        return result
+
+    def test_order_and_paging(self):
+        self.assertEqual(100, self.queue.pop(None))
+        self.assertEqual(1, self.persistence.pages)
+        self.assertEqual([100 - i for i in range(1, 10)], self._pop_all())
+        # 3 pages, the last one being incomplete
+        self.assertEqual(3, self.persistence.pages)
+
+    def test_push_has_priority(self):
+        self.assertEqual(100, self.queue.pop(None))
+        self.queue.push(5)
+        self.queue.push(95)
+        self.assertEqual(5, self.queue.pop(None))
+        self.assertEqual(95, self.queue.pop(None))
+        # 95 is not returned a second time
+        self.assertEqual([99, 98, 97, 96, 94, 93, 92, 91], self._pop_all())
+
+    def test_restart(self):
+        self.assertEqual(10, len(self._pop_all()))
+        self.assertIsNone(self.queue.pop(None))
+        self.queue.restart()
+        self.assertEqual(10, len(self._pop_all()))
+
+
+if __name__ == '__main__':
+    unittest.main()
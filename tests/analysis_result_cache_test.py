@@ -0,0 +1,76 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, AnalysisResult, Base, _sessionmaker, \
+    _session_scope
+
+
+class AnalysisResultCacheTests(unittest.TestCase):
+    """
+    Tests for the persisted analysis result cache
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        engine = create_engine("sqlite:///{}".format(os.path.join(self.temp_dir.name, "test.db")))
+        Base.metadata.create_all(engine)
+        _sessionmaker.configure(bind=engine)
+        self.persistence = SQLAlchemyPersistence
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _add(self, analyser: str, version: str, text: str or None):
+        with _session_scope() as session:
+            self.persistence.add_analysis_result(session, AnalysisResult(
+                image_hash="hash", analyser=analyser, analyser_version=version, text=text, quality=0.5, created=0))
+
+    def _get(self, analyser: str, version: str) -> str or None:
+        with _session_scope(False) as session:
+            result = self.persistence.get_analysis_result(session, "hash", analyser, version)
+            return None if result is None else result.text
+
+    def test_get_and_replace(self):
+        self.assertIsNone(self._get("tesseract", "1"))
+        self._add("tesseract", "1", "first")
+        self.assertEqual("first", self._get("tesseract", "1"))
+        self.assertIsNone(self._get("tesseract", "2"))
+        self.assertIsNone(self._get("google-vision", "1"))
+
+        self._add("tesseract", "1", "second")
+        self.assertEqual("second", self._get("tesseract", "1"))
+
+    def test_delete_outdated(self):
+        self._add("tesseract", "1", "old")
+        self._add("tesseract", "2", "new")
+        self._add("google-vision", "1", "other")
+
+        with _session_scope() as session:
+            self.assertEqual(1, self.persistence.delete_analysis_results(session, "tesseract", "2"))
+
+        self.assertIsNone(self._get("tesseract", "1"))
+        self.assertEqual("new", self._get("tesseract", "2"))
+        self.assertEqual("other", self._get("google-vision", "1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
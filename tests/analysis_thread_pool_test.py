@@ -0,0 +1,106 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+import time
+import unittest
+
+from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.executor import AnalysisThreadPool
+from infinitewisdom.analysis.preprocessing import ImagePreprocessor, PreprocessedImage
+
+
+def prepare(image_data: bytes) -> PreprocessedImage:
+    return ImagePreprocessor().prepare(image_data)
+
+
+class SlowAnalyser(ImageAnalyser):
+    """
+    Analyser simulating a slow remote service, keeping track of the number of concurrent requests
+    """
+
+    def __init__(self, identifier: str, concurrency: int, delay: float = 0.1):
+        self.identifier = identifier
+        self.concurrency = concurrency
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def get_identifier(self) -> str:
+        return self.identifier
+
+    def get_quality(self) -> float:
+        return 0.9
+
+    def get_monthly_capacity(self) -> float:
+        return 1000
+
+    def get_max_concurrency(self) -> int:
+        return self.concurrency
+
+    def find_text(self, image: bytes) -> str or None:
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return image.decode()
+
+
+class AnalysisThreadPoolTests(unittest.TestCase):
+    """
+    Tests for running analysers calling remote services concurrently
+    """
+
+    def test_concurrency_limit(self):
+        analyser = SlowAnalyser("slow", concurrency=2)
+        pool = AnalysisThreadPool([analyser])
+        try:
+            start = time.time()
+            futures = [pool.submit(analyser, [prepare("image {}".format(i).encode())]) for i in
+                       range(4)]
+            results = list(map(lambda x: x.result(timeout=10), futures))
+            duration = time.time() - start
+        finally:
+            pool.shutdown()
+
+        self.assertEqual([["image 0"], ["image 1"], ["image 2"], ["image 3"]], results)
+        self.assertEqual(2, analyser.max_running)
+        self.assertLess(duration, 4 * analyser.delay)
+
+    def test_batch(self):
+        analyser = SlowAnalyser("slow", concurrency=1, delay=0)
+        pool = AnalysisThreadPool([analyser])
+        try:
+            future = pool.submit(analyser, list(map(prepare, [b"a", b"b", b"c"])))
+            self.assertEqual(["a", "b", "c"], future.result(timeout=10))
+        finally:
+            pool.shutdown()
+
+    def test_analysers_without_concurrency(self):
+        concurrent = SlowAnalyser("concurrent", concurrency=1)
+        synchronous = SlowAnalyser("synchronous", concurrency=0)
+        pool = AnalysisThreadPool([concurrent, synchronous])
+        try:
+            self.assertTrue(pool.supports(concurrent))
+            self.assertFalse(pool.supports(synchronous))
+        finally:
+            pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
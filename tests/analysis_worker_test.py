@@ -0,0 +1,300 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from infinitewisdom.analysis import ImageAnalyser, AnalysisError
+from infinitewisdom.analysis.worker import AnalysisWorker, MAX_ANALYSIS_ATTEMPTS
+from infinitewisdom.persistence.sqlalchemy import Image, AnalysisResult
+
+
+class FakeAnalyser(ImageAnalyser):
+    """
+    Analyser "recognizing" the image data as text, images listed in `broken` fail.
+    If `release` is given, analyses block until it is set.
+    """
+
+    def __init__(self, identifier: str = "fake", quality: float = 0.5, batch_size: int = 1,
+                 broken: [bytes] = None, concurrency: int = 0, release: threading.Event = None):
+        self.identifier = identifier
+        self.quality = quality
+        self.batch_size = batch_size
+        self.broken = broken or []
+        self.concurrency = concurrency
+        self.release = release
+        self.calls = []
+
+    def get_identifier(self) -> str:
+        return self.identifier
+
+    def get_quality(self) -> float:
+        return self.quality
+
+    def get_monthly_capacity(self) -> float:
+        return 1000
+
+    def get_batch_size(self) -> int:
+        return self.batch_size
+
+    def get_max_concurrency(self) -> int:
+        return self.concurrency
+
+    def find_text(self, image: bytes) -> str or None:
+        self.calls.append(image)
+        if self.release is not None:
+            self.release.wait()
+        if image in self.broken:
+            raise ValueError("Broken image")
+        return image.decode()
+
+
+class ProcessIdAnalyser(FakeAnalyser):
+    """
+    CPU bound analyser prefixing the recognized text with the id of the process it is run in
+    """
+
+    def is_cpu_bound(self) -> bool:
+        return True
+
+    def find_text(self, image: bytes) -> str or None:
+        return "{} {}".format(os.getpid(), super().find_text(image))
+
+
+class FakePersistence:
+    """
+    In-memory persistence providing the methods used by the analysis worker
+    """
+
+    def __init__(self, images: {int: bytes}):
+        self.images = {}
+        self.image_data = {}
+        for entity_id, image_data in images.items():
+            self.images[entity_id] = Image(id=entity_id, url="url{}".format(entity_id),
+                                           image_hash="hash{}".format(entity_id), created=entity_id)
+            self.image_data["hash{}".format(entity_id)] = image_data
+        # (image hash, analyser, version) -> AnalysisResult
+        self.results = {}
+
+    def remove_outdated_analysis_results(self, session, versions):
+        pass
+
+    def get_analysis_timestamps(self, session, analyser: str, since: float):
+        return []
+
+    def find_non_optimal(self, session, target_quality: float, after: tuple or None = None, limit: int = 1000):
+        page = []
+        for entity in sorted(self.images.values(), key=lambda x: x.id):
+            if entity.analyser_quality is not None and entity.analyser_quality >= target_quality:
+                continue
+            if after is not None and (entity.id,) <= after:
+                continue
+            page.append(((entity.id,), entity.id))
+        return page[:limit]
+
+    def get_image(self, session, entity_id: int):
+        return self.images.get(entity_id, None)
+
+    def get_image_data(self, entity: Image):
+        return self.image_data.get(entity.image_hash, None)
+
+    def update(self, session, entity: Image, image_data: bytes = None):
+        pass
+
+    def delete(self, session, entity: Image):
+        self.images.pop(entity.id, None)
+
+    def get_analysis_result(self, session, image_hash: str, analyser: ImageAnalyser, version: str):
+        return self.results.get((image_hash, analyser.get_identifier(), version), None)
+
+    def add_analysis_result(self, session, image_hash: str, analyser: ImageAnalyser, version: str,
+                            text: str or None):
+        self.results[(image_hash, analyser.get_identifier(), version)] = AnalysisResult(
+            image_hash=image_hash, analyser=analyser.get_identifier(), analyser_version=version,
+            text=text, quality=analyser.get_quality(), created=0)
+
+
+def create_config(processes: int = 0, hedge_delay: float = 0.0, max_size: int = 0) -> SimpleNamespace:
+    """
+    :return: configuration containing the entries used by the analysis worker
+    """
+    values = {
+        "IMAGE_ANALYSIS_INTERVAL": 1,
+        "IMAGE_ANALYSIS_PROCESSES": processes,
+        "IMAGE_ANALYSIS_HEDGE_DELAY": hedge_delay,
+        "IMAGE_ANALYSIS_PREPROCESSING_CROP": 0.0,
+        "IMAGE_ANALYSIS_PREPROCESSING_MAX_SIZE": max_size,
+        "IMAGE_ANALYSIS_PREPROCESSING_GRAYSCALE": False,
+        "IMAGE_ANALYSIS_PREPROCESSING_BINARISE": False,
+        "IMAGE_ANALYSIS_PREPROCESSING_JPEG_QUALITY": 90,
+    }
+    return SimpleNamespace(**{key: SimpleNamespace(value=value) for key, value in values.items()})
+
+
+class AnalysisWorkerTests(unittest.TestCase):
+    """
+    Tests for the analysis worker using an in-memory persistence
+    """
+
+    def _create_worker(self, persistence: FakePersistence, analysers: [ImageAnalyser], **config) -> AnalysisWorker:
+        worker = AnalysisWorker(create_config(**config), persistence, analysers)
+        self.addCleanup(worker.stop)
+        return worker
+
+    def test_failed_image_of_batch_is_queued_again(self):
+        persistence = FakePersistence({1: b"first", 2: b"broken", 3: b"third"})
+        analyser = FakeAnalyser(batch_size=3, broken=[b"broken"])
+        worker = self._create_worker(persistence, [analyser])
+
+        worker._run()
+        self.assertEqual([b"first", b"broken", b"third"], analyser.calls)
+        self.assertEqual("first", persistence.images[1].text)
+        self.assertEqual("third", persistence.images[3].text)
+        # the failed image is neither updated nor cached
+        self.assertIsNone(persistence.images[2].analyser)
+        self.assertIsNone(persistence.get_analysis_result(None, "hash2", analyser, analyser.get_version()))
+
+        self.assertEqual(2, worker._queue.pop(None))
+
+    def test_give_up_after_max_attempts(self):
+        persistence = FakePersistence({1: b"broken"})
+        analyser = FakeAnalyser(broken=[b"broken"])
+        worker = self._create_worker(persistence, [analyser])
+
+        for _ in range(MAX_ANALYSIS_ATTEMPTS):
+            worker._analyse_next(None)
+        self.assertEqual(MAX_ANALYSIS_ATTEMPTS, len(analyser.calls))
+        self.assertEqual(0, len(worker._queue))
+
+    def test_cache_hit_skips_analyser(self):
+        persistence = FakePersistence({1: b"first"})
+        analyser = FakeAnalyser()
+        persistence.add_analysis_result(None, "hash1", analyser, analyser.get_version(), "cached")
+        worker = self._create_worker(persistence, [analyser])
+
+        worker._analyse_next(None)
+        self.assertEqual([], analyser.calls)
+        self.assertEqual("cached", persistence.images[1].text)
+        self.assertEqual(analyser.get_identifier(), persistence.images[1].analyser)
+
+    def test_cache_miss_stores_result(self):
+        persistence = FakePersistence({1: b"first"})
+        analyser = FakeAnalyser()
+        worker = self._create_worker(persistence, [analyser])
+
+        worker._analyse_next(None)
+        self.assertEqual([b"first"], analyser.calls)
+        result = persistence.get_analysis_result(None, "hash1", analyser, analyser.get_version())
+        self.assertEqual("first", result.text)
+        self.assertEqual(analyser.get_quality(), result.quality)
+
+    def test_cached_results_depend_on_preprocessing(self):
+        persistence = FakePersistence({1: b"first"})
+        analyser = FakeAnalyser()
+        persistence.add_analysis_result(None, "hash1", analyser, analyser.get_version(), "cached")
+        worker = self._create_worker(persistence, [analyser], max_size=1024)
+
+        # the cached result has been produced without downscaling
+        self.assertEqual("1+max_size=1024,jpeg_quality=90", worker._analyser_versions[analyser])
+        self.assertFalse(worker._apply_cached_result(None, persistence.images[1], analyser))
+
+    def test_hedge_shares_preprocessed_image(self):
+        persistence = FakePersistence({1: b"first"})
+        release = threading.Event()
+        self.addCleanup(release.set)
+        slow = FakeAnalyser(identifier="slow", quality=0.9, concurrency=1, release=release)
+        fast = FakeAnalyser(identifier="fast", quality=0.5, concurrency=1)
+        worker = self._create_worker(persistence, [slow, fast], hedge_delay=0.01)
+
+        prepared = []
+        prepare = worker._preprocessor.prepare
+        worker._preprocessor.prepare = lambda x: prepared.append(prepare(x)) or prepared[-1]
+
+        worker._analyse_next(None)
+        time.sleep(0.02)
+        worker._hedge_slow_analyses(None)
+        pending = next(filter(lambda x: x.analyser is slow, worker._pending.values()))
+        for hedge in pending.hedges:
+            hedge.result(timeout=5)
+
+        self.assertEqual([b"first"], fast.calls)
+        # the image is prepared once and shared by the slow analysis and its hedge
+        self.assertEqual(1, len(prepared))
+        hedge = next(filter(lambda x: x.analyser is fast, worker._pending.values()))
+        self.assertIs(prepared[0], hedge.prepared[0])
+
+    def test_cancelled_hedge_uses_no_capacity(self):
+        persistence = FakePersistence({1: b"first", 2: b"second"})
+        release_slow = threading.Event()
+        release_fast = threading.Event()
+        self.addCleanup(release_slow.set)
+        self.addCleanup(release_fast.set)
+        slow = FakeAnalyser(identifier="slow", quality=0.9, concurrency=1, release=release_slow)
+        fast = FakeAnalyser(identifier="fast", quality=0.5, concurrency=1, release=release_fast)
+        worker = self._create_worker(persistence, [slow, fast], hedge_delay=0.01)
+        first = (persistence.images[1], worker._preprocessor.prepare(b"first"))
+        second = (persistence.images[2], worker._preprocessor.prepare(b"second"))
+
+        # keeps the only thread of the fast analyser busy, so the hedge can't start
+        worker._submit(fast, [second])
+        primary = worker._submit(slow, [first])
+        worker._pending[primary].hedges = [worker._submit(fast, [first], hedge=True)]
+        self.assertEqual(fast.get_monthly_capacity() - 2, worker._capacity_ledger.get_remaining(fast))
+
+        release_slow.set()
+        primary.result(timeout=5)
+        worker._apply_results(None)
+
+        self.assertEqual("first", persistence.images[1].text)
+        self.assertEqual(fast.get_monthly_capacity() - 1, worker._capacity_ledger.get_remaining(fast))
+        self.assertEqual(1, len(worker._pending))
+
+    def test_process_pool(self):
+        persistence = FakePersistence({1: b"first", 2: b"second", 3: b"third"})
+        analyser = ProcessIdAnalyser()
+        worker = self._create_worker(persistence, [analyser], processes=2)
+
+        def complete_pending():
+            for future in list(worker._pending.keys()):
+                future.result(timeout=60)
+            worker._apply_results(None)
+
+        # the first run fills both processes, the third image has to wait for a free process
+        worker._run()
+        self.assertLessEqual(len(worker._pending), 2)
+        complete_pending()
+        worker._run()
+        complete_pending()
+
+        pids = set()
+        for entity_id, text in [(1, "first"), (2, "second"), (3, "third")]:
+            pid, entity_text = persistence.images[entity_id].text.split(" ")
+            self.assertEqual(text, entity_text)
+            pids.add(int(pid))
+            result = persistence.get_analysis_result(None, "hash{}".format(entity_id), analyser,
+                                                     analyser.get_version())
+            self.assertEqual(persistence.images[entity_id].text, result.text)
+        # images are analysed in the worker processes
+        self.assertNotIn(os.getpid(), pids)
+        self.assertLessEqual(len(pids), 2)
+        self.assertEqual(0, len(worker._pending))
+
+
+if __name__ == '__main__':
+    unittest.main()
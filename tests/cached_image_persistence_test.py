@@ -0,0 +1,66 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tempfile
+import unittest
+
+from infinitewisdom.persistence.cached_image_persistence import CachedImageDataStore
+from infinitewisdom.persistence.image_persistence import FileImageDataStore
+
+
+class CachedImageDataStoreTests(unittest.TestCase):
+    """
+    Tests for the in-memory image data cache
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.file_store = FileImageDataStore(self._temp_dir.name)
+        self.store = CachedImageDataStore(self.file_store, max_size=250)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_put_populates_cache(self):
+        self.store.put("aaa", b"a" * 100)
+        self.file_store.put("aaa", None)
+        self.assertEqual(b"a" * 100, self.store.get("aaa"))
+
+    def test_evicts_least_recently_used(self):
+        self.store.put("aaa", b"a" * 100)
+        self.store.put("bbb", b"b" * 100)
+        self.store.get("aaa")
+        self.store.put("ccc", b"c" * 100)
+
+        self.assertEqual(["aaa", "ccc"], sorted(self.store._cache.keys()))
+        self.assertEqual(200, self.store._size)
+        self.assertEqual(b"b" * 100, self.store.get("bbb"))
+
+    def test_remove(self):
+        self.store.put("aaa", b"a" * 100)
+        self.store.put("aaa", None)
+        self.assertFalse(self.store.has("aaa"))
+        self.assertIsNone(self.store.get("aaa"))
+        self.assertEqual(0, self.store._size)
+
+    def test_too_large_is_not_cached(self):
+        self.store.put("aaa", b"a" * 300)
+        self.assertEqual(0, len(self.store._cache))
+        self.assertEqual(b"a" * 300, self.store.get("aaa"))
+
+
+if __name__ == '__main__':
+    unittest.main()
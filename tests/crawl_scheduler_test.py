@@ -0,0 +1,70 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from infinitewisdom.crawl_scheduler import AdaptiveCrawlScheduler
+
+
+class AdaptiveCrawlSchedulerTests(unittest.TestCase):
+    """
+    Tests for the adaptive crawl interval
+    """
+
+    def setUp(self):
+        self.scheduler = AdaptiveCrawlScheduler(min_interval=1, max_interval=8, window=20, min_novelty=0.1)
+
+    def _record(self, novel: bool, count: int):
+        for _ in range(count):
+            self.scheduler.record(novel)
+
+    def test_backs_off_when_saturated(self):
+        self._record(False, 20)
+        self.assertEqual(2, self.scheduler.get_interval())
+        self._record(False, 100)
+        self.assertEqual(8, self.scheduler.get_interval())
+        self.assertEqual(0, self.scheduler.get_novelty())
+
+    def test_speeds_up_again(self):
+        self._record(False, 60)
+        self.assertEqual(8, self.scheduler.get_interval())
+        self._record(True, 100)
+        self.assertEqual(1, self.scheduler.get_interval())
+
+    def test_keeps_interval_in_between(self):
+        self._record(False, 20)
+        self.assertEqual(2, self.scheduler.get_interval())
+        # a novelty ratio of 0.15 neither backs off nor speeds up
+        for i in range(100):
+            self.scheduler.record(i % 20 < 3)
+        self.assertEqual(2, self.scheduler.get_interval())
+
+    def test_backs_off_from_zero_interval(self):
+        scheduler = AdaptiveCrawlScheduler(min_interval=0, max_interval=8, window=20, min_novelty=0.1)
+        for _ in range(20):
+            scheduler.record(False)
+        self.assertEqual(1, scheduler.get_interval())
+        for _ in range(100):
+            scheduler.record(False)
+        self.assertEqual(8, scheduler.get_interval())
+
+        for _ in range(100):
+            scheduler.record(True)
+        self.assertEqual(0, scheduler.get_interval())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from infinitewisdom.crawler import Crawler
+from infinitewisdom.util import create_hash
+
+IMAGE_API_URL = "https://inspirobot.me/api"
+
+
+class FakeResponse:
+    """
+    Response of the fake http client, usable as a streamed response
+    """
+
+    def __init__(self, text: str = "", content: bytes = b""):
+        self.text = text
+        self.content = content
+        self.headers = {"Content-Type": "image/jpeg"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size: int):
+        yield self.content
+
+
+class FakeHttpClient:
+    """
+    Http client generating the given image urls, the image data of an url is the url itself
+    unless specified otherwise
+    """
+
+    def __init__(self, urls: [str], image_data: {str: bytes} = None):
+        self.urls = list(urls)
+        self.image_data = image_data or {}
+        self.generated = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> FakeResponse:
+        if url == IMAGE_API_URL:
+            with self._lock:
+                # the last url is repeated once all urls have been generated
+                generated_url = self.urls[min(self.generated, len(self.urls) - 1)]
+                self.generated += 1
+            return FakeResponse(text=generated_url)
+        return FakeResponse(content=self.image_data.get(url, url.encode()))
+
+
+class FakePersistence:
+    """
+    In-memory persistence providing the methods used by the crawler
+    """
+
+    def __init__(self, temp_dir: str, urls: [str] = None):
+        self.temp_dir = temp_dir
+        self.urls = urls or []
+        self.images = {}
+        self.image_data = {}
+
+    def create_temp_image_file(self):
+        handle, file_path = tempfile.mkstemp(dir=self.temp_dir)
+        return os.fdopen(handle, "wb"), file_path
+
+    def get_all_urls(self, session, changed_after: float = None):
+        return list(self.urls)
+
+    def count(self, session) -> int:
+        return len(self.urls)
+
+    def find_by_image_hash(self, session, image_hash: str):
+        return self.images.get(image_hash, None)
+
+    def add_file(self, session, image, image_hash: str, file_path: str):
+        image.id = len(self.images) + 1
+        image.image_hash = image_hash
+        with open(file_path, "rb") as f:
+            self.image_data[image_hash] = f.read()
+        os.remove(file_path)
+        self.images[image_hash] = image
+        self.urls.append(image.url)
+
+    def update(self, session, entity, image_data: bytes = None):
+        self.image_data[entity.image_hash] = image_data
+
+
+class FakeWorker:
+    """
+    Collects the ids of images added to the queue of a worker
+    """
+
+    def __init__(self):
+        self.ids = []
+
+    def add_image_to_queue(self, image_entity_id: int):
+        self.ids.append(image_entity_id)
+
+
+def create_config(base_path: str, persist_workers: int = 1, queue_size: int = 16,
+                  novelty_window: int = 100) -> SimpleNamespace:
+    values = {
+        "CRAWLER_INTERVAL": 0.0,
+        "CRAWLER_MAX_INTERVAL": 10.0,
+        "CRAWLER_NOVELTY_WINDOW": novelty_window,
+        "CRAWLER_MIN_NOVELTY": 0.5,
+        "CRAWLER_URL_WORKERS": 1,
+        "CRAWLER_DOWNLOAD_WORKERS": 1,
+        "CRAWLER_HASH_WORKERS": 1,
+        "CRAWLER_PERSIST_WORKERS": persist_workers,
+        "CRAWLER_QUEUE_SIZE": queue_size,
+        "CRAWLER_URL_FILTER_CAPACITY": 1000,
+        "CRAWLER_URL_FILTER_ERROR_RATE": 0.001,
+        "FILE_PERSISTENCE_BASE_PATH": base_path,
+    }
+    return SimpleNamespace(**{key: SimpleNamespace(value=value) for key, value in values.items()})
+
+
+class CrawlerTests(unittest.TestCase):
+    """
+    Tests for the crawler pipeline with a faked image api and persistence
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_dir = os.path.join(self.temp_dir.name, "images")
+        os.makedirs(self.image_dir)
+        self.uploader = FakeWorker()
+        self.analysis_worker = FakeWorker()
+
+        session_scope = patch("infinitewisdom.crawler._session_scope", lambda *args: nullcontext())
+        session_scope.start()
+        self.addCleanup(session_scope.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _create_crawler(self, persistence: FakePersistence, http_client: FakeHttpClient, **kwargs) -> Crawler:
+        for target in ["infinitewisdom.crawler.HTTP_CLIENT", "infinitewisdom.util.HTTP_CLIENT"]:
+            http_client_patch = patch(target, http_client)
+            http_client_patch.start()
+            self.addCleanup(http_client_patch.stop)
+
+        config = create_config(self.temp_dir.name, **kwargs)
+        return Crawler(config, persistence, self.uploader, [], self.analysis_worker)
+
+    def _download(self, crawler: Crawler, url: str) -> (str, str, str):
+        crawler._generate_url()
+        self.assertEqual(url, crawler._download_queue.get_nowait())
+        crawler._download(url)
+        return crawler._hash_queue.get_nowait()
+
+    def _get_temp_files(self) -> [str]:
+        return os.listdir(self.image_dir)
+
+    def test_pipeline(self):
+        persistence = FakePersistence(self.image_dir)
+        crawler = self._create_crawler(persistence, FakeHttpClient(["url1", "url2"]))
+
+        for url in ["url1", "url2"]:
+            item = self._download(crawler, url)
+            self.assertEqual((url, create_hash(url.encode())), (item[0], item[2]))
+            crawler._hash(item)
+            crawler._persist(crawler._persist_queue.get_nowait())
+
+        self.assertEqual({create_hash(b"url1"): b"url1", create_hash(b"url2"): b"url2"}, persistence.image_data)
+        self.assertEqual([1, 2], self.uploader.ids)
+        self.assertEqual([1, 2], self.analysis_worker.ids)
+        self.assertIn("url1", crawler._url_filter)
+        self.assertEqual([], self._get_temp_files())
+        self.assertEqual(set(), crawler._pending_hashes)
+
+    def test_pending_hash_is_dropped(self):
+        persistence = FakePersistence(self.image_dir)
+        http_client = FakeHttpClient(["url1", "url2"], image_data={"url1": b"same", "url2": b"same"})
+        crawler = self._create_crawler(persistence, http_client)
+
+        first = self._download(crawler, "url1")
+        second = self._download(crawler, "url2")
+        crawler._hash(first)
+        # the first image hasn't been persisted yet, so the second one is dropped by its hash
+        crawler._hash(second)
+        self.assertEqual({create_hash(b"same")}, crawler._pending_hashes)
+        self.assertEqual(1, crawler._persist_queue.qsize())
+        self.assertEqual([os.path.basename(first[1])], self._get_temp_files())
+        self.assertIn("url2", crawler._url_filter)
+        self.assertEqual(0.0, crawler._scheduler.get_novelty())
+
+        crawler._persist(crawler._persist_queue.get_nowait())
+        self.assertEqual(["url1"], persistence.urls)
+        self.assertEqual(0.5, crawler._scheduler.get_novelty())
+        self.assertEqual(set(), crawler._pending_hashes)
+        self.assertEqual([], self._get_temp_files())
+
+    def test_known_urls_are_skipped(self):
+        persistence = FakePersistence(self.image_dir, urls=["known"])
+        crawler = self._create_crawler(persistence, FakeHttpClient(["known", "new"]))
+
+        crawler._generate_url()
+        self.assertEqual(0, crawler._download_queue.qsize())
+        crawler._generate_url()
+        self.assertEqual("new", crawler._download_queue.get_nowait())
+        # only the known url has been recorded, the new one is recorded once it is persisted
+        self.assertEqual(0.0, crawler._scheduler.get_novelty())
+
+    def test_known_urls_slow_down_the_crawler(self):
+        persistence = FakePersistence(self.image_dir, urls=["known"])
+        crawler = self._create_crawler(persistence, FakeHttpClient(["known"]), novelty_window=4)
+
+        for _ in range(4):
+            crawler._generate_url()
+        self.assertEqual(0, crawler._download_queue.qsize())
+        self.assertEqual(0.0, crawler._scheduler.get_novelty())
+        self.assertEqual(1.0, crawler._scheduler.get_interval())
+
+    def test_backpressure_and_stop(self):
+        http_client = FakeHttpClient(list(map(lambda x: "url{}".format(x), range(100))))
+        # without persist workers the pipeline fills up
+        crawler = self._create_crawler(FakePersistence(self.image_dir), http_client, persist_workers=0,
+                                       queue_size=1)
+        crawler.start()
+        try:
+            deadline = time.time() + 10
+            while not crawler._persist_queue.full() or not crawler._hash_queue.full() \
+                    or not crawler._download_queue.full():
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.01)
+            time.sleep(0.2)
+            generated = http_client.generated
+            time.sleep(0.2)
+            # each stage holds at most one item in its queue and one in progress
+            self.assertEqual(generated, http_client.generated)
+            self.assertLessEqual(generated, 7)
+        finally:
+            crawler.stop()
+
+        self.assertEqual(0, crawler._download_queue.qsize())
+        self.assertEqual(0, crawler._hash_queue.qsize())
+        self.assertEqual(0, crawler._persist_queue.qsize())
+        self.assertEqual(set(), crawler._pending_hashes)
+        # temporary files of images that were still on their way are removed
+        self.assertEqual([], self._get_temp_files())
+        self.assertTrue(os.path.exists(crawler._url_filter_file_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text as sql_text
+
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, Base, _session_scope
+
+MIGRATION_FILE_PATH = os.path.join(os.path.dirname(__file__), "..", "alembic", "versions",
+                                   "d7526a63b3f3_added_full_text_search_index.py")
+
+
+def load_migration():
+    spec = importlib.util.spec_from_file_location("full_text_search_migration", MIGRATION_FILE_PATH)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    return migration
+
+
+class FullTextSearchTests(unittest.TestCase):
+    """
+    Tests for the text search of the SQLAlchemy persistence using SQLite
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _create_persistence(self, full_text_search: bool) -> SQLAlchemyPersistence:
+        url = "sqlite:///{}".format(os.path.join(self.temp_dir.name, "test.db"))
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        if full_text_search:
+            with engine.begin() as connection:
+                for statement in load_migration().SQLITE_UPGRADE:
+                    connection.execute(sql_text(statement))
+        engine.dispose()
+
+        # the complete migration history can't be applied to SQLite
+        with patch.object(SQLAlchemyPersistence, "_migrate_db"):
+            persistence = SQLAlchemyPersistence(url)
+
+        with _session_scope() as session:
+            for i, text in enumerate(["Hello World", "The world is yours", "You are a hero", None, "Heroic deeds"]):
+                session.add(Image(id=i + 1, url="url{}".format(i + 1), text=text, created=i))
+        return persistence
+
+    def _find(self, persistence: SQLAlchemyPersistence, text: str) -> [int]:
+        with _session_scope() as session:
+            return sorted(map(lambda x: x.id, persistence.find_by_text(session, text)))
+
+    def test_full_text_search(self):
+        persistence = self._create_persistence(full_text_search=True)
+        self.assertTrue(persistence._full_text_search)
+
+        # every word has to match as a prefix
+        self.assertEqual([2], self._find(persistence, "WOR is"))
+        self.assertEqual([3, 5], self._find(persistence, "hero"))
+        self.assertEqual([], self._find(persistence, "hero world"))
+
+    def test_index_follows_changes(self):
+        persistence = self._create_persistence(full_text_search=True)
+        with _session_scope() as session:
+            session.query(Image).get(4).text = "another world"
+            session.query(Image).get(1).text = "goodbye"
+            session.delete(session.query(Image).get(2))
+
+        self.assertEqual([4], self._find(persistence, "world"))
+        self.assertEqual([1], self._find(persistence, "good"))
+
+    def test_ilike_fallback(self):
+        persistence = self._create_persistence(full_text_search=False)
+        self.assertFalse(persistence._full_text_search)
+
+        self.assertEqual([1, 2], self._find(persistence, "world"))
+        self.assertEqual([3, 5], self._find(persistence, "hero"))
+
+
+if __name__ == '__main__':
+    unittest.main()
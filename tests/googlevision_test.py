@@ -0,0 +1,86 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from types import SimpleNamespace
+
+from infinitewisdom.analysis import AnalysisError
+from infinitewisdom.analysis.googlevision import GoogleVision
+
+
+class FakeImageAnnotatorClient:
+    """
+    Fake of the Google Vision client that "detects" the image data as text
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def batch_annotate_images(self, requests: [dict]):
+        self.batch_sizes.append(len(requests))
+        return SimpleNamespace(responses=list(map(self._annotate, requests)))
+
+    @staticmethod
+    def _annotate(request: dict):
+        # vision.Feature.Type.TEXT_DETECTION
+        assert request["features"] == [{"type_": 5}]
+        content = request["image"]["content"]
+        if content == b"broken":
+            return SimpleNamespace(error=SimpleNamespace(message="Bad image data"), text_annotations=[])
+
+        annotations = []
+        if len(content) > 0:
+            annotations.append(SimpleNamespace(description=content.decode()))
+        return SimpleNamespace(error=SimpleNamespace(message=""), text_annotations=annotations)
+
+
+class GoogleVisionTests(unittest.TestCase):
+    """
+    Tests for the Google Vision analyser using a fake client
+    """
+
+    def setUp(self):
+        self.client = FakeImageAnnotatorClient()
+        self.analyser = GoogleVision("auth.json", batch_size=4, client=self.client)
+
+    def test_batch_size(self):
+        self.assertEqual(4, self.analyser.get_batch_size())
+        self.assertEqual(16, GoogleVision("auth.json", batch_size=100, client=self.client).get_batch_size())
+        self.assertRaises(ValueError, self.analyser.find_text_batch, [b"a"] * 5)
+
+    def test_find_text_batch(self):
+        texts = self.analyser.find_text_batch([b"first", b"", b"third"])
+        self.assertEqual(["first", None, "third"], texts)
+        # all images are analysed in a single request
+        self.assertEqual([3], self.client.batch_sizes)
+
+    def test_mixed_success_and_error(self):
+        texts = self.analyser.find_text_batch([b"first", b"broken", b"third"])
+        self.assertEqual("first", texts[0])
+        self.assertIsInstance(texts[1], AnalysisError)
+        self.assertIn("Bad image data", str(texts[1]))
+        self.assertEqual("third", texts[2])
+        self.assertEqual([3], self.client.batch_sizes)
+
+    def test_error_single_image(self):
+        self.assertRaises(AnalysisError, self.analyser._get_text, self.client._annotate({
+            "image": {"content": b"broken"},
+            "features": [{"type_": 5}]
+        }))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from infinitewisdom.util import HttpClient
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Fails every request until the configured number of failures is reached
+    """
+    failures = 0
+    requests = 0
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond()
+
+    def _respond(self):
+        FlakyHandler.requests += 1
+        status = 503 if FlakyHandler.requests <= FlakyHandler.failures else 200
+        body = b"ok"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTests(unittest.TestCase):
+    """
+    Tests for the shared http client
+    """
+
+    def setUp(self):
+        FlakyHandler.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_port)
+        self.client = HttpClient(retries=2, backoff_factor=0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retries_temporary_errors(self):
+        FlakyHandler.failures = 2
+        response = self.client.get(self.url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, FlakyHandler.requests)
+
+    def test_returns_last_response_when_retries_are_exhausted(self):
+        FlakyHandler.failures = 5
+        response = self.client.get(self.url)
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(3, FlakyHandler.requests)
+
+    def test_post_is_not_retried_by_default(self):
+        FlakyHandler.failures = 1
+        response = self.client.post(self.url, data=b"data")
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(1, FlakyHandler.requests)
+
+    def test_post_is_retried_on_opt_in(self):
+        FlakyHandler.failures = 1
+        response = self.client.post(self.url, retry=True, data=b"data")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, FlakyHandler.requests)
+
+    def test_get_is_not_retried_on_opt_out(self):
+        FlakyHandler.failures = 1
+        response = self.client.get(self.url, retry=False)
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(1, FlakyHandler.requests)
+
+    def test_retried_streamed_responses_release_their_connections(self):
+        FlakyHandler.failures = 4
+        client = HttpClient(max_connections_per_host=2, retries=3, backoff_factor=0, pool_timeout=1)
+        # more attempts than pooled connections, this blocks if retried responses aren't closed
+        response = client.get(self.url, stream=True)
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(4, FlakyHandler.requests)
+        response.close()
+
+        response = client.get(self.url, stream=True)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"ok", response.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
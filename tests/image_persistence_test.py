@@ -0,0 +1,153 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+import unittest
+
+from infinitewisdom.persistence.image_persistence import FileImageDataStore
+from infinitewisdom.util import create_hash
+
+
+class FileImageDataStoreTests(unittest.TestCase):
+    """
+    Tests for the file based image data store
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.store = FileImageDataStore(self._temp_dir.name)
+        self.image_data = b"some image data"
+        self.image_hash = create_hash(self.image_data)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_put_get_remove(self):
+        self.store.put(self.image_hash, self.image_data)
+        self.assertTrue(self.store.has(self.image_hash))
+        self.assertEqual(self.image_data, self.store.get(self.image_hash))
+        self.assertEqual([self.image_hash], list(self.store.get_hashes()))
+
+        self.store.put(self.image_hash, None)
+        self.assertFalse(self.store.has(self.image_hash))
+        self.assertIsNone(self.store.get(self.image_hash))
+
+    def test_verify(self):
+        self.store.put(self.image_hash, self.image_data)
+        self.assertTrue(self.store.verify(self.image_hash))
+
+        with open(self.store._get_file_path(self.image_hash), 'wb') as f:
+            f.write(b"corrupted")
+        self.assertFalse(self.store.verify(self.image_hash))
+
+        # data of a different size replaces the corrupted file
+        self.store.put(self.image_hash, self.image_data)
+        self.assertTrue(self.store.verify(self.image_hash))
+
+    def test_put_file(self):
+        temp_file, temp_file_path = self.store.create_temp_file()
+        with temp_file:
+            temp_file.write(self.image_data)
+        self.store.put_file(self.image_hash, temp_file_path)
+
+        self.assertFalse(os.path.exists(temp_file_path))
+        self.assertEqual(self.image_data, self.store.get(self.image_hash))
+        self.assertEqual([self.image_hash], list(self.store.get_hashes()))
+
+    def _run_concurrently(self, *targets):
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(x,)) for x in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            raise errors[0]
+
+    def _get_files(self) -> [str]:
+        return [file for _, _, files in os.walk(self._temp_dir.name) for file in files]
+
+    def test_readers_never_see_partial_data(self):
+        # data of different sizes, so every put replaces the file
+        versions = [b"a" * 1024 * 1024, b"b" * 2 * 1024 * 1024]
+        writing = threading.Event()
+        writing.set()
+
+        def write():
+            try:
+                for i in range(50):
+                    self.store.put(self.image_hash, versions[i % 2])
+                    if i % 10 == 4:
+                        self.store.put(self.image_hash, None)
+            finally:
+                writing.clear()
+
+        def read():
+            while writing.is_set():
+                image_data = self.store.get(self.image_hash)
+                if image_data is not None:
+                    self.assertIn(image_data, versions)
+
+        self._run_concurrently(write, read, read)
+        self.assertEqual(versions[1], self.store.get(self.image_hash))
+        # no temporary files are left behind
+        self.assertEqual(["{}.jpg".format(self.image_hash)], self._get_files())
+
+    def test_remove_racing_put(self):
+        # hashes stored in the same folder but guarded by different locks
+        removed_hash = "abc0"
+        put_hash = next(filter(lambda x: self.store._get_lock(x) is not self.store._get_lock(removed_hash),
+                               map(lambda x: "abc{}".format(x), range(1, 100))))
+        self.assertEqual(os.path.dirname(self.store._get_file_path(removed_hash)),
+                         os.path.dirname(self.store._get_file_path(put_hash)))
+
+        def put_and_remove():
+            for _ in range(500):
+                self.store.put(removed_hash, b"removed")
+                self.store.put(removed_hash, None)
+
+        def put():
+            for i in range(500):
+                image_data = "put {}".format(i % 2).encode()
+                if i % 2 == 0:
+                    self.store.put(put_hash, image_data)
+                else:
+                    temp_file, temp_file_path = self.store.create_temp_file()
+                    with temp_file:
+                        temp_file.write(image_data)
+                    self.store.put_file(put_hash, temp_file_path)
+                self.assertEqual(image_data, self.store.get(put_hash))
+                self.store.put(put_hash, None)
+            self.store.put(put_hash, b"final")
+
+        self._run_concurrently(put_and_remove, put)
+        self.assertFalse(self.store.has(removed_hash))
+        self.assertEqual(b"final", self.store.get(put_hash))
+        self.assertEqual([put_hash], list(self.store.get_hashes()))
+        self.assertEqual(["{}.jpg".format(put_hash)], self._get_files())
+
+
+if __name__ == '__main__':
+    unittest.main()
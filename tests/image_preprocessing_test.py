@@ -0,0 +1,90 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import importlib.util
+import unittest
+
+import numpy as np
+
+from infinitewisdom.analysis.preprocessing import ImagePreprocessor, INPUT_FORMAT_JPEG, INPUT_FORMAT_GRAYSCALE, \
+    crop, downscale, binarise
+
+CV2_AVAILABLE = importlib.util.find_spec("cv2") is not None
+
+
+class ImagePreprocessingTests(unittest.TestCase):
+    """
+    Tests for the vectorised image preprocessing operations
+    """
+
+    def test_crop(self):
+        image = np.arange(100, dtype=np.uint8).reshape(10, 10)
+        cropped = crop(image, 0.2)
+        self.assertEqual((6, 6), cropped.shape)
+        self.assertEqual(22, cropped[0, 0])
+        self.assertEqual(77, cropped[-1, -1])
+
+    def test_downscale(self):
+        image = np.zeros((9, 6, 3), dtype=np.uint8)
+        image[:, :3] = 200
+        scaled = downscale(image, 3)
+        self.assertEqual((3, 2, 3), scaled.shape)
+        self.assertTrue(np.all(scaled[:, 0] == 200))
+        self.assertTrue(np.all(scaled[:, 1] == 0))
+
+    def test_downscale_small_image(self):
+        image = np.zeros((4, 4), dtype=np.uint8)
+        self.assertIs(image, downscale(image, 4))
+
+    @unittest.skipUnless(CV2_AVAILABLE, "opencv is not installed")
+    def test_grayscale_matches_grayscale_decoding(self):
+        import cv2
+
+        image = np.random.default_rng(0).integers(0, 256, (32, 48, 3), dtype=np.uint8)
+        image_data = cv2.imencode(".png", image)[1].tobytes()
+        expected = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+        prepared = ImagePreprocessor().prepare(image_data)
+        self.assertTrue(np.array_equal(expected, prepared.get(INPUT_FORMAT_GRAYSCALE)))
+        # the representation is only created once
+        self.assertIs(prepared.get(INPUT_FORMAT_GRAYSCALE), prepared.get(INPUT_FORMAT_GRAYSCALE))
+
+    def test_fingerprint(self):
+        self.assertEqual("", ImagePreprocessor().get_fingerprint(INPUT_FORMAT_JPEG))
+        self.assertEqual("", ImagePreprocessor().get_fingerprint(INPUT_FORMAT_GRAYSCALE))
+        # settings that only affect the other representation don't change the fingerprint
+        self.assertEqual("", ImagePreprocessor(binarise=True).get_fingerprint(INPUT_FORMAT_JPEG))
+        self.assertEqual("", ImagePreprocessor(grayscale=True).get_fingerprint(INPUT_FORMAT_GRAYSCALE))
+
+        preprocessor = ImagePreprocessor(crop=0.1, max_size=512, binarise=True)
+        self.assertEqual("crop=0.1,max_size=512,binarise", preprocessor.get_fingerprint(INPUT_FORMAT_GRAYSCALE))
+        self.assertEqual("crop=0.1,max_size=512,jpeg_quality=90", preprocessor.get_fingerprint(INPUT_FORMAT_JPEG))
+
+    def test_binarise(self):
+        image = np.array([[10, 20, 30, 200, 210, 220]], dtype=np.uint8)
+        self.assertEqual([0, 0, 0, 255, 255, 255], binarise(image)[0].tolist())
+
+    def test_unmodified_jpeg_is_not_decoded(self):
+        data = b"not an image"
+        prepared = ImagePreprocessor().prepare(data)
+        self.assertIs(data, prepared.get(INPUT_FORMAT_JPEG))
+
+    def test_invalid_input_format(self):
+        prepared = ImagePreprocessor().prepare(b"")
+        self.assertRaises(ValueError, prepared.get, "unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
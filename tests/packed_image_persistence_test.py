@@ -0,0 +1,102 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from infinitewisdom.persistence.packed_image_persistence import PackedImageDataStore
+
+
+class PackedImageDataStoreTests(unittest.TestCase):
+    """
+    Tests for the packed image data store
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_path = self._temp_dir.name
+        self.data = {"hash{}".format(i): os.urandom(100 + i) for i in range(10)}
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _create_store(self) -> PackedImageDataStore:
+        return PackedImageDataStore(self.base_path, segment_size=500)
+
+    def test_put_get_remove(self):
+        store = self._create_store()
+        for image_hash, image_data in self.data.items():
+            store.put(image_hash, image_data)
+
+        for image_hash, image_data in self.data.items():
+            self.assertTrue(store.has(image_hash))
+            self.assertEqual(image_data, store.get(image_hash))
+
+        store.put("hash0", None)
+        self.assertFalse(store.has("hash0"))
+        self.assertIsNone(store.get("hash0"))
+        self.assertEqual(9, len(list(store.get_hashes())))
+
+    def test_reload(self):
+        store = self._create_store()
+        for image_hash, image_data in self.data.items():
+            store.put(image_hash, image_data)
+        store.put("hash0", None)
+
+        store = self._create_store()
+        self.assertFalse(store.has("hash0"))
+        for image_hash, image_data in list(self.data.items())[1:]:
+            self.assertEqual(image_data, store.get(image_hash))
+
+    def test_compact(self):
+        store = self._create_store()
+        for image_hash, image_data in self.data.items():
+            store.put(image_hash, image_data)
+        for image_hash in list(self.data.keys())[:5]:
+            store.put(image_hash, None)
+        self.assertGreater(store.get_dead_ratio(), 0)
+
+        store.compact()
+        self.assertEqual(0, store.get_dead_ratio())
+
+        store = self._create_store()
+        self.assertEqual(5, len(list(store.get_hashes())))
+        for image_hash, image_data in list(self.data.items())[5:]:
+            self.assertEqual(image_data, store.get(image_hash))
+
+    def test_failed_write_is_discarded(self):
+        store = self._create_store()
+        store.put("hash0", self.data["hash0"])
+
+        def write_partially(segment_file):
+            segment_file.write(b"partial")
+            raise OSError("No space left on device")
+
+        self.assertRaises(OSError, store._append, 100, write_partially)
+        self.assertFalse(store.has("hash1"))
+
+        store.put("hash1", self.data["hash1"])
+        self.assertEqual(self.data["hash0"], store.get("hash0"))
+        self.assertEqual(self.data["hash1"], store.get("hash1"))
+        self.assertEqual(0, store.get_dead_ratio())
+
+        store = self._create_store()
+        self.assertEqual(self.data["hash1"], store.get("hash1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+
+from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_TESSERACT, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION, \
+    FILE_PERSISTENCE_STORE_FILES
+from infinitewisdom.persistence import ImageDataPersistence
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, Base, _session_scope
+from infinitewisdom.persistence.statistics import PersistenceStatistics, EntityState
+
+
+def get_metric(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels)
+
+
+class PersistenceStatisticsTests(unittest.TestCase):
+    """
+    Tests for the incrementally updated persistence statistics
+    """
+
+    def setUp(self):
+        self.stats = PersistenceStatistics()
+        self.stats.set(pool_size=10, with_image_data=8, uploaded=5, with_text=4,
+                       analysers={IMAGE_ANALYSIS_TYPE_TESSERACT: 4})
+
+    def _assert_metrics(self, pool_size: int, with_image_data: int, uploaded: int, with_text: int,
+                        tesseract: int, google_vision: int):
+        self.assertEqual(pool_size, get_metric("pool_size"))
+        self.assertEqual(with_image_data, get_metric("entities_with_image_data_count"))
+        self.assertEqual(uploaded, get_metric("telegram_entities_count"))
+        self.assertEqual(with_text, get_metric("image_analysis_has_text_count"))
+        self.assertEqual(tesseract, get_metric("image_analysis_type_count", type=IMAGE_ANALYSIS_TYPE_TESSERACT))
+        self.assertEqual(google_vision,
+                         get_metric("image_analysis_type_count", type=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION))
+
+    def test_set(self):
+        self._assert_metrics(10, 8, 5, 4, 4, 0)
+
+    def test_added_and_removed(self):
+        state = EntityState(has_image_data=True, uploaded=False, analyser=None, has_text=False)
+        self.stats.added(state)
+        self._assert_metrics(11, 9, 5, 4, 4, 0)
+
+        self.stats.removed(EntityState(has_image_data=True, uploaded=True, analyser=IMAGE_ANALYSIS_TYPE_TESSERACT,
+                                       has_text=True))
+        self._assert_metrics(10, 8, 4, 3, 3, 0)
+
+    def test_changed(self):
+        old = EntityState(has_image_data=True, uploaded=True, analyser=IMAGE_ANALYSIS_TYPE_TESSERACT, has_text=True)
+        new = EntityState(has_image_data=True, uploaded=True, analyser=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION,
+                          has_text=True)
+        self.stats.changed(old, new)
+        self._assert_metrics(10, 8, 5, 4, 3, 1)
+
+        # an unchanged state doesn't change anything
+        self.stats.changed(new, new)
+        self._assert_metrics(10, 8, 5, 4, 3, 1)
+
+
+
+class ImageDataPersistenceStatisticsTests(unittest.TestCase):
+    """
+    Tests for the statistics changes applied by the persistence on updates
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        url = "sqlite:///{}".format(os.path.join(self.temp_dir.name, "test.db"))
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+
+        values = {
+            "SQL_PERSISTENCE_URL": url,
+            "FILE_PERSISTENCE_BASE_PATH": self.temp_dir.name,
+            "FILE_PERSISTENCE_STORE": FILE_PERSISTENCE_STORE_FILES,
+            "FILE_PERSISTENCE_CACHE_SIZE": 0,
+            "PERSISTENCE_IN_MEMORY_TEXT_INDEX": False,
+            "TELEGRAM_BOT_TOKEN": "token",
+        }
+        config = SimpleNamespace(**{key: SimpleNamespace(value=value) for key, value in values.items()})
+        # the complete migration history can't be applied to SQLite
+        with patch.object(SQLAlchemyPersistence, "_migrate_db"):
+            self.persistence = ImageDataPersistence(config)
+
+        with _session_scope() as session:
+            self.persistence.add(session, Image(url="url1", created=1), b"first")
+            self.persistence.add(session, Image(url="url2", text="Hello", analyser=IMAGE_ANALYSIS_TYPE_TESSERACT,
+                                                analyser_quality=0.5, created=2), b"second")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _assert_metrics(self, uploaded: int, with_text: int, tesseract: int, google_vision: int):
+        self.assertEqual(2, get_metric("pool_size"))
+        self.assertEqual(2, get_metric("entities_with_image_data_count"))
+        self.assertEqual(uploaded, get_metric("telegram_entities_count"))
+        self.assertEqual(with_text, get_metric("image_analysis_has_text_count"))
+        self.assertEqual(tesseract, get_metric("image_analysis_type_count", type=IMAGE_ANALYSIS_TYPE_TESSERACT))
+        self.assertEqual(google_vision,
+                         get_metric("image_analysis_type_count", type=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION))
+
+    def test_update_after_autoflush(self):
+        self._assert_metrics(0, 1, 1, 0)
+        with _session_scope() as session:
+            entity = self.persistence.find_by_url(session, "url1")[0]
+            entity.text = "World"
+            entity.analyser = IMAGE_ANALYSIS_TYPE_GOOGLE_VISION
+            # flushes the changes before the entity is updated
+            session.query(Image).count()
+            self.persistence.update(session, entity)
+        self._assert_metrics(0, 2, 1, 1)
+
+        with _session_scope() as session:
+            entity = self.persistence.find_by_url(session, "url2")[0]
+            entity.text = None
+            self.persistence.update(session, entity)
+            # updating an unchanged entity doesn't change anything
+            self.persistence.update(session, entity)
+        self._assert_metrics(0, 1, 1, 1)
+
+    def test_upload(self):
+        with _session_scope() as session:
+            bot_token = self.persistence.get_bot_token(session, "token")
+            entity = self.persistence.find_by_url(session, "url1")[0]
+            entity.add_file_id(bot_token, "file1")
+            session.query(Image).count()
+            self.persistence.update(session, entity)
+            self._assert_metrics(1, 1, 1, 0)
+
+            # another file id of an uploaded image doesn't count again
+            entity.add_file_id(bot_token, "file2")
+            self.persistence.update(session, entity)
+            # neither do uploads by other bots
+            entity.add_file_id(self.persistence.get_bot_token(session, "other"), "file3")
+            self.persistence.update(session, entity)
+        self._assert_metrics(1, 1, 1, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
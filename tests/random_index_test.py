@@ -0,0 +1,47 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from infinitewisdom.persistence.random_index import RandomIdIndex
+
+
+class RandomIdIndexTests(unittest.TestCase):
+    """
+    Tests for the random id index
+    """
+
+    def test_sample_is_distinct(self):
+        index = RandomIdIndex(range(100))
+        sample = index.sample(16)
+        self.assertEqual(16, len(sample))
+        self.assertEqual(16, len(set(sample)))
+
+    def test_sample_larger_than_index(self):
+        index = RandomIdIndex([1, 2, 3])
+        self.assertCountEqual([1, 2, 3], index.sample(16))
+        self.assertEqual([], RandomIdIndex().sample(1))
+
+    def test_add_and_remove(self):
+        index = RandomIdIndex([1, 2, 3])
+        index.add(3)
+        index.add(4)
+        index.remove(1)
+        index.remove(4)
+        index.remove(42)
+        self.assertEqual(2, len(index))
+        self.assertNotIn(1, index)
+        self.assertCountEqual([2, 3], index.sample(10))
@@ -0,0 +1,94 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+from telegram.error import RetryAfter
+
+from infinitewisdom.rate_limiter import TelegramRateLimiter, PRIORITY_BACKGROUND, PRIORITY_USER, TokenBucket
+
+
+class TelegramRateLimiterTests(unittest.TestCase):
+    """
+    Tests for the telegram rate limiter
+    """
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        now = time.monotonic()
+        self.assertEqual(0, bucket.get_wait_time(2, now))
+        bucket.take(2)
+        self.assertAlmostEqual(0.1, bucket.get_wait_time(1, now), delta=0.01)
+        # more than the capacity only waits for a full bucket
+        self.assertAlmostEqual(0.2, bucket.get_wait_time(5, now), delta=0.01)
+
+    def test_chat_limit(self):
+        limiter = TelegramRateLimiter(global_rate=1000, chat_rate=20, chat_burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire(1)
+        # the first message is sent immediately
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+        # other chats are not affected
+        start = time.monotonic()
+        limiter.acquire(2)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_user_priority(self):
+        limiter = TelegramRateLimiter(global_rate=10, chat_rate=1000, chat_burst=10)
+        limiter.acquire(1, count=10)
+
+        order = []
+
+        def send(chat_id: int, priority: int):
+            limiter.acquire(chat_id, priority)
+            order.append(priority)
+
+        background = threading.Thread(target=send, args=(2, PRIORITY_BACKGROUND))
+        background.start()
+        time.sleep(0.02)
+        user = threading.Thread(target=send, args=(3, PRIORITY_USER))
+        user.start()
+        background.join()
+        user.join()
+
+        self.assertEqual([PRIORITY_USER, PRIORITY_BACKGROUND], order)
+
+    def test_retry_after(self):
+        limiter = TelegramRateLimiter(global_rate=1000, chat_rate=1000)
+        calls = []
+
+        def send():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise RetryAfter(0.2)
+            return "sent"
+
+        self.assertEqual("sent", limiter.send(1, send))
+        self.assertEqual(2, len(calls))
+        self.assertGreaterEqual(calls[1] - calls[0], 0.19)
+
+        def always_fail():
+            raise RetryAfter(0)
+
+        self.assertRaises(RetryAfter, limiter.send, 1, always_fail)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, Base, _sessionmaker, \
+    _session_scope
+
+
+class SQLAlchemyPersistenceTests(unittest.TestCase):
+    """
+    Tests for telegram upload related queries of the SQLAlchemy persistence
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        engine = create_engine("sqlite:///{}".format(os.path.join(self.temp_dir.name, "test.db")))
+        Base.metadata.create_all(engine)
+        _sessionmaker.configure(bind=engine)
+        self.persistence = SQLAlchemyPersistence
+
+        # image 1 has been uploaded by bot a, image 2 by bot b, image 3 by both and image 4 by none of them
+        with _session_scope() as session:
+            bot_a = self.persistence.get_or_add_bot_token(session, "bot_a")
+            bot_b = self.persistence.get_or_add_bot_token(session, "bot_b")
+            for entity_id in range(1, 5):
+                session.add(Image(id=entity_id, url="url{}".format(entity_id), created=entity_id))
+            session.flush()
+            session.query(Image).get(1).add_file_id(bot_a, "file1")
+            session.query(Image).get(2).add_file_id(bot_b, "file2")
+            session.query(Image).get(3).add_file_id(bot_a, "file3")
+            session.query(Image).get(3).add_file_id(bot_b, "file3")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _get_not_uploaded_image_ids(self, bot_token: str, chunk_size: int = 10000) -> [int]:
+        with _session_scope(False) as session:
+            return sorted(self.persistence.get_not_uploaded_image_ids(session, bot_token, chunk_size))
+
+    def test_get_not_uploaded_image_ids(self):
+        self.assertEqual([2, 4], self._get_not_uploaded_image_ids("bot_a"))
+        self.assertEqual([1, 4], self._get_not_uploaded_image_ids("bot_b"))
+        # the result is the same when it is streamed in small chunks
+        self.assertEqual([2, 4], self._get_not_uploaded_image_ids("bot_a", chunk_size=1))
+
+    def test_get_not_uploaded_image_ids_unknown_bot(self):
+        self.assertEqual([], self._get_not_uploaded_image_ids("unknown"))
+
+    def test_find_telegram_file_ids(self):
+        with _session_scope(False) as session:
+            self.assertEqual({1: "file1", 3: "file3"},
+                             self.persistence.find_telegram_file_ids(session, "bot_a", [1, 2, 3, 4]))
+            self.assertEqual({2: "file2"}, self.persistence.find_telegram_file_ids(session, "bot_b", [1, 2]))
+            self.assertEqual({}, self.persistence.find_telegram_file_ids(session, "unknown", [1, 2, 3]))
+            self.assertEqual({}, self.persistence.find_telegram_file_ids(session, "bot_a", []))
+
+
+if __name__ == '__main__':
+    unittest.main()
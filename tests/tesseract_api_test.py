@@ -0,0 +1,56 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib.util
+import unittest
+
+import numpy as np
+
+from infinitewisdom.analysis.tesseract_api import TesseractApi
+
+TESSEROCR_AVAILABLE = importlib.util.find_spec("tesserocr") is not None
+CV2_AVAILABLE = importlib.util.find_spec("cv2") is not None
+
+
+class TesseractApiTests(unittest.TestCase):
+    """
+    Tests for the tesserocr analyser
+    """
+
+    @unittest.skipIf(TESSEROCR_AVAILABLE, "tesserocr is installed")
+    def test_missing_tesserocr(self):
+        # allows falling back to pytesseract
+        self.assertRaises(ImportError, TesseractApi)
+
+    @unittest.skipUnless(TESSEROCR_AVAILABLE and CV2_AVAILABLE, "tesserocr or cv2 is not installed")
+    def test_find_text(self):
+        import cv2
+
+        image = np.full((100, 400), 255, dtype=np.uint8)
+        cv2.putText(image, "WISDOM", (20, 70), cv2.FONT_HERSHEY_SIMPLEX, 2, 0, 4)
+
+        analyser = TesseractApi()
+        self.assertIn("WISDOM", analyser.find_text(image))
+        # the API handle is reused
+        self.assertIs(analyser._get_api(), analyser._get_api())
+
+    @unittest.skipUnless(TESSEROCR_AVAILABLE and CV2_AVAILABLE, "tesserocr or cv2 is not installed")
+    def test_invalid_image_raises(self):
+        self.assertRaises(ValueError, TesseractApi().find_text, b"no image")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from infinitewisdom.persistence.text_index import InvertedTextIndex
+
+
+class InvertedTextIndexTests(unittest.TestCase):
+    """
+    Tests for the in-memory text index
+    """
+
+    def setUp(self):
+        self.index = InvertedTextIndex([
+            (1, "Hello World"),
+            (2, "The world is yours"),
+            (3, "You are a hero"),
+            (4, None),
+            (5, "Heroic deeds"),
+        ])
+
+    def test_search_matches_all_words_as_prefix(self):
+        self.assertEqual([2], self.index.search("WOR is"))
+        self.assertEqual([3, 5], self.index.search("hero"))
+        self.assertEqual([], self.index.search("hero world"))
+        self.assertEqual([], self.index.search("!!"))
+
+    def test_update_and_remove(self):
+        self.index.update(4, "another world")
+        self.index.update(1, "goodbye")
+        self.index.remove(2)
+        self.assertEqual([4], self.index.search("world"))
+        self.assertEqual([1], self.index.search("good"))
+        self.assertEqual(4, len(self.index))
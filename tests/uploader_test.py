@@ -0,0 +1,132 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from telegram.error import NetworkError, BadRequest, RetryAfter
+
+from infinitewisdom.persistence.sqlalchemy import Image, BotToken
+from infinitewisdom.uploader import TelegramUploader
+
+
+class FakePersistence:
+    """
+    In-memory persistence providing the methods used by the uploader
+    """
+
+    def __init__(self, images: {int: bytes}):
+        self.images = {}
+        self.image_data = {}
+        for entity_id, image_data in images.items():
+            self.images[entity_id] = Image(id=entity_id, url="url{}".format(entity_id), created=entity_id)
+            self.image_data[entity_id] = image_data
+        self.bot_token = BotToken(hashed_token="hashed")
+
+    def get_not_uploaded_image_ids(self, session, bot_token: str):
+        return list(self.images.keys())
+
+    def get_image(self, session, entity_id: int):
+        return self.images.get(entity_id, None)
+
+    def get_image_data(self, entity: Image):
+        return self.image_data.get(entity.id, None)
+
+    def get_bot_token(self, session, bot_token: str):
+        return self.bot_token
+
+    def update(self, session, entity: Image, image_data: bytes = None):
+        pass
+
+
+class TelegramUploaderTests(unittest.TestCase):
+    """
+    Tests for the telegram uploader with faked telegram requests
+    """
+
+    def setUp(self):
+        self.persistence = FakePersistence({1: b"first", 2: b"broken", 3: b"third"})
+        config = SimpleNamespace(UPLOADER_INTERVAL=SimpleNamespace(value=1),
+                                 UPLOADER_CHAT_ID=SimpleNamespace(value="chat"),
+                                 UPLOADER_BATCH_SIZE=SimpleNamespace(value=10))
+        self.uploader = TelegramUploader(config, self.persistence, SimpleNamespace(token="token"))
+
+    @staticmethod
+    def _send_photo(bot, chat_id: str, image_data: bytes, priority: int) -> {str}:
+        if image_data == b"broken":
+            raise BadRequest("Image_process_failed")
+        return {image_data.decode()}
+
+    def _get_file_ids(self, entity_id: int) -> [str]:
+        return list(map(lambda x: x.id, self.persistence.images[entity_id].telegram_file_ids))
+
+    def test_media_group(self):
+        self.persistence.image_data[2] = b"second"
+        with patch("infinitewisdom.uploader.send_media_group",
+                   side_effect=lambda images, **kwargs: list(map(lambda x: {x.decode()}, images))) as send:
+            self.uploader._run()
+
+        # all images are sent in a single media group
+        self.assertEqual(1, send.call_count)
+        self.assertEqual(["first"], self._get_file_ids(1))
+        self.assertEqual(["second"], self._get_file_ids(2))
+        self.assertEqual(["third"], self._get_file_ids(3))
+        self.assertEqual(set(), self.uploader._not_uploaded_ids)
+
+    def test_single_photo(self):
+        self.uploader._not_uploaded_ids = {3}
+        with patch("infinitewisdom.uploader.send_photo",
+                   side_effect=lambda image_data, **kwargs: {image_data.decode()}):
+            self.uploader._run()
+
+        self.assertEqual(["third"], self._get_file_ids(3))
+        self.assertEqual(set(), self.uploader._not_uploaded_ids)
+
+    def test_failed_media_group_falls_back_to_single_photos(self):
+        with patch("infinitewisdom.uploader.send_media_group", side_effect=BadRequest("Image_process_failed")), \
+                patch("infinitewisdom.uploader.send_photo", side_effect=self._send_photo):
+            self.uploader._run()
+
+        self.assertEqual(["first"], self._get_file_ids(1))
+        self.assertEqual(["third"], self._get_file_ids(3))
+        # only the broken image is queued again
+        self.assertEqual([], self._get_file_ids(2))
+        self.assertEqual({2}, self.uploader._not_uploaded_ids)
+
+    def test_failed_upload_is_queued_again(self):
+        with patch("infinitewisdom.uploader.send_media_group", side_effect=NetworkError("Timed out")), \
+                patch("infinitewisdom.uploader.send_photo", side_effect=NetworkError("Timed out")):
+            self.uploader._run()
+
+        self.assertEqual({1, 2, 3}, self.uploader._not_uploaded_ids)
+        for entity_id in [1, 2, 3]:
+            self.assertEqual([], self._get_file_ids(entity_id))
+
+    def test_retry_after_queues_images_again(self):
+        with patch("infinitewisdom.uploader.send_media_group", side_effect=RetryAfter(30)), \
+                patch("infinitewisdom.uploader.time") as time_mock:
+            self.uploader._run()
+
+        self.assertEqual({1, 2, 3}, self.uploader._not_uploaded_ids)
+        for entity_id in [1, 2, 3]:
+            self.assertEqual([], self._get_file_ids(entity_id))
+        # the rate limiter has already waited, so the uploader doesn't wait on its own
+        time_mock.sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
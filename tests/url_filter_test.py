@@ -0,0 +1,79 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+import unittest
+
+from infinitewisdom.url_filter import BloomFilter
+
+
+class BloomFilterTests(unittest.TestCase):
+    """
+    Tests for the crawler url filter
+    """
+
+    def setUp(self):
+        self.urls = ["https://generated.inspirobot.me/a/{}.jpg".format(i) for i in range(1000)]
+        self.bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        for url in self.urls:
+            self.bloom_filter.add(url)
+
+    def test_no_false_negatives(self):
+        # urls that were false positives while adding them are not counted
+        self.assertGreater(len(self.bloom_filter), 980)
+        for url in self.urls:
+            self.assertIn(url, self.bloom_filter)
+
+    def test_false_positive_rate(self):
+        false_positives = sum(1 for i in range(10000) if "https://other/{}.jpg".format(i) in self.bloom_filter)
+        self.assertLess(false_positives / 10000, 0.03)
+        self.assertAlmostEqual(0.01, self.bloom_filter.get_false_positive_rate(), delta=0.005)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "filter.bin")
+            self.bloom_filter.save(file_path, 123.0)
+            loaded, timestamp = BloomFilter.load(file_path)
+
+        self.assertEqual(123.0, timestamp)
+        self.assertEqual(len(self.bloom_filter), len(loaded))
+        for url in self.urls:
+            self.assertIn(url, loaded)
+
+    def test_concurrent_saves(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "filter.bin")
+            threads = [threading.Thread(target=self.bloom_filter.save, args=(file_path, float(i))) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            loaded, timestamp = BloomFilter.load(file_path)
+            # no temporary files are left behind
+            self.assertEqual(["filter.bin"], os.listdir(temp_dir))
+
+        self.assertIsNotNone(loaded)
+        self.assertEqual(len(self.bloom_filter), len(loaded))
+
+    def test_load_missing_file(self):
+        self.assertEqual((None, None), BloomFilter.load("/does/not/exist"))
+
+
+if __name__ == '__main__':
+    unittest.main()